@@ -16,5 +16,9 @@ setup(
     package_data={"": ["data/*"]},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={"numba": ["numba"]},
+    entry_points={
+        "console_scripts": ["ucam-thruput=ucam_thruput.cli:main"],
+    },
     zip_safe=False,
 )
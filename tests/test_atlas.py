@@ -0,0 +1,59 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.atlas import AtlasIndex
+
+
+def _index():
+    nan = np.nan
+    return AtlasIndex(
+        atlas=['pickles', 'pickles', 'pickles', 'ck04models'],
+        sptype=['G2V', 'K0III', 'M5I', ''],
+        teff=[5800.0, nan, nan, 5750.0],
+        logg=[nan, nan, nan, 4.5],
+        feh=[nan, nan, nan, 0.0],
+        path=['a.fits', 'b.fits', 'c.fits', 'd.fits'],
+        ext=[1, 1, 1, 1],
+        column=['FLUX', 'FLUX', 'FLUX', 'g45'],
+    )
+
+
+def test_query_keeps_entries_without_teff():
+    index = _index()
+    assert len(index.query(atlas='pickles')) == 3
+    assert len(index.query()) == 4
+    assert sorted(index.sptype[index.query(atlas='pickles')]) == ['G2V', 'K0III', 'M5I']
+
+
+def test_query_teff_range():
+    index = _index()
+    rows = index.query(teff=(5700, 5900))
+    assert sorted(index.atlas[rows]) == ['ck04models', 'pickles']
+    assert len(index.query(atlas='pickles', teff=(5000, 6000))) == 1
+
+
+def test_nearest_skips_entries_without_values():
+    nan = np.nan
+    index = AtlasIndex(
+        atlas=['kurucz'] * 4 + ['pickles'] * 2,
+        sptype=[''] * 4 + ['K0III', 'M5I'],
+        teff=[6000.0, 6000.0, 7000.0, 7000.0, nan, nan],
+        logg=[4.0, nan, nan, nan, nan, nan],
+        feh=[nan, 0.0, nan, nan, nan, nan],
+        path=['a', 'b', 'c', 'd', 'e', 'f'],
+        ext=[1] * 6,
+        column=['FLUX'] * 6,
+    )
+    row = index.nearest('kurucz', 6100.0, logg=4.5)
+    assert (index.teff[row], index.logg[row]) == (6000.0, 4.0)
+    # entries without a Teff are never nearest
+    assert index.teff[index.nearest('kurucz', 9000.0)] == 7000.0
+    with pytest.raises(ValueError, match='have a log g'):
+        index.nearest('kurucz', 7000.0, logg=4.5)
+    with pytest.raises(ValueError, match=r'have a \[Fe/H\]'):
+        index.nearest('kurucz', 7000.0, feh=0.0)
+    with pytest.raises(ValueError, match='have a Teff'):
+        index.nearest('pickles', 5000.0)
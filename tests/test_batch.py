@@ -0,0 +1,44 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput import kernels
+from ucam_thruput.bandpass import DEFAULT_WAVESET, obsmode_area, throughput_stack
+from ucam_thruput.batch import evaluate
+from ucam_thruput.photometry import countrate
+from ucam_thruput.spectra import from_spec
+
+
+def test_missing_magnitudes_left_unscaled():
+    specs = ['bb:5000', 'bb:6000', 'bb:7000']
+    obsmodes = ['ucam,wht,g'] * 3
+    countrate, abmag = evaluate(specs, obsmodes, mags=[18.0, np.nan, 17.0])
+    raw_rate, raw_mag = evaluate(specs, obsmodes)
+
+    np.testing.assert_allclose(abmag[[0, 2]], [18.0, 17.0])
+    assert countrate[1] == raw_rate[1]
+    assert abmag[1] == raw_mag[1]
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_file_spectra_match_resampled(tmpdir, backend):
+    if backend == 'numba':
+        pytest.importorskip('numba')
+    # unevenly tabulated, and narrower than the default waveset
+    wave = np.sort(np.random.default_rng(2).uniform(3000.0, 9000.0, 700))
+    filename = str(tmpdir.join('spectrum.dat'))
+    np.savetxt(filename, np.column_stack((wave, 1e-16 * (1 + np.sin(wave / 300.0)**2))))
+    spec = 'file:' + filename
+    obsmodes = ['ucam,wht,u', 'ucam,wht,g', 'ucam,wht,r', 'ucam,wht,i', 'ucam,wht,z']
+    expected = countrate(from_spec(spec), throughput_stack(obsmodes), DEFAULT_WAVESET,
+                         [obsmode_area(obsmode) for obsmode in obsmodes])
+
+    previous = kernels.get_backend().name
+    kernels.set_backend(backend)
+    try:
+        rate, _ = evaluate([spec] * len(obsmodes) + ['bb:5000'], obsmodes + ['ucam,wht,g'])
+    finally:
+        kernels.set_backend(previous)
+    np.testing.assert_allclose(rate[:-1], expected, rtol=1e-10)
@@ -0,0 +1,102 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput import components
+from ucam_thruput.bandpass import DEFAULT_WAVESET, obsmode_area, throughput
+from ucam_thruput.calibrate import ForwardModel, fit_throughputs, write_fitted_curves
+from ucam_thruput.photometry import countrate
+from ucam_thruput.spectra import blackbody
+
+OBSMODES = ['ucam,wht,g', 'ucam,wht,r', 'ucam,wht,i']
+TEMPERATURES = [3500.0, 5000.0, 7000.0, 10000.0, 20000.0]
+
+
+@pytest.fixture
+def version_dir(tmpdir, monkeypatch):
+    # saved versions go to a temporary directory, and are forgotten afterwards
+    monkeypatch.setattr(components, '_version_dir', lambda: str(tmpdir))
+    monkeypatch.setattr(components, '_DIGESTS', {})
+    return tmpdir
+
+
+def _observations():
+    obsmodes = [obsmode for obsmode in OBSMODES for _ in TEMPERATURES]
+    flux = np.array([blackbody(teff) for _ in OBSMODES for teff in TEMPERATURES])
+    return obsmodes, flux
+
+
+def _countrates(obsmodes, flux):
+    return np.array([
+        countrate(f, throughput(obsmode, cache=False), DEFAULT_WAVESET, obsmode_area(obsmode))
+        for obsmode, f in zip(obsmodes, flux)
+    ])
+
+
+def test_fit_recovers_perturbed_curves(version_dir):
+    obsmodes, flux = _observations()
+    # the two scales are not degenerate, as only g passes through ucam_ccd_grn
+    free = {'ucam_ccd_grn': ('scale',), 'ucam_dich2_trans': ('scale', 'shift')}
+    truth = {('ucam_ccd_grn', 'scale'): 0.92, ('ucam_dich2_trans', 'scale'): 1.04,
+             ('ucam_dich2_trans', 'shift'): 12.5}
+
+    # observe through perturbed versions of the curves, then go back to the originals
+    for name in free:
+        wave, thru = components.load_component(name)
+        components.write_version(name, wave + truth.get((name, 'shift'), 0.0),
+                                 truth[(name, 'scale')] * thru)
+    observed = _countrates(obsmodes, flux)
+    for filename in version_dir.listdir():
+        filename.remove()
+    components._DIGESTS.clear()
+
+    fit = fit_throughputs(obsmodes, flux, observed, free=free)
+    for parameter, value in zip(fit.parameters, fit.values):
+        tol = 0.05 if parameter[1] == 'shift' else 1e-3
+        assert value == pytest.approx(truth[parameter], abs=tol)
+    np.testing.assert_allclose(fit.model, observed, rtol=1e-4)
+
+
+def test_jacobian_matches_finite_differences():
+    obsmodes, flux = _observations()
+    # alum appears twice in every obsmode
+    free = {'alum': ('scale', 'shift'), 'ucam_dich2_trans': ('scale', 'shift'),
+            'ucam_ccd_red': ('scale',)}
+    model = ForwardModel(obsmodes, flux, free)
+    values = {'scale': [0.9, 1.1, 0.95], 'shift': [3.4, -7.3]}
+    params = np.array([values[kind].pop(0) for _, kind in model.parameters])
+
+    jacobian = model.jacobian(params)
+    for j in range(len(params)):
+        # shifts are linear between grid points, so stay within one
+        h = 1e-3 if model.parameters[j][1] == 'shift' else 1e-6
+        up, down = params.copy(), params.copy()
+        up[j] += h
+        down[j] -= h
+        expected = (model(up) - model(down)) / (2 * h)
+        np.testing.assert_allclose(jacobian[:, j], expected, rtol=1e-6,
+                                   atol=1e-9 * np.max(np.abs(expected)))
+
+
+def test_fitted_curves_round_trip(version_dir):
+    obsmodes, flux = _observations()
+    free = {'ucam_dich2_trans': ('scale', 'shift')}
+    model = ForwardModel(obsmodes, flux, free)
+    observed = model(np.array([0.97, 6.0]))
+    fit = model.fit(observed)
+
+    filenames = write_fitted_curves(model, fit)
+    assert list(filenames) == ['ucam_dich2_trans']
+    assert components.component_versions('ucam_dich2_trans') == [filenames['ucam_dich2_trans']]
+    with open(filenames['ucam_dich2_trans']) as f:
+        header = f.readline()
+    assert header.startswith('# ucam_dich2_trans version')
+
+    wave, thru = components.load_component('ucam_dich2_trans')
+    expected_wave, expected_thru = model.fitted_curves(fit.values)['ucam_dich2_trans']
+    np.testing.assert_array_equal(wave, expected_wave)
+    np.testing.assert_array_equal(thru, expected_thru)
+    # the saved version is used for the obsmodes from then on
+    np.testing.assert_allclose(_countrates(obsmodes, flux), observed, rtol=1e-4)
@@ -0,0 +1,18 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import pytest
+
+from ucam_thruput.cli import main
+
+
+def test_errors_are_reported_as_usage(tmpdir, capsys):
+    table = tmpdir.join('targets.csv')
+    table.write('teff\n5000\n')
+    with pytest.raises(SystemExit) as info:
+        main(['photometry', str(table), '--quiet'])
+    assert info.value.code == 2
+    err = capsys.readouterr().err
+    assert err.startswith('usage: ucam-thruput')
+    assert 'No obsmode column or --obsmode option' in err
+    assert 'Traceback' not in err
@@ -0,0 +1,46 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput import compact
+from ucam_thruput.bandpass import DEFAULT_WAVESET, obsmode_area, throughput
+from ucam_thruput.compact import BandpassSet, CompactBandpass
+from ucam_thruput.photometry import countrate
+from ucam_thruput.spectra import blackbody
+
+OBSMODES = ['ucam,wht,u', 'ucam,wht,g', 'hcam,gtc,z_s', 'ucam,wht,ha_narrow']
+
+
+@pytest.mark.parametrize('obsmode', OBSMODES)
+def test_single_precision_within_tolerance(obsmode):
+    bandpass = CompactBandpass.from_obsmode(obsmode)
+    full = throughput(obsmode)
+    assert bandpass.thru.dtype == np.float32
+    assert np.max(np.abs(bandpass() - full)) <= compact.THRU_RTOL * np.max(full)
+    # nothing non-zero is left out
+    assert not np.any(full[:bandpass.start]) and not np.any(full[bandpass.stop:])
+
+
+def test_lossy_storage_is_rejected(monkeypatch):
+    with pytest.raises(ValueError, match='float16'):
+        CompactBandpass.from_obsmode('ucam,wht,g', dtype=np.float16)
+    monkeypatch.setattr(compact, 'THRU_RTOL', 1e-12)
+    with pytest.raises(ValueError, match='float32'):
+        CompactBandpass.from_obsmode('ucam,wht,g')
+    # double precision is not checked
+    CompactBandpass.from_obsmode('ucam,wht,g', dtype=np.float64)
+
+
+@pytest.mark.parametrize('airmass', [None, 1.8])
+def test_countrates_match_full_throughput(airmass):
+    bandpasses = BandpassSet(OBSMODES, airmasses=[airmass])
+    flux = np.array([blackbody(teff) for teff in (3000.0, 6000.0, 20000.0)])
+    for obsmode in OBSMODES:
+        expected = countrate(flux, throughput(obsmode, airmass=airmass), DEFAULT_WAVESET,
+                             obsmode_area(obsmode))
+        # a zeropoint error of ZEROPOINT_ATOL mag is about as large a fraction of the rate
+        np.testing.assert_allclose(bandpasses[obsmode].countrate(flux), expected,
+                                   rtol=compact.ZEROPOINT_ATOL)
+    assert bandpasses.nbytes < len(OBSMODES) * throughput(OBSMODES[0]).nbytes
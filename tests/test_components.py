@@ -0,0 +1,41 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import ucam_thruput
+from ucam_thruput import components
+
+
+def test_identical_curves_share_one_file(tmpdir, monkeypatch):
+    monkeypatch.setenv('PYSYN_CDBS', str(tmpdir))
+    nonhst = tmpdir.mkdir('comp').mkdir('nonhst')
+    ucam_thruput._install_throughput_files()
+    installed = set(path.basename for path in nonhst.listdir())
+    groups = components.unique_components()
+    assert len(installed) == len(groups)
+
+    itable = ucam_thruput._make_instrument_reference_table()
+    table = ucam_thruput._make_component_table(itable)
+    filenames = {
+        row['COMPNAME']: row['FILENAME'].split('$')[1] for row in table
+        if row['COMPNAME'] != components.CLEAR
+    }
+    # every component with a curve points to an installed file
+    for name, filename in filenames.items():
+        if components.component_file(name).is_file():
+            assert filename in installed
+    for names in groups.values():
+        used = set(filenames[name] for name in names if name in filenames)
+        assert len(used) <= 1
+    assert filenames['hcam_coll_gtc'] == filenames['hcam_coll_wht'] == 'hcam_coll_gtc.txt'
+
+
+def test_canonical_names_are_cached(monkeypatch):
+    components.canonical_name('hcam_coll_wht')
+
+    def component_names():
+        raise AssertionError("packaged components listed again")
+
+    # later lookups use the groups found by the first
+    monkeypatch.setattr(components, 'component_names', component_names)
+    assert components.canonical_name('hcam_coll_wht') == 'hcam_coll_gtc'
+    assert components.canonical_name('hcam_win_red') == 'hcam_win_blu'
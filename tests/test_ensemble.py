@@ -0,0 +1,34 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+from ucam_thruput.bandpass import obsmode_components
+from ucam_thruput.ensemble import Uncertainty, ensemble_photometry
+
+
+def _grey_only(obsmode, name, sigma):
+    uncertainties = {
+        component: Uncertainty(0.0, 0.0, 0.0) for component in obsmode_components(obsmode)
+    }
+    uncertainties[name] = Uncertainty(sigma, 0.0, 0.0)
+    return uncertainties
+
+
+def test_repeated_components_independent():
+    obsmode = 'ucam,wht,g'
+    n_alum = obsmode_components(obsmode).count('alum')
+    assert n_alum > 1
+    sigma = 0.01
+    result = ensemble_photometry(obsmode, 20000, uncertainties=_grey_only(obsmode, 'alum', sigma))
+    # each mirror contributes sigma**2 to the variance of the log throughput
+    variance = np.var(result.zeropoint / (2.5 / np.log(10)))
+    np.testing.assert_allclose(variance, n_alum * sigma**2, rtol=0.05)
+
+
+def test_shared_components_correlated():
+    # the same mirrors are drawn identically in different obsmodes
+    g = ensemble_photometry('ucam,wht,g', 500, uncertainties=_grey_only('ucam,wht,g', 'alum', 0.01))
+    r = ensemble_photometry('ucam,wht,r', 500, uncertainties=_grey_only('ucam,wht,r', 'alum', 0.01))
+    np.testing.assert_allclose(g.zeropoint - g.zeropoint.mean(), r.zeropoint - r.zeropoint.mean(),
+                               atol=1e-10)
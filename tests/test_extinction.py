@@ -0,0 +1,61 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.bandpass import DEFAULT_WAVESET, throughput
+from ucam_thruput.extinction import colour_obsmodes, extinction_table
+from ucam_thruput.photometry import abmag, countrate
+from ucam_thruput.spectra import flat
+
+OBSMODES = ['ucam,wht,u', 'ucam,wht,g', 'ucam,wht,r', 'ucam,wht,ha_narrow']
+SPECS = ['pl:{}'.format(index) for index in (-3.0, -1.5, 0.0, 1.5, 3.0)]
+
+
+@pytest.fixture(scope='module')
+def table():
+    return extinction_table(OBSMODES, SPECS)
+
+
+def _loss(flux, obsmode, airmass):
+    # magnitudes lost to the atmosphere, measured directly
+    rate = countrate(flux, throughput(obsmode, airmass=airmass, cache=False), DEFAULT_WAVESET, 1.0)
+    above = countrate(flux, throughput(obsmode + ',noatmos'), DEFAULT_WAVESET, 1.0)
+    return -2.5 * np.log10(rate / above)
+
+
+def _colour(flux, obsmode):
+    g, r = colour_obsmodes(obsmode)
+    return (abmag(flux, throughput(g), DEFAULT_WAVESET)
+            - abmag(flux, throughput(r), DEFAULT_WAVESET))
+
+
+@pytest.mark.parametrize('obsmode', OBSMODES)
+def test_flat_spectrum_has_no_colour_term(table, obsmode):
+    # a flat spectrum has zero colour, so loses k' X alone
+    flux = flat()
+    assert _colour(flux, obsmode) == pytest.approx(0.0, abs=1e-10)
+    for airmass in (1.0, 2.0, 3.0):
+        assert _loss(flux, obsmode, airmass) == pytest.approx(
+            airmass * table[obsmode].k1, abs=3 * table[obsmode].rms + 1e-6
+        )
+
+
+def test_narrow_band_has_no_colour_term(table):
+    # extinction hardly changes across a narrow band, so colour does not matter
+    assert abs(table['ucam,wht,ha_narrow'].k2) < 1e-3 * table['ucam,wht,ha_narrow'].k1
+
+
+@pytest.mark.parametrize('obsmode', ['ucam,wht,g', 'ucam,wht,r'])
+def test_reddened_spectrum_recovers_colour_term(table, obsmode):
+    # reddening a flat spectrum moves light to the red side of the band, where
+    # extinction is lower, so redder stars lose less and k'' is negative
+    airmass = 2.0
+    flux = flat()
+    reddened = flux * 10**(-0.4 * 0.5 * (5500.0 / DEFAULT_WAVESET - 1))
+    colour = _colour(reddened, obsmode)
+    assert colour > 0.1
+    k2 = (_loss(reddened, obsmode, airmass) - _loss(flux, obsmode, airmass)) / (airmass * colour)
+    assert k2 < 0
+    assert table[obsmode].k2 == pytest.approx(k2, rel=0.2)
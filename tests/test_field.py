@@ -0,0 +1,41 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.bandpass import DEFAULT_WAVESET, throughput
+from ucam_thruput.field import field_throughput, shift_factor
+
+
+def _half_max_edges(thru):
+    # wavelengths at which a single-peaked bandpass crosses half its peak
+    above = np.flatnonzero(thru >= 0.5 * thru.max())
+    lo, hi = above[0], above[-1]
+    half = 0.5 * thru.max()
+    blue = np.interp(half, thru[lo - 1:lo + 1], DEFAULT_WAVESET[lo - 1:lo + 1])
+    red = np.interp(half, thru[hi + 1:hi - 1:-1], DEFAULT_WAVESET[hi + 1:hi - 1:-1])
+    return np.array([blue, red])
+
+
+@pytest.mark.parametrize('obsmode', ['hcam,gtc,g', 'ucam,wht,ha_narrow', 'uspec,tnt,r'])
+def test_on_axis_matches_throughput(obsmode):
+    np.testing.assert_array_equal(field_throughput(obsmode, 0.0), throughput(obsmode))
+
+
+def test_off_axis_shifts_filter_edges():
+    obsmode = 'ucam,wht,ha_narrow'
+    angles = np.array([0.0, 5.0, 10.0, 15.0])
+    thru = field_throughput(obsmode, angles)
+    on_axis = _half_max_edges(thru[0])
+    for angle, curve in zip(angles[1:], thru[1:]):
+        edges = _half_max_edges(curve)
+        assert np.all(edges < on_axis)
+        np.testing.assert_allclose(edges / on_axis, shift_factor(angle), atol=1e-4)
+
+
+def test_blocks_of_angles():
+    angles = np.linspace(0.0, 12.0, 15).reshape(3, 5)
+    thru = field_throughput('hcam,gtc,r', angles, block_size=4)
+    assert thru.shape == (3, 5, len(DEFAULT_WAVESET))
+    np.testing.assert_array_equal(thru[1, 2], field_throughput('hcam,gtc,r', angles[1, 2]))
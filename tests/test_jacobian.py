@@ -0,0 +1,57 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.bandpass import DEFAULT_WAVESET, component_stack, obsmode_area
+from ucam_thruput.jacobian import magnitude_gradients, polynomial_basis, shift_basis
+from ucam_thruput.photometry import abmag, countrate
+from ucam_thruput.spectra import blackbody
+
+# alum appears twice in the chain
+OBSMODE = 'ucam,wht,g'
+
+
+def _magnitude(flux, curves, kind):
+    thru = np.prod(curves, axis=0)
+    if kind == 'abmag':
+        return abmag(flux, thru, DEFAULT_WAVESET)
+    return -2.5 * np.log10(countrate(flux, thru, DEFAULT_WAVESET, obsmode_area(OBSMODE)))
+
+
+@pytest.fixture(scope='module')
+def flux():
+    return np.array([blackbody(4000.0), blackbody(15000.0)])
+
+
+@pytest.mark.parametrize('kind', ['instrumental', 'abmag'])
+def test_polynomial_basis_matches_finite_differences(flux, kind):
+    basis = polynomial_basis(OBSMODE, 2)
+    result = magnitude_gradients(flux, OBSMODE, basis, kind)
+    _, curves = component_stack(OBSMODE)
+    np.testing.assert_allclose(result.mag, _magnitude(flux, curves, kind), rtol=1e-12)
+
+    h = 1e-5
+    for c in range(len(curves)):
+        for p in range(basis.shape[1]):
+            up, down = curves.copy(), curves.copy()
+            up[c] += h * basis[c, p]
+            down[c] -= h * basis[c, p]
+            expected = (_magnitude(flux, up, kind) - _magnitude(flux, down, kind)) / (2 * h)
+            np.testing.assert_allclose(result.gradient[:, c, p], expected, rtol=1e-6, atol=1e-9)
+
+
+@pytest.mark.parametrize('kind', ['instrumental', 'abmag'])
+def test_shift_basis_matches_finite_differences(flux, kind):
+    result = magnitude_gradients(flux, OBSMODE, shift_basis(OBSMODE), kind)
+    _, curves = component_stack(OBSMODE)
+
+    # shift each curve by interpolation, well within one grid step
+    h = 1e-3
+    for c in range(len(curves)):
+        up, down = curves.copy(), curves.copy()
+        up[c] = np.interp(DEFAULT_WAVESET - h, DEFAULT_WAVESET, curves[c])
+        down[c] = np.interp(DEFAULT_WAVESET + h, DEFAULT_WAVESET, curves[c])
+        expected = (_magnitude(flux, up, kind) - _magnitude(flux, down, kind)) / (2 * h)
+        np.testing.assert_allclose(result.gradient[:, c, 0], expected, rtol=1e-5, atol=1e-9)
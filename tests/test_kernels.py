@@ -0,0 +1,82 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput import kernels
+from ucam_thruput.bandpass import DEFAULT_WAVESET, band, obsmode_area, throughput
+from ucam_thruput.photometry import abmag, countrate
+
+pytest.importorskip('numba')
+
+
+@pytest.fixture(scope='module')
+def backends():
+    return kernels.NumpyBackend(), kernels.NumbaBackend()
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(1)
+    waveset = np.linspace(3000.0, 10000.0, 2000)
+    wave = np.sort(rng.uniform(2500.0, 10500.0, 900))
+    return dict(
+        waveset=waveset, wave=wave,
+        flux=rng.uniform(0.0, 1.0, (30, len(wave))),
+        a=rng.uniform(0.0, 1.0, (30, len(waveset))),
+        b=rng.uniform(0.0, 1.0, (12, len(waveset))),
+    )
+
+
+def test_inner(backends, data):
+    reference, numba = backends
+    np.testing.assert_allclose(numba.inner(data['a'], data['b']),
+                               reference.inner(data['a'], data['b']), rtol=1e-12)
+
+
+@pytest.mark.parametrize('shape_a, shape_b', [
+    ((30,), (30,)), ((30,), (1,)), ((1,), (12,)), ((5, 1), (1, 12)), ((2, 3, 4), (3, 1)),
+])
+def test_paired_inner(backends, data, shape_a, shape_b):
+    reference, numba = backends
+    n_wave = len(data['waveset'])
+    a = np.resize(data['a'], shape_a + (n_wave,))
+    b = np.resize(data['b'], shape_b + (n_wave,))
+    expected = reference.paired_inner(a, b)
+    result = numba.paired_inner(a, b)
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('n_bands', [2, kernels.NumbaBackend.max_fused, 12])
+def test_interp_inner(backends, data, n_bands):
+    # few bandpasses use the fused kernel, more interpolate a block at a time
+    reference, numba = backends
+    args = (data['wave'], data['flux'], data['b'][:n_bands], data['waveset'])
+    np.testing.assert_allclose(numba.interp_inner(*args, block_size=7),
+                               reference.interp_inner(*args, block_size=7), rtol=1e-12)
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'])
+def test_photometry_matches_synphot(backend):
+    import astropy.units as u
+    import synphot as syn
+
+    obsmode = 'ucam,wht,g'
+    waveset = DEFAULT_WAVESET
+    spectrum = syn.SourceSpectrum(syn.BlackBodyNorm1D, temperature=5000)
+    obs = syn.Observation(spectrum, band(obsmode), binset=waveset, force='taper')
+    area = obsmode_area(obsmode)
+    flux = spectrum(waveset).value
+
+    previous = kernels.get_backend().name
+    kernels.set_backend(backend)
+    try:
+        rate = countrate(flux, throughput(obsmode), waveset, area)
+        mag = abmag(flux, throughput(obsmode), waveset)
+    finally:
+        kernels.set_backend(previous)
+    expected = obs.countrate(area=area * u.cm**2, binned=False, wavelengths=waveset).value
+    np.testing.assert_allclose(rate, expected, rtol=1e-8)
+    np.testing.assert_allclose(mag, obs.effstim(u.ABmag, wavelengths=waveset).value, atol=1e-8)
@@ -0,0 +1,42 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.bandpass import DEFAULT_WAVESET, band, obsmode_area
+from ucam_thruput.lines import C_KMS, doppler_factor, line_photometry
+
+OBSMODE = 'ucam,wht,ha_narrow'
+
+
+def _synphot_rate(wave, flux, fwhm):
+    import astropy.units as u
+    import synphot as syn
+    line = syn.SourceSpectrum(syn.GaussianFlux1D, mean=wave, fwhm=wave * fwhm / C_KMS,
+                              total_flux=flux * u.erg / u.s / u.cm**2)
+    obs = syn.Observation(line, band(OBSMODE), binset=DEFAULT_WAVESET, force='taper')
+    return obs.countrate(area=obsmode_area(OBSMODE) * u.cm**2).value
+
+
+def test_line_matches_synphot():
+    result = line_photometry([[6562.8, 1e-14, 500.0]], [OBSMODE], [0.0])
+    assert result.line[0, 0] == pytest.approx(_synphot_rate(6562.8, 1e-14, 500.0), rel=1e-3)
+
+
+def test_velocity_moves_line_across_band_edge():
+    # the band is centred on H alpha at about 2600 km/s, and at 0 km/s the line is on its edge
+    velocities = np.array([-3000.0, 0.0, 1200.0, 2600.0, 8000.0])
+    result = line_photometry([[6562.8, 1e-14, 300.0]], [OBSMODE], velocities)
+    expected = [_synphot_rate(6562.8 * factor, 1e-14, 300.0) for factor in doppler_factor(velocities)]
+    np.testing.assert_allclose(result.line[:, 0], expected, rtol=2e-3, atol=1e-3 * max(expected))
+    # shifted well outside the narrow band the line is lost
+    assert result.line[0, 0] < 0.01 * result.line[3, 0]
+    assert result.line[-1, 0] < 0.01 * result.line[3, 0]
+
+
+def test_continuum_scaled_to_magnitude():
+    result = line_photometry([[6562.8, 1e-14, 500.0]], [OBSMODE], [0.0], continuum='flat',
+                             continuum_mag=18.0, norm_obsmode=OBSMODE)
+    unscaled = line_photometry([[6562.8, 1e-14, 500.0]], [OBSMODE], [0.0], continuum='flat')
+    assert result.continuum[0] == pytest.approx(unscaled.continuum[0] * 10**(-0.4 * 18.0))
@@ -0,0 +1,63 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import itertools
+
+import numpy as np
+import pytest
+
+from ucam_thruput.planning import DEAD_TIME, MULTIPLIED_ARMS, plan_exposures
+
+
+def _brute_force_front(instrument, telescope, filters, exposures, multipliers, **kwargs):
+    # signal-to-noise of every arm, filter, multiplier and exposure time, from
+    # plans with a single option for each arm
+    n_filters = len(next(iter(filters.values())))
+    snr = {}
+    for j in range(n_filters):
+        for m in multipliers:
+            for t in exposures:
+                plans = plan_exposures(instrument, telescope, filters={
+                    arm: [names[j]] for arm, names in filters.items()
+                }, exposures=[t], multipliers=[m], **kwargs)
+                assert len(plans.exposure) == 1
+                for arm, name, value in zip(plans.arms, plans.filters[0], plans.snr[0]):
+                    snr[arm, name, m, t] = value
+
+    # every configuration, and the objectives to be minimised
+    arms = plans.arms
+    choices = [[(name, m) for name in filters[arm]
+                for m in (multipliers if arm in MULTIPLIED_ARMS[instrument] else [1])]
+               for arm in arms]
+    points = []
+    for t in exposures:
+        for config in itertools.product(*choices):
+            values = np.array([snr[arm, name, m, t] for arm, (name, m) in zip(arms, config)])
+            cadence = max(m for _, m in config) * (t + DEAD_TIME[instrument])
+            points.append((cadence, -values.min(), values.max() / values.min()))
+    points = np.array(points)
+
+    front = set()
+    for point in points:
+        dominated = np.any(np.all(points <= point, axis=1) & np.any(points < point, axis=1))
+        if not dominated:
+            front.add(tuple(np.round(point, 9)))
+    return front
+
+
+@pytest.mark.parametrize('instrument, telescope, filters, multipliers', [
+    ('ucam', 'wht', dict(u=['u', '3500_nb'], g=['g', 'bowen'], riz=['r', 'ha_narrow']),
+     [1, 2, 4]),
+    ('hcam', 'gtc', {arm: [arm, arm + '_s'] for arm in 'ugriz'}, [1, 3]),
+])
+def test_matches_brute_force(instrument, telescope, filters, multipliers):
+    exposures = [0.05, 0.3, 2.0, 10.0]
+    kwargs = dict(spec='bb:6000', mag=17.0, airmass=1.3)
+    expected = _brute_force_front(instrument, telescope, filters, exposures, multipliers,
+                                  **kwargs)
+    plans = plan_exposures(instrument, telescope, filters=filters, exposures=exposures,
+                           multipliers=multipliers, **kwargs)
+    found = {tuple(np.round(point, 9))
+             for point in zip(plans.cadence, -plans.min_snr, plans.imbalance)}
+    assert found == expected
+    assert np.all(np.diff(plans.cadence) >= 0)
@@ -0,0 +1,16 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.redshift import redshift_photometry
+
+
+@pytest.mark.parametrize('index', [0.0, -2.0, 1.5])
+def test_power_law_kcorrection(index):
+    # for F_nu ~ nu**index, K = -2.5 (1 + index) log10(1 + z) in every band
+    result = redshift_photometry('pl:{}'.format(index), ['ucam,wht,g', 'hcam,gtc,r'],
+                                 redshifts=[0.0, 0.5, 1.0, 3.0])
+    expected = -2.5 * (1 + index) * np.log10(1 + result.redshifts)
+    np.testing.assert_allclose(result.kcorr, expected[:, np.newaxis] * np.ones(2), atol=1e-6)
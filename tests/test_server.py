@@ -0,0 +1,86 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import asyncio
+import json
+import socket
+
+import pytest
+
+from ucam_thruput.server import PhotometryServer, PhotometryService
+
+
+@pytest.fixture(scope='module')
+def service():
+    return PhotometryService(telescopes=['wht'])
+
+
+def test_request(service):
+    reply, = service.evaluate([dict(id=1, obsmode='ucam,wht,g', mag=18.0, spectrum=dict(teff=5800))])
+    assert reply['id'] == 1
+    assert reply['abmag'] == 18.0
+    assert reply['countrate'] > 0
+
+
+@pytest.mark.parametrize('request_', [
+    dict(id=2, obsmode='ucam,wht,g'),
+    dict(id=3, obsmode='ucam,wht,g', mag=18.0, spectrum=dict(teff=-5)),
+    dict(id=4, obsmode='ucam,wht,g', mag='nan'),
+])
+def test_bad_requests_give_errors(service, request_):
+    reply, = service.evaluate([request_])
+    assert set(reply) == {'id', 'error'}
+    json.loads(json.dumps(reply, allow_nan=False))
+
+
+def test_batch_matches_single_requests(service):
+    requests = [dict(id=i, obsmode=obsmode, mag=mag, spectrum=spectrum)
+                for i, (obsmode, mag, spectrum) in enumerate(
+                    (obsmode, mag, spectrum)
+                    for obsmode in ('ucam,wht,g', 'ucam,wht,r', 'ucam,wht,g')
+                    for mag in (16.0, 18.0)
+                    for spectrum in (dict(teff=5800), dict(index=-1.0), None, dict(teff=5800)))]
+    batch = service.evaluate(requests)
+    single = [service.evaluate([request])[0] for request in requests]
+    for b, s in zip(batch, single):
+        assert b['id'] == s['id']
+        assert b['countrate'] == pytest.approx(s['countrate'], rel=1e-12)
+
+
+def test_concurrent_requests(service):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = PhotometryServer(service, max_batch=16, batch_window=0.01)
+    obsmodes = ['ucam,wht,u', 'ucam,wht,g', 'ucam,wht,r']
+    requests = [dict(id=i, obsmode=obsmodes[i % 3], mag=18.0, spectrum=dict(teff=4000 + 100 * i))
+                for i in range(60)]
+
+    async def client(request):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        writer.close()
+        return reply
+
+    async def run():
+        task = asyncio.ensure_future(server.serve(port=port))
+        for _ in range(100):
+            try:
+                await client(dict(op='obsmodes'))
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        try:
+            return await asyncio.gather(*[client(request) for request in requests])
+        finally:
+            task.cancel()
+
+    replies = asyncio.run(run())
+    expected = service.evaluate(requests)
+    assert [reply['id'] for reply in replies] == list(range(len(requests)))
+    for reply, exp in zip(replies, expected):
+        assert reply['countrate'] == pytest.approx(exp['countrate'], rel=1e-12)
+    # requests arriving together were evaluated together, in batches of at most 16
+    assert len(requests) / 16 <= server.metrics.batches < len(requests)
@@ -0,0 +1,26 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput import sky
+from ucam_thruput.bandpass import list_obsmodes
+
+GRID = dict(phases=[0.0, 1.0], distances=[30.0, 90.0], airmasses=[1.0, 2.0], cache=False)
+
+
+def test_default_table_covers_every_obsmode():
+    table = sky.sky_table(**GRID)
+    assert table.obsmodes == list_obsmodes()
+    assert np.all(table.counts > 0)
+
+
+def test_unknown_pixel_scale_is_an_error(monkeypatch):
+    scales = dict(sky.PIXEL_SCALES)
+    del scales[('uspec', 'wht')]
+    monkeypatch.setattr(sky, 'PIXEL_SCALES', scales)
+    with pytest.raises(ValueError, match='uspec,wht'):
+        sky.sky_table(['ucam,wht,g', 'uspec,wht,g'], **GRID)
+    with pytest.raises(ValueError, match='uspec,wht'):
+        sky.sky_table(**GRID)
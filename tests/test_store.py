@@ -0,0 +1,27 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+import pytest
+
+from ucam_thruput.batch import evaluate_grid, sweep
+from ucam_thruput.store import ResultStore
+
+
+def test_repeated_spectra(tmp_path):
+    specs = ['flat', 'bb:5000', 'flat']
+    obsmodes = ['ucam,wht,g', 'ucam,wht,r']
+    store = sweep(str(tmp_path / 'store'), specs, obsmodes, chunk_size=2)
+    countrate, _ = evaluate_grid(specs, obsmodes)
+
+    assert store.shape == (3, 2, 1)
+    np.testing.assert_allclose(store.read('countrate'), countrate)
+    # a repeated label selects every spectrum with that label
+    np.testing.assert_allclose(store.read('countrate', spectra=['flat']), countrate[[0, 2]])
+    np.testing.assert_allclose(store.read('countrate', spectra=['bb:5000'], obsmodes=['ucam,wht,r']),
+                               countrate[[1]][:, [1]])
+
+
+def test_repeated_obsmodes_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ResultStore.create(str(tmp_path / 'store'), ['flat'], ['ucam,wht,g', 'ucam,wht,g'])
@@ -0,0 +1,60 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from ucam_thruput.batch import evaluate_grid, sweep
+from ucam_thruput.workqueue import merge_results, plan_sweep, queue_status
+
+
+def test_workers_and_merge(tmp_path):
+    queue = str(tmp_path / 'queue')
+    # catalogue spectra repeat, as they do in real target lists
+    specs = ['bb:{:.1f}'.format(teff) for teff in np.repeat([3000, 5000, 8000, 12000, 20000], 10)]
+    obsmodes = ['ucam,wht,u', 'ucam,wht,g', 'hcam,gtc,z']
+    assert plan_sweep(queue, specs, obsmodes, conditions=['', 'noatmos'], shard_size=7) == 8
+
+    # several worker processes share the queue
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'ucam_thruput.cli', 'worker', queue, '--quiet'])
+        for _ in range(4)
+    ]
+    assert all(worker.wait(timeout=300) == 0 for worker in workers)
+    assert queue_status(queue).done == 8
+
+    store = merge_results(queue, str(tmp_path / 'store'))
+    countrate, abmag = evaluate_grid(specs, obsmodes, ['', 'noatmos'])
+    assert store.shape == (50, 3, 2)
+    np.testing.assert_allclose(store.read('countrate'), countrate)
+    np.testing.assert_allclose(store.read('abmag'), abmag)
+
+
+def test_blank_magnitudes(tmp_path):
+    # targets without a mag are left unscaled, not turned into NaN
+    table = tmp_path / 'targets.csv'
+    table.write_text('teff,mag\n5000,18.0\n6000,\n')
+    queue = str(tmp_path / 'queue')
+    cli = [sys.executable, '-m', 'ucam_thruput.cli']
+    subprocess.check_call(cli + ['plan', str(table), queue, '--obsmode', 'ucam,wht,g',
+                                 '--mag-obsmode', 'ucam,wht,g'])
+    subprocess.check_call(cli + ['worker', queue, '--quiet'])
+    store = merge_results(queue, str(tmp_path / 'store'))
+
+    countrate, abmag = evaluate_grid(['bb:6000.0'], ['ucam,wht,g'])
+    result = store.read('abmag')
+    assert result[0, 0, 0] == pytest.approx(18.0)
+    np.testing.assert_allclose(result[1], abmag[0])
+    np.testing.assert_allclose(store.read('countrate')[1], countrate[0])
+
+
+def test_sweep_blank_magnitudes(tmp_path):
+    store = sweep(str(tmp_path / 'store'), ['bb:5000', 'bb:6000'], ['ucam,wht,g'],
+                  mags=[18.0, np.nan], norm_obsmode='ucam,wht,g')
+    _, abmag = evaluate_grid(['bb:6000'], ['ucam,wht,g'])
+    result = store.read('abmag')
+    assert result[0, 0, 0] == pytest.approx(18.0)
+    np.testing.assert_allclose(result[1], abmag[0])
@@ -2,7 +2,7 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import datetime
-import importlib
+import importlib.resources
 import os
 import shutil
 from itertools import chain
@@ -10,6 +10,8 @@ from itertools import chain
 import numpy as np
 from astropy.table import Table
 
+from .components import canonical_name, component_file, unique_components
+
 INSTRUMENT_TABLE_NAME = "ucam_thruput_tmg.fits"
 COMPONENT_TABLE_NAME = "ucam_thruput_tmc.fits"
 # telescope areas in cm**2, corrected for obstructions
@@ -119,9 +121,10 @@ def _install_throughput_files():
             """
         raise ValueError(err_msg)
 
-    resource_dir = importlib.resources.files("ucam_thruput") / "data"
-    for filename in resource_dir.glob("*.txt"):
-        shutil.copy(filename, pysyn_cdbs)
+    # identical curves are only copied once, see _make_component_table
+    for names in unique_components().values():
+        with importlib.resources.as_file(component_file(names[0])) as filename:
+            shutil.copy(filename, pysyn_cdbs)
 
 
 def _make_instrument_reference_table():
@@ -168,12 +171,17 @@ def _make_component_table(itable):
         dtype=(
             np.dtype((str, 26)),
             np.dtype((str, 18)),
-            np.dtype((str, 50)),
+            # room for the names of saved component versions
+            np.dtype((str, 80)),
             np.dtype((str, 68)),
         ),
     )
     components = set(itable["COMPNAME"])
-    filenames = ["crnonhstcomp$" + component + ".txt" for component in components]
+    # components with identical curves all point to the same file
+    filenames = [
+        "crnonhstcomp$" + canonical_name(component) + ".txt"
+        for component in components
+    ]
     now = datetime.datetime.now()
     time_string = now.strftime("%b %d %Y %H:%M:%S").lower()
     for component, filename in zip(components, filenames):
@@ -0,0 +1,372 @@
+"""
+An index of the spectral atlases installed in CDBS.
+
+The Pickles library, and gridded model atlases with a ``catalog.fits``
+(such as ``ck04models``, ``k93models`` and ``phoenix``), are scanned once
+and the spectral type, effective temperature, surface gravity, metallicity,
+file and flux column of every spectrum are saved in the user directory.
+The index is rebuilt automatically if the atlases change.
+
+Entries are sorted by atlas, then Teff, log g and [Fe/H], so that queries
+find the rows for an atlas and a range of temperatures by binary search,
+and only the rows in that range are checked against any other criteria.
+
+Spectra resampled onto a wavelength grid can be saved alongside the index,
+so that commonly used templates are read from a memory-mapped array rather
+than from their FITS files.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET, waveset_key
+from .spectra import PICKLES_MAIN_SEQUENCE, from_file
+
+INDEX_NAME = "atlas_index.npz"
+PICKLES_DIR = os.path.join('grid', 'pickles', 'dat_uvk')
+
+_INDEX = None
+# waveset key -> (row keys, memory-mapped flux)
+_FLUX_CACHE = {}
+
+
+def _cdbs():
+    pysyn_cdbs = os.getenv("PYSYN_CDBS")
+    if pysyn_cdbs is None:
+        raise ValueError("PYSYN_CDBS environment variable is not set")
+    return pysyn_cdbs
+
+
+def _catalogs(pysyn_cdbs):
+    return sorted(glob.glob(os.path.join(pysyn_cdbs, 'grid', '*', 'catalog.fits')))
+
+
+def _signature(pysyn_cdbs):
+    """
+    A hash of the atlas files present, and when they were modified.
+    """
+    sha = hashlib.sha1(pysyn_cdbs.encode())
+    paths = _catalogs(pysyn_cdbs) + [os.path.join(pysyn_cdbs, PICKLES_DIR)]
+    for path in paths:
+        if os.path.exists(path):
+            sha.update('{}:{}'.format(path, os.path.getmtime(path)).encode())
+    return sha.hexdigest()
+
+
+def _scan_pickles(pysyn_cdbs):
+    from astropy.io import fits
+    known = {name: (sptype, teff) for name, sptype, teff in PICKLES_MAIN_SEQUENCE}
+    rows = []
+    for path in sorted(glob.glob(os.path.join(pysyn_cdbs, PICKLES_DIR, '*.fits'))):
+        name = os.path.basename(path)[:-5]
+        if name in known:
+            sptype, teff = known[name]
+        else:
+            with fits.open(path) as hdul:
+                header = hdul[1].header if len(hdul) > 1 else hdul[0].header
+                sptype = str(header.get('SPTYPE', hdul[0].header.get('SPTYPE', ''))).strip()
+            teff = np.nan
+        rows.append(('pickles', sptype, teff, np.nan, np.nan,
+                     os.path.relpath(path, pysyn_cdbs), 1, 'FLUX'))
+    return rows
+
+
+def _scan_catalog(pysyn_cdbs, catalog):
+    from astropy.io import fits
+    atlas_dir = os.path.dirname(catalog)
+    atlas = os.path.basename(atlas_dir)
+    rows = []
+    with fits.open(catalog) as hdul:
+        data = hdul[1].data
+        for index, filename in zip(data['INDEX'], data['FILENAME']):
+            # INDEX is "teff,metallicity,log g" and FILENAME "path[column]"
+            teff, feh, logg = (float(value) for value in index.split(','))
+            path, _, column = filename.strip().partition('[')
+            rows.append((atlas, '', teff, logg, feh,
+                         os.path.relpath(os.path.join(atlas_dir, path), pysyn_cdbs),
+                         1, column.rstrip(']') or 'FLUX'))
+    return rows
+
+
+class AtlasIndex:
+    """
+    Index of spectra in CDBS atlases.
+
+    Parameters
+    ----------
+    atlas, sptype : `~numpy.ndarray`
+        Name of the atlas, and spectral type (empty if unknown), of each entry.
+    teff, logg, feh : `~numpy.ndarray`
+        Effective temperature (K), log surface gravity and metallicity of
+        each entry, NaN if unknown.
+    path : `~numpy.ndarray`
+        FITS file of each entry, relative to ``$PYSYN_CDBS``.
+    ext : `~numpy.ndarray`
+        FITS extension holding each spectrum.
+    column : `~numpy.ndarray`
+        Flux column of each spectrum.
+    signature : string, optional
+        Identifies the state of the atlases the index was built from.
+    """
+    def __init__(self, atlas, sptype, teff, logg, feh, path, ext, column, signature=''):
+        atlas = np.asarray(atlas, dtype=str)
+        teff, logg, feh = (np.asarray(arr, dtype=np.float64) for arr in (teff, logg, feh))
+        order = np.lexsort((feh, logg, teff, atlas))
+        self.atlas = atlas[order]
+        self.sptype = np.asarray(sptype, dtype=str)[order]
+        self.teff = teff[order]
+        self.logg = logg[order]
+        self.feh = feh[order]
+        self.path = np.asarray(path, dtype=str)[order]
+        self.ext = np.asarray(ext, dtype=int)[order]
+        self.column = np.asarray(column, dtype=str)[order]
+        self.signature = signature
+
+        self.atlases = sorted(set(self.atlas.tolist()))
+        self.keys = np.char.add(np.char.add(self.path, '['), np.char.add(self.column, ']'))
+        self._sptypes = {}
+        for row, sptype in enumerate(self.sptype):
+            if sptype:
+                self._sptypes.setdefault(sptype, []).append(row)
+
+    def __len__(self):
+        return len(self.atlas)
+
+    def _atlas_rows(self, atlas):
+        start = np.searchsorted(self.atlas, atlas, side='left')
+        stop = np.searchsorted(self.atlas, atlas, side='right')
+        return start, stop
+
+    def query(self, atlas=None, sptype=None, teff=None, logg=None, feh=None):
+        """
+        Find entries matching all the given criteria.
+
+        Parameters
+        ----------
+        atlas : string, optional
+            Atlas name, e.g ``'pickles'`` or ``'ck04models'``.
+        sptype : string, optional
+            Spectral type, e.g ``'G2V'``.
+        teff, logg, feh : float or tuple, optional
+            A value, or an inclusive ``(min, max)`` range.
+
+        Returns
+        -------
+        rows : `~numpy.ndarray`
+            Indices of the matching entries, in index order.
+        """
+        if sptype is not None:
+            rows = np.array(self._sptypes.get(sptype, []), dtype=int)
+        else:
+            atlases = self.atlases if atlas is None else [atlas]
+            chunks = []
+            for name in atlases:
+                start, stop = self._atlas_rows(name)
+                if teff is not None:
+                    # entries without a Teff (NaN) sort last, and are excluded here
+                    lo, hi = _bounds(teff)
+                    teffs = self.teff[start:stop]
+                    start, stop = (start + np.searchsorted(teffs, lo, side='left'),
+                                   start + np.searchsorted(teffs, hi, side='right'))
+                chunks.append(np.arange(start, stop))
+            rows = np.concatenate(chunks) if chunks else np.array([], dtype=int)
+        mask = np.ones(len(rows), dtype=bool)
+        if atlas is not None:
+            mask &= self.atlas[rows] == atlas
+        for values, bounds in ((self.teff, teff), (self.logg, logg), (self.feh, feh)):
+            if bounds is not None:
+                lo, hi = _bounds(bounds)
+                mask &= (values[rows] >= lo) & (values[rows] <= hi)
+        return rows[mask]
+
+    def nearest(self, atlas, teff, logg=None, feh=None):
+        """
+        The entry of an atlas closest in Teff, then log g, then [Fe/H].
+
+        Returns
+        -------
+        row : int
+        """
+        start, stop = self._atlas_rows(atlas)
+        if start == stop:
+            raise ValueError("No atlas {} in the index".format(atlas))
+        teffs = self.teff[start:stop]
+        # entries without a Teff sort to the end
+        teffs = teffs[:np.count_nonzero(np.isfinite(teffs))]
+        if not len(teffs):
+            raise ValueError("No entries of atlas {} have a Teff".format(atlas))
+        i = np.searchsorted(teffs, teff)
+        candidates = [teffs[j] for j in (i - 1, i) if 0 <= j < len(teffs)]
+        closest = min(candidates, key=lambda value: abs(value - teff))
+        first = start + np.searchsorted(teffs, closest, side='left')
+        last = start + np.searchsorted(teffs, closest, side='right')
+        rows = np.arange(first, last)
+        for values, target, label in ((self.logg, logg, 'log g'), (self.feh, feh, '[Fe/H]')):
+            if target is not None and len(rows) > 1:
+                distance = np.abs(values[rows] - target)
+                if not np.any(np.isfinite(distance)):
+                    raise ValueError("No entries of atlas {} with Teff {:g} have a {}".format(
+                        atlas, closest, label
+                    ))
+                rows = rows[distance == np.nanmin(distance)]
+        return int(rows[0])
+
+    def filename(self, row):
+        """
+        Full path of the FITS file for an entry.
+        """
+        return os.path.join(_cdbs(), self.path[row])
+
+    def flux(self, rows, waveset=None):
+        """
+        Spectra of entries, resampled onto a wavelength grid.
+
+        Spectra saved with `save_flux` are read from the memory-mapped copy,
+        others from their FITS files.
+
+        Parameters
+        ----------
+        rows : int or `~numpy.ndarray`
+            Index entries.
+        waveset : `~numpy.ndarray`, optional
+            Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+        Returns
+        -------
+        flux : `~numpy.ndarray`
+            PHOTLAM, of shape ``rows.shape + waveset.shape``.
+        """
+        if waveset is None:
+            waveset = DEFAULT_WAVESET
+        rows = np.asarray(rows, dtype=int)
+        keys, cached = _saved_flux(waveset)
+        lookup = {key: i for i, key in enumerate(keys)}
+        flux = np.empty(rows.shape + (len(waveset),))
+        for index, row in np.ndenumerate(rows):
+            saved = lookup.get(self.keys[row])
+            if saved is not None:
+                flux[index] = cached[saved]
+            else:
+                flux[index] = from_file(self.filename(row), waveset,
+                                        ext=int(self.ext[row]), flux_col=str(self.column[row]))
+        return flux
+
+    def save_flux(self, rows, waveset=None):
+        """
+        Save resampled spectra of entries, to be memory-mapped by `flux`.
+
+        Entries already saved for this wavelength grid are kept.
+        """
+        from . import _check_user_dir
+        if waveset is None:
+            waveset = DEFAULT_WAVESET
+        keys, cached = _saved_flux(waveset)
+        keys = list(keys)
+        saved = set(keys)
+        rows = [row for row in np.atleast_1d(rows) if self.keys[row] not in saved]
+        if not rows:
+            return
+        new = self.flux(rows, waveset)
+        flux = np.concatenate((np.asarray(cached), new)) if len(keys) else new
+        keys += [self.keys[row] for row in rows]
+
+        base = os.path.join(_check_user_dir(), 'atlas_flux_{}'.format(waveset_key(waveset)[:16]))
+        # write then rename, so that readers never see a partial file
+        _FLUX_CACHE.pop(waveset_key(waveset), None)
+        with open(base + '.tmp.npy', 'wb') as f:
+            np.save(f, flux)
+        with open(base + '_keys.tmp.npy', 'wb') as f:
+            np.save(f, np.array(keys))
+        os.replace(base + '.tmp.npy', base + '.npy')
+        os.replace(base + '_keys.tmp.npy', base + '_keys.npy')
+
+    def save(self, filename):
+        np.savez(filename, atlas=self.atlas, sptype=self.sptype, teff=self.teff,
+                 logg=self.logg, feh=self.feh, path=self.path, ext=self.ext,
+                 column=self.column, signature=np.array(self.signature))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['atlas'], data['sptype'], data['teff'], data['logg'], data['feh'],
+                       data['path'], data['ext'], data['column'], str(data['signature']))
+
+
+def _bounds(bounds):
+    if bounds is None:
+        return -np.inf, np.inf
+    if np.ndim(bounds) == 0:
+        return bounds, bounds
+    lo, hi = bounds
+    return lo, hi
+
+
+def _saved_flux(waveset):
+    """
+    Row keys and memory-mapped flux of spectra saved for a wavelength grid.
+    """
+    from . import _check_user_dir
+    key = waveset_key(waveset)
+    if key not in _FLUX_CACHE:
+        base = os.path.join(_check_user_dir(), 'atlas_flux_{}'.format(key[:16]))
+        if os.path.exists(base + '.npy') and os.path.exists(base + '_keys.npy'):
+            keys = np.load(base + '_keys.npy').tolist()
+            _FLUX_CACHE[key] = (keys, np.load(base + '.npy', mmap_mode='r'))
+        else:
+            _FLUX_CACHE[key] = ([], np.empty((0, len(waveset))))
+    return _FLUX_CACHE[key]
+
+
+def build_index():
+    """
+    Scan the atlases installed in ``$PYSYN_CDBS``.
+
+    Returns
+    -------
+    index : `AtlasIndex`
+    """
+    pysyn_cdbs = _cdbs()
+    rows = _scan_pickles(pysyn_cdbs)
+    for catalog in _catalogs(pysyn_cdbs):
+        rows.extend(_scan_catalog(pysyn_cdbs, catalog))
+    if not rows:
+        raise ValueError("No spectral atlases found in {}".format(pysyn_cdbs))
+    columns = [list(column) for column in zip(*rows)]
+    return AtlasIndex(*columns, signature=_signature(pysyn_cdbs))
+
+
+def atlas_index(rebuild=False):
+    """
+    The index of installed atlases, read from the user directory if up to date.
+
+    Parameters
+    ----------
+    rebuild : bool, optional
+        Scan the atlases even if the saved index looks current.
+
+    Returns
+    -------
+    index : `AtlasIndex`
+    """
+    global _INDEX
+    from . import _check_user_dir
+    signature = _signature(_cdbs())
+    if not rebuild and _INDEX is not None and _INDEX.signature == signature:
+        return _INDEX
+    filename = os.path.join(_check_user_dir(), INDEX_NAME)
+    index = None
+    if not rebuild and os.path.exists(filename):
+        index = AtlasIndex.load(filename)
+        if index.signature != signature:
+            index = None
+    if index is None:
+        index = build_index()
+        index.save(filename)
+    _INDEX = index
+    return index
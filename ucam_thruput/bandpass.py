@@ -0,0 +1,354 @@
+"""
+Evaluation of obsmode throughputs directly from the instrument models.
+
+This follows the light path through the graph table in the same way as
+``stsynphot``, but multiplies the component curves on a common wavelength
+grid with ``numpy``, so that many bandpasses can be built and combined
+cheaply. Component curves and assembled throughputs are cached, keyed on
+the content hash of the curves involved.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+from itertools import chain
+
+import numpy as np
+
+from .components import CLEAR, component_digest, load_component
+
+# common wavelength grid (Angstroms) covering all the component curves
+DEFAULT_WAVESET = np.arange(2000.0, 12001.0, 1.0)
+DEFAULT_WAVESET.flags.writeable = False
+
+INSTRUMENTS = ('ucam', 'hcam', 'uspec')
+# component holding the atmospheric transmission at an airmass of one
+ATMOSPHERE = 'atmos'
+
+_GRAPH = None
+# (component digest, waveset key) -> resampled curve
+_CURVE_CACHE = {}
+# (sorted component digests, waveset key, airmass) -> throughput
+_THRUPUT_CACHE = {}
+# (component digests, waveset key) -> leave-one-out products
+_PARTIAL_CACHE = {}
+# waveset id -> (waveset, key)
+_WAVESET_KEYS = {}
+
+
+def _graph():
+    """
+    Graph table rows grouped by input node.
+    """
+    global _GRAPH
+    if _GRAPH is None:
+        from .common import Common
+        from .hcam import Hcam
+        from .ucam import Ucam
+        from .uspec import Uspec
+
+        rows = chain(*(
+            Common().instrument_table_rows,
+            Ucam().instrument_table_rows,
+            Hcam().instrument_table_rows,
+            Uspec().instrument_table_rows
+        ))
+        graph = {}
+        for compname, keyword, innode, outnode, _, _ in rows:
+            graph.setdefault(innode, []).append((keyword, compname, outnode))
+        _GRAPH = graph
+    return _GRAPH
+
+
+def parse_obsmode(obsmode):
+    """
+    Split an obsmode string into a tuple of keywords.
+    """
+    if isinstance(obsmode, (tuple, list)):
+        return tuple(obsmode)
+    return tuple(kw.strip() for kw in obsmode.split(',') if kw.strip())
+
+
+def obsmode_components(obsmode):
+    """
+    Components along the light path for an obsmode.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+
+    Returns
+    -------
+    components : tuple
+        Names of the components traversed, in order. Clear components are omitted.
+    """
+    graph = _graph()
+    modes = parse_obsmode(obsmode)
+    used = set()
+    components = []
+    innode = min(graph)
+    while innode in graph:
+        rows = graph[innode]
+        match = None
+        for keyword, compname, outnode in rows:
+            if keyword == 'default':
+                match = (compname, outnode)
+        for mode in modes:
+            matches = [(compname, outnode) for keyword, compname, outnode in rows
+                       if keyword == mode]
+            if len(matches) > 1:
+                raise ValueError(
+                    "{} matches found for {} in obsmode {}".format(len(matches), mode, obsmode)
+                )
+            if matches:
+                used.add(mode)
+                match = matches[0]
+        if match is None:
+            choices = sorted(set(row[0] for row in rows))
+            raise ValueError(
+                "Incomplete obsmode {}, choose from {}".format(obsmode, choices)
+            )
+        compname, outnode = match
+        if compname != CLEAR:
+            components.append(compname)
+        innode = outnode
+    unused = set(modes) - used
+    if unused:
+        raise ValueError(
+            "Unused keywords {} in obsmode {}".format(sorted(unused), obsmode)
+        )
+    return tuple(components)
+
+
+def list_obsmodes(telescope=None):
+    """
+    All valid instrument, telescope and filter combinations.
+
+    Parameters
+    ----------
+    telescope : string, optional
+        Only return obsmodes for this telescope. By default, obsmodes for
+        every telescope in ``TELESCOPE_AREAS`` are returned.
+
+    Returns
+    -------
+    obsmodes : list
+        Obsmode strings of the form ``'instrument,telescope,filter'``.
+    """
+    from . import TELESCOPE_AREAS
+    from .hcam import Hcam
+    from .ucam import Ucam
+    from .uspec import Uspec
+
+    filters = dict(
+        ucam=chain(*Ucam._filter_groupings.values()),
+        hcam=chain(*Hcam._filter_groupings.values()),
+        uspec=Uspec._filter_list
+    )
+    filters = {inst: [filt.name for filt in filts] for inst, filts in filters.items()}
+    telescopes = sorted(TELESCOPE_AREAS) if telescope is None else [telescope]
+
+    obsmodes = []
+    for tel in telescopes:
+        for inst in INSTRUMENTS:
+            for name in filters[inst]:
+                obsmode = ','.join((inst, tel, name))
+                try:
+                    obsmode_components(obsmode)
+                except ValueError:
+                    # instrument is not used on this telescope
+                    continue
+                obsmodes.append(obsmode)
+    return obsmodes
+
+
+def obsmode_telescope(obsmode):
+    """
+    The telescope named in an obsmode.
+    """
+    from . import TELESCOPE_AREAS
+    telescopes = [kw for kw in parse_obsmode(obsmode) if kw in TELESCOPE_AREAS]
+    if len(telescopes) != 1:
+        raise ValueError("Obsmode {} must name exactly one telescope".format(obsmode))
+    return telescopes[0]
+
+
+def obsmode_area(obsmode):
+    """
+    Collecting area (cm**2) of the telescope named in an obsmode.
+    """
+    from . import TELESCOPE_AREAS
+    return TELESCOPE_AREAS[obsmode_telescope(obsmode)]
+
+
+def waveset_key(waveset):
+    """
+    A hashable key identifying a wavelength grid.
+    """
+    cached = _WAVESET_KEYS.get(id(waveset))
+    if cached is not None and cached[0] is waveset:
+        return cached[1]
+    waveset = np.ascontiguousarray(waveset, dtype=np.float64)
+    key = hashlib.sha1(waveset.tobytes()).hexdigest()
+    if not waveset.flags.writeable:
+        # read-only grids cannot change under us, so remember them
+        _WAVESET_KEYS[id(waveset)] = (waveset, key)
+    return key
+
+
+def component_curve(name, waveset=None):
+    """
+    Throughput of a single component, resampled onto a wavelength grid.
+
+    Parameters
+    ----------
+    name : string
+        Component name.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    thru : `~numpy.ndarray`
+        Read-only throughput on ``waveset``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    key = (component_digest(name), waveset_key(waveset))
+    curve = _CURVE_CACHE.get(key)
+    if curve is None:
+        wave, thru = load_component(name)
+        # beyond the tabulated range, extrapolate from end points as synphot does
+        curve = np.interp(waveset, wave, thru)
+        curve.flags.writeable = False
+        _CURVE_CACHE[key] = curve
+    return curve
+
+
+def throughput(obsmode, waveset=None, airmass=None, cache=True):
+    """
+    Total throughput of an obsmode.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    airmass : float, optional
+        Airmass at which to evaluate the atmospheric transmission. By default
+        the tabulated transmission, for an airmass of one, is used. Obsmodes
+        without the atmosphere (``noatmos``) are unaffected.
+    cache : bool, optional
+        Keep the result for later calls. Callers which keep their own copy,
+        such as `ucam_thruput.compact`, can turn this off to save memory.
+
+    Returns
+    -------
+    thru : `~numpy.ndarray`
+        Read-only throughput on ``waveset``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    components = obsmode_components(obsmode)
+    if airmass is not None:
+        airmass = float(airmass)
+        if airmass < 1:
+            raise ValueError("airmass must be at least one, not {}".format(airmass))
+        if airmass == 1 or ATMOSPHERE not in components:
+            airmass = None
+    key = (tuple(sorted(component_digest(name) for name in components)),
+           waveset_key(waveset), airmass)
+    thru = _THRUPUT_CACHE.get(key)
+    if thru is None:
+        thru = np.ones(len(waveset))
+        for name in components:
+            if name == ATMOSPHERE and airmass is not None:
+                thru *= component_curve(name, waveset)**airmass
+            else:
+                thru *= component_curve(name, waveset)
+        thru.flags.writeable = False
+        if cache:
+            _THRUPUT_CACHE[key] = thru
+    return thru
+
+
+def component_stack(obsmode, waveset=None):
+    """
+    Throughputs of each component of an obsmode.
+
+    Returns
+    -------
+    components : tuple
+        Component names, in the order they are traversed.
+    curves : `~numpy.ndarray`
+        Throughputs of shape (n_components, n_wave).
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    components = obsmode_components(obsmode)
+    curves = np.array([component_curve(name, waveset) for name in components])
+    return components, curves
+
+
+def partial_products(obsmode, waveset=None):
+    """
+    For each component of an obsmode, the product of all the other components.
+
+    These are formed from running products from each end of the chain, rather
+    than by division, so components with zero throughput are handled exactly.
+
+    Returns
+    -------
+    components : tuple
+        Component names, in the order they are traversed.
+    products : `~numpy.ndarray`
+        Read-only array of shape (n_components, n_wave), where row i is the
+        product of every component except component i.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    components = obsmode_components(obsmode)
+    key = (tuple(component_digest(name) for name in components), waveset_key(waveset))
+    products = _PARTIAL_CACHE.get(key)
+    if products is None:
+        _, curves = component_stack(obsmode, waveset)
+        ones = np.ones((1, len(waveset)))
+        before = np.cumprod(np.vstack((ones, curves[:-1])), axis=0)
+        after = np.cumprod(np.vstack((ones, curves[:0:-1])), axis=0)[::-1]
+        products = before * after
+        products.flags.writeable = False
+        _PARTIAL_CACHE[key] = products
+    return components, products
+
+
+def throughput_stack(obsmodes, waveset=None, airmass=None):
+    """
+    Throughputs of several obsmodes as a 2D array of shape (n_obsmodes, n_wave).
+    """
+    return np.vstack([throughput(obsmode, waveset, airmass) for obsmode in obsmodes])
+
+
+def band(obsmode, waveset=None, airmass=None):
+    """
+    A `synphot.SpectralElement` for an obsmode, built without stsynphot.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    airmass : float, optional
+        Airmass for the atmospheric transmission, see `throughput`.
+    """
+    import synphot as syn
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    return syn.SpectralElement(
+        syn.Empirical1D, points=np.array(waveset),
+        lookup_table=np.array(throughput(obsmode, waveset, airmass)),
+        meta=dict(expr=str(obsmode))
+    )
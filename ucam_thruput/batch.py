@@ -0,0 +1,208 @@
+"""
+Batch synthetic photometry for large numbers of targets.
+
+Targets are (spectrum, obsmode) pairs, with spectra given as the string
+descriptions understood by `ucam_thruput.spectra.from_spec`. Each unique
+spectrum is integrated through each unique obsmode once, in blocks of
+spectra so that memory use is bounded, and the results are gathered back
+out to the individual targets. Spectra read from files (``file:<path>``)
+are integrated on their own wavelength grid with
+`ucam_thruput.photometry.tabulated_countrate`, which interpolates as part
+of the integral rather than building the resampled spectrum.
+
+For sweeps over every combination of spectrum, obsmode and observing
+condition, `sweep` writes the results a chunk at a time into a
+`ucam_thruput.store.ResultStore`, so that long runs can be resumed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET, obsmode_area, throughput_stack
+from .kernels import get_backend
+from .photometry import abmag_offset, tabulated_countrate, trapezoid_weights
+from .spectra import from_spec, tabulated_file
+from .store import ResultStore
+
+
+def _raw_countrates(specs, thru, waveset, block_size):
+    # count rates for unit area, of shape (n_specs, n_bandpasses)
+    thru_weights = thru * trapezoid_weights(waveset)
+    raw = np.empty((len(specs), len(thru)))
+    for start in range(0, len(specs), block_size):
+        block = list(specs[start:start + block_size])
+        resampled = [i for i, spec in enumerate(block) if not spec.startswith('file:')]
+        if resampled:
+            flux = np.array([from_spec(block[i], waveset) for i in resampled])
+            raw[start + np.array(resampled)] = get_backend().inner(flux, thru_weights)
+        for i, spec in enumerate(block):
+            if spec.startswith('file:'):
+                wave, flux = tabulated_file(spec[len('file:'):], waveset)
+                raw[start + i] = tabulated_countrate(wave, flux, thru, waveset, 1.0)[0]
+    return raw
+
+
+def evaluate(specs, obsmodes, mags=None, norm_obsmodes=None, waveset=None, block_size=256):
+    """
+    Count rates and AB magnitudes of many targets.
+
+    Parameters
+    ----------
+    specs : sequence
+        Spectrum description for each target.
+    obsmodes : sequence
+        Obsmode for each target.
+    mags : `~numpy.ndarray`, optional
+        AB magnitude of each target, used to scale its spectrum. If not given,
+        spectra are used as they are, as are those of targets whose
+        magnitude is NaN.
+    norm_obsmodes : sequence, optional
+        Obsmode in which each of ``mags`` is measured. Defaults to ``obsmodes``.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    block_size : int, optional
+        Number of spectra held in memory at once.
+
+    Returns
+    -------
+    countrate, abmag : `~numpy.ndarray`
+        Count rate (counts/s) and AB magnitude of each target in its obsmode.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    if norm_obsmodes is None:
+        norm_obsmodes = obsmodes
+    n_targets = len(specs)
+    if n_targets == 0:
+        return np.zeros(0), np.zeros(0)
+
+    unique_specs, spec_index = np.unique(np.asarray(specs, dtype=str), return_inverse=True)
+    modes = np.concatenate((np.asarray(obsmodes, dtype=str), np.asarray(norm_obsmodes, dtype=str)))
+    unique_modes, mode_index = np.unique(modes, return_inverse=True)
+    mode_index, norm_index = mode_index[:n_targets], mode_index[n_targets:]
+
+    thru = throughput_stack(unique_modes, waveset)
+    area = np.array([obsmode_area(obsmode) for obsmode in unique_modes])
+    offset = abmag_offset(thru, waveset)
+
+    # integrate every unique spectrum through every unique obsmode
+    raw = _raw_countrates(unique_specs, thru, waveset, block_size)
+
+    with np.errstate(divide='ignore'):
+        raw_mag = -2.5 * np.log10(raw) + offset
+    countrate = area[mode_index] * raw[spec_index, mode_index]
+    abmag = raw_mag[spec_index, mode_index]
+    if mags is not None:
+        shift = np.asarray(mags, dtype=np.float64) - raw_mag[spec_index, norm_index]
+        shift[np.isnan(mags)] = 0.0
+        countrate = countrate * 10**(-0.4 * shift)
+        abmag = abmag + shift
+    return countrate, abmag
+
+
+def _condition_obsmode(obsmode, condition):
+    return ','.join((obsmode, condition)) if condition else obsmode
+
+
+def evaluate_grid(specs, obsmodes, conditions=('',), mags=None, norm_obsmode=None,
+                  waveset=None, block_size=256):
+    """
+    Count rates and AB magnitudes of every spectrum in every obsmode and condition.
+
+    Parameters
+    ----------
+    specs : sequence
+        Spectrum descriptions.
+    obsmodes : sequence
+        Obsmodes.
+    conditions : sequence, optional
+        Extra obsmode keywords for each observing condition, e.g ``'noatmos'``.
+        An empty string adds nothing.
+    mags : `~numpy.ndarray`, optional
+        AB magnitude of each spectrum in ``norm_obsmode``, used to scale it.
+        Spectra whose magnitude is NaN are used as they are.
+    norm_obsmode : string, optional
+        Obsmode in which ``mags`` are measured.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    block_size : int, optional
+        Number of spectra held in memory at once.
+
+    Returns
+    -------
+    countrate, abmag : `~numpy.ndarray`
+        Arrays of shape (n_specs, n_obsmodes, n_conditions).
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    if mags is not None and norm_obsmode is None:
+        raise ValueError("norm_obsmode is needed to scale spectra to mags")
+    modes = [_condition_obsmode(obsmode, condition)
+             for obsmode in obsmodes for condition in conditions]
+    n_grid = len(modes)
+    if mags is not None:
+        modes.append(norm_obsmode)
+    thru = throughput_stack(modes, waveset)
+    area = np.array([obsmode_area(obsmode) for obsmode in modes])
+    offset = abmag_offset(thru, waveset)
+
+    raw = _raw_countrates(specs, thru, waveset, block_size)
+    with np.errstate(divide='ignore'):
+        raw_mag = -2.5 * np.log10(raw) + offset
+    countrate = area[:n_grid] * raw[:, :n_grid]
+    abmag = raw_mag[:, :n_grid]
+    if mags is not None:
+        shift = np.asarray(mags, dtype=np.float64) - raw_mag[:, -1]
+        shift[np.isnan(mags)] = 0.0
+        countrate = countrate * 10**(-0.4 * shift[:, np.newaxis])
+        abmag = abmag + shift[:, np.newaxis]
+    shape = (len(specs), len(obsmodes), len(conditions))
+    return countrate.reshape(shape), abmag.reshape(shape)
+
+
+def sweep(directory, specs, obsmodes, conditions=('',), mags=None, norm_obsmode=None,
+          chunk_size=1024, waveset=None, block_size=256):
+    """
+    Photometry of every spectrum in every obsmode and condition, saved to disk.
+
+    Results are written a chunk of spectra at a time. If the store already
+    exists with the same spectra, obsmodes and conditions, only the chunks
+    which are missing are computed, so an interrupted sweep can be resumed
+    by running it again.
+
+    Parameters
+    ----------
+    directory : string
+        Directory for the `~ucam_thruput.store.ResultStore`.
+    specs, obsmodes, conditions, mags, norm_obsmode : optional
+        As for `evaluate_grid`.
+    chunk_size : int, optional
+        Number of spectra in each chunk of the store.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    block_size : int, optional
+        Number of spectra held in memory at once.
+
+    Returns
+    -------
+    store : `~ucam_thruput.store.ResultStore`
+        The store, with fields ``countrate`` and ``abmag``.
+    """
+    attrs = dict(norm_obsmode=norm_obsmode)
+    if mags is not None:
+        mags = np.asarray(mags, dtype=np.float64)
+        attrs['mags_sha1'] = hashlib.sha1(mags.tobytes()).hexdigest()
+    store = ResultStore.create(directory, specs, obsmodes, conditions,
+                               chunk_size=chunk_size, attrs=attrs)
+    for chunk in store.pending():
+        rows = store.chunk_slice(chunk)
+        countrate, abmag = evaluate_grid(
+            store.spectra[rows], obsmodes, conditions,
+            None if mags is None else mags[rows], norm_obsmode, waveset, block_size
+        )
+        store.write_chunk(chunk, countrate=countrate, abmag=abmag)
+    return store
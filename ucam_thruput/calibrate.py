@@ -0,0 +1,379 @@
+"""
+Fitting component throughputs to observed count rates of standard stars.
+
+A few components, typically the dichroics and CCDs, are given free
+parameters: a grey scale factor and, for components with sharp edges, a
+wavelength shift. The count rate of each standard star is then
+
+    area * sum_i F_i w_i R_i prod_c s_c T_c(lambda_i - delta_c)
+
+where R is the product of every component which is not free. R, and its
+product with the spectrum, the trapezoid weights and the collecting area,
+do not change as the parameters are varied, so they are formed once. On
+the uniform wavelength grid, shifted component curves are a linear
+interpolation between two slices of a padded copy of the curve, so the
+model and its Jacobian are evaluated without allocating any new arrays.
+
+The fit is a Levenberg-Marquardt least-squares fit of the model count rates
+to the observed ones. Fitted curves can be saved as new versions of the
+components, which are then used in place of the packaged curves.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, component_curve, obsmode_area,
+                       obsmode_components)
+from .components import load_component, write_version
+from .photometry import trapezoid_weights
+
+CalibrationFit = namedtuple(
+    "CalibrationFit", ['parameters', 'values', 'errors', 'chisq', 'model', 'n_iter']
+)
+
+SCALE = 'scale'
+SHIFT = 'shift'
+
+
+def free_parameters(name):
+    """
+    Default free parameters of a component.
+
+    Dichroics get a scale factor and a wavelength shift, anything else a
+    scale factor only.
+    """
+    if '_dich' in name:
+        return (SCALE, SHIFT)
+    return (SCALE,)
+
+
+def calibration_components(obsmodes):
+    """
+    The dichroics and CCDs in the light paths of some obsmodes.
+    """
+    names = set()
+    for obsmode in obsmodes:
+        names.update(name for name in obsmode_components(obsmode)
+                     if '_dich' in name or '_ccd' in name)
+    return sorted(names)
+
+
+class ForwardModel:
+    """
+    Count rates of standard stars as a function of component parameters.
+
+    Parameters
+    ----------
+    obsmodes : list
+        Obsmode of each of N observations.
+    flux : `~numpy.ndarray`
+        Spectra (PHOTLAM) of the N stars, of shape (N, n_wave).
+    free : dict or list
+        Free parameters, as a mapping of component name to a tuple of
+        ``'scale'`` and/or ``'shift'``. If a list of names is given, the
+        parameters are those from `free_parameters`.
+    max_shift : float, optional
+        Largest wavelength shift (Angstroms). Shifts are clipped to this.
+    waveset : `~numpy.ndarray`, optional
+        Uniformly spaced wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Attributes
+    ----------
+    parameters : list
+        ``(component, 'scale' or 'shift')`` for each parameter, in order.
+    initial : `~numpy.ndarray`
+        Parameter values for the unchanged curves.
+    """
+    def __init__(self, obsmodes, flux, free, max_shift=50.0, waveset=None):
+        if waveset is None:
+            waveset = DEFAULT_WAVESET
+        step = np.diff(waveset)
+        if not np.allclose(step, step[0]):
+            raise ValueError("waveset must be uniformly spaced")
+        flux = np.atleast_2d(np.asarray(flux, dtype=np.float64))
+        if len(flux) != len(obsmodes):
+            raise ValueError("need one spectrum per obsmode")
+        if not isinstance(free, dict):
+            free = {name: free_parameters(name) for name in free}
+
+        self.names = sorted(free)
+        self.parameters = []
+        self._scale_index = np.full(len(self.names), -1)
+        self._shift_index = np.full(len(self.names), -1)
+        for k, name in enumerate(self.names):
+            for kind in free[name]:
+                if kind == SCALE:
+                    self._scale_index[k] = len(self.parameters)
+                elif kind == SHIFT:
+                    self._shift_index[k] = len(self.parameters)
+                else:
+                    raise ValueError("unknown parameter {} for {}".format(kind, name))
+                self.parameters.append((name, kind))
+        self.initial = np.array([1.0 if kind == SCALE else 0.0 for _, kind in self.parameters])
+
+        n_wave = len(waveset)
+        self.step = step[0]
+        self.max_shift = max_shift
+        # free curves on the grid, padded at each end to allow for shifts
+        self._pad = int(np.ceil(max_shift / self.step)) + 1
+        padded = waveset[0] + self.step * np.arange(-self._pad, n_wave + self._pad)
+        # the curves being fitted, kept in case new versions are saved meanwhile
+        self._base = [load_component(name) for name in self.names]
+        self._padded = np.array([np.interp(padded, *curve) for curve in self._base])
+
+        # group the observations by obsmode, so that each group is one slice
+        order = np.argsort(obsmodes, kind='stable')
+        self._inverse = np.argsort(order)
+        weights = trapezoid_weights(waveset)
+        index = {name: k for k, name in enumerate(self.names)}
+        self._groups = []
+        start = 0
+        sorted_modes = [obsmodes[i] for i in order]
+        while start < len(order):
+            obsmode = sorted_modes[start]
+            stop = start
+            while stop < len(order) and sorted_modes[stop] == obsmode:
+                stop += 1
+            components = obsmode_components(obsmode)
+            fixed = obsmode_area(obsmode) * weights
+            for name in components:
+                if name not in index:
+                    fixed = fixed * component_curve(name, waveset)
+            fixed_flux = np.ascontiguousarray(flux[order[start:stop]] * fixed)
+            free_here = [index[name] for name in components if name in index]
+            self._groups.append((slice(start, stop), fixed_flux, free_here))
+            start = stop
+
+        # work space
+        self._curves = np.empty((len(self.names), n_wave))
+        self._derivs = np.empty((len(self.names), n_wave))
+        self._product = np.empty(n_wave)
+        self._work = np.empty(n_wave)
+        self._model = np.empty(len(obsmodes))
+        self._jacobian = np.empty((len(self.parameters), len(obsmodes)))
+
+    def _update(self, params):
+        n_wave = self._curves.shape[1]
+        for k in range(len(self.names)):
+            scale = params[self._scale_index[k]] if self._scale_index[k] >= 0 else 1.0
+            shift = params[self._shift_index[k]] if self._shift_index[k] >= 0 else 0.0
+            shift = min(max(shift, -self.max_shift), self.max_shift) / self.step
+            # T(lambda - delta) lies between pixels i - n - 1 and i - n
+            n = int(np.floor(shift))
+            frac = shift - n
+            upper = self._padded[k, self._pad - n:self._pad - n + n_wave]
+            lower = self._padded[k, self._pad - n - 1:self._pad - n - 1 + n_wave]
+            curve, deriv = self._curves[k], self._derivs[k]
+            np.multiply(upper, scale * (1 - frac), out=curve)
+            np.multiply(lower, scale * frac, out=deriv)
+            curve += deriv
+            np.subtract(lower, upper, out=deriv)
+            deriv *= scale / self.step
+
+    def _evaluate(self, params):
+        self._update(params)
+        for rows, fixed_flux, free_here in self._groups:
+            self._product.fill(1.0)
+            for k in free_here:
+                self._product *= self._curves[k]
+            np.dot(fixed_flux, self._product, out=self._model[rows])
+        return self._model
+
+    def _evaluate_jacobian(self, params):
+        model = self._evaluate(params)
+        self._jacobian.fill(0.0)
+        for rows, fixed_flux, free_here in self._groups:
+            for k in set(free_here):
+                count = free_here.count(k)
+                j = self._scale_index[k]
+                if j >= 0:
+                    # count rates go as scale**count
+                    np.multiply(model[rows], count / params[j], out=self._jacobian[j, rows])
+                j = self._shift_index[k]
+                if j >= 0:
+                    # product of the other curves in the chain, times the derivative of this one
+                    np.multiply(self._derivs[k], count, out=self._work)
+                    skipped = False
+                    for other in free_here:
+                        if other == k and not skipped:
+                            skipped = True
+                            continue
+                        self._work *= self._curves[other]
+                    np.dot(fixed_flux, self._work, out=self._jacobian[j, rows])
+        return self._jacobian
+
+    def __call__(self, params, out=None):
+        """
+        Model count rates (counts/s) of each observation.
+        """
+        if out is None:
+            out = np.empty(len(self._model))
+        return np.take(self._evaluate(params), self._inverse, out=out)
+
+    def jacobian(self, params, out=None):
+        """
+        Derivatives of the model count rates, of shape (N, n_parameters).
+        """
+        if out is None:
+            out = np.empty(self._jacobian.shape[::-1])
+        return np.take(self._evaluate_jacobian(params).T, self._inverse, axis=0, out=out)
+
+    def fit(self, countrate, error=None, params=None, max_iter=100, tol=1e-10):
+        """
+        Fit the parameters to observed count rates.
+
+        Parameters
+        ----------
+        countrate : `~numpy.ndarray`
+            Observed count rates (counts/s) of each observation.
+        error : `~numpy.ndarray`, optional
+            Uncertainties on the count rates. Defaults to 1 per cent.
+        params : `~numpy.ndarray`, optional
+            Starting parameters, which are updated in place. Defaults to
+            a copy of `initial`.
+        max_iter : int, optional
+            Maximum number of iterations.
+        tol : float, optional
+            Stop when chi-squared changes by less than this fraction.
+
+        Returns
+        -------
+        fit : `CalibrationFit`
+            Parameter names, best-fit values and their uncertainties,
+            chi-squared, model count rates and number of iterations.
+        """
+        countrate = np.asarray(countrate, dtype=np.float64)
+        if error is None:
+            error = 0.01 * countrate
+        # work in the grouped order of the observations
+        order = np.argsort(self._inverse)
+        data = countrate[order]
+        inv_error = 1 / np.asarray(error, dtype=np.float64)[order]
+        params = self.initial.copy() if params is None else params
+        trial = np.empty_like(params)
+        resid = np.empty_like(data)
+
+        def chisq(p):
+            np.subtract(data, self._evaluate(p), out=resid)
+            np.multiply(resid, inv_error, out=resid)
+            return np.dot(resid, resid)
+
+        current = chisq(params)
+        damping = 1e-3
+        for n_iter in range(1, max_iter + 1):
+            jac = self._evaluate_jacobian(params) * inv_error
+            chisq(params)
+            alpha = np.dot(jac, jac.T)
+            beta = np.dot(jac, resid)
+            diag = np.diag(alpha).copy()
+            diag[diag == 0] = 1.0
+            while True:
+                step = np.linalg.solve(alpha + damping * np.diag(diag), beta)
+                np.add(params, step, out=trial)
+                new = chisq(trial)
+                if new <= current:
+                    break
+                damping *= 10
+                if damping > 1e10:
+                    break
+            if new > current:
+                break
+            params[:] = trial
+            damping = max(damping / 10, 1e-12)
+            converged = current - new <= tol * max(current, 1e-300)
+            current = new
+            if converged:
+                break
+
+        jac = self._evaluate_jacobian(params) * inv_error
+        errors = np.sqrt(np.abs(np.diag(np.linalg.pinv(np.dot(jac, jac.T)))))
+        return CalibrationFit(
+            list(self.parameters), params, errors, chisq(params), self(params), n_iter
+        )
+
+    def fitted_curves(self, params):
+        """
+        Fitted throughputs of the free components, at their tabulated wavelengths.
+
+        Returns
+        -------
+        curves : dict
+            Mapping of component name to arrays of wavelength (Angstroms)
+            and throughput.
+        """
+        curves = {}
+        for k, name in enumerate(self.names):
+            wave, thru = self._base[k]
+            scale = params[self._scale_index[k]] if self._scale_index[k] >= 0 else 1.0
+            shift = params[self._shift_index[k]] if self._shift_index[k] >= 0 else 0.0
+            shift = min(max(shift, -self.max_shift), self.max_shift)
+            curves[name] = (wave + shift, scale * thru)
+        return curves
+
+
+def fit_throughputs(obsmodes, flux, countrate, error=None, free=None, max_shift=50.0,
+                    waveset=None, write=False):
+    """
+    Fit scale factors and shifts of components to standard star count rates.
+
+    Note that grey scale factors of components which always appear together
+    (e.g. a dichroic and the CCD behind it) are degenerate; only one of them
+    should be free.
+
+    Parameters
+    ----------
+    obsmodes : list
+        Obsmode of each observation.
+    flux : `~numpy.ndarray`
+        Spectra (PHOTLAM) of the stars observed, of shape (N, n_wave).
+    countrate : `~numpy.ndarray`
+        Observed count rates (counts/s).
+    error : `~numpy.ndarray`, optional
+        Uncertainties on the count rates. Defaults to 1 per cent.
+    free : dict or list, optional
+        Free parameters, see `ForwardModel`. Defaults to every dichroic and
+        CCD in the obsmodes, from `calibration_components`.
+    max_shift : float, optional
+        Largest wavelength shift (Angstroms).
+    waveset : `~numpy.ndarray`, optional
+        Uniformly spaced wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    write : bool, optional
+        Save the fitted curves as new versions of the components.
+
+    Returns
+    -------
+    fit : `CalibrationFit`
+    """
+    if free is None:
+        free = calibration_components(obsmodes)
+    model = ForwardModel(obsmodes, flux, free, max_shift, waveset)
+    fit = model.fit(countrate, error)
+    if write:
+        write_fitted_curves(model, fit)
+    return fit
+
+
+def write_fitted_curves(model, fit):
+    """
+    Save the curves from a fit as new versions of the components.
+
+    Re-run `ucam_thruput.setup` afterwards to use them with ``stsynphot``.
+
+    Returns
+    -------
+    filenames : dict
+        Mapping of component name to the file written.
+    """
+    filenames = {}
+    for name, (wave, thru) in model.fitted_curves(fit.values).items():
+        values = ', '.join(
+            '{}={:.6g}'.format(kind, value)
+            for (param_name, kind), value in zip(fit.parameters, fit.values)
+            if param_name == name
+        )
+        filenames[name] = write_version(name, wave, thru, 'fitted to standard stars: ' + values)
+    return filenames
@@ -0,0 +1,359 @@
+"""
+The ``ucam-thruput`` command line tool.
+
+``ucam-thruput photometry`` streams a CSV or FITS target table through the
+batch photometry engine in fixed-size chunks, writing a CSV table with a
+count rate and AB magnitude for every target and obsmode. Each target's
+spectrum is taken from one of these columns, in order of preference:
+
+* ``spectrum`` - a description understood by `ucam_thruput.spectra.from_spec`
+* ``sptype`` - a Pickles main sequence spectral type, e.g G2V
+* ``teff`` - the temperature (K) of a blackbody
+
+otherwise a flat (AB) spectrum is used. If there is a ``mag`` column, the
+spectrum is scaled to that AB magnitude, in the obsmode given by
+``--mag-obsmode``, or in the target's obsmode if it has only one.
+Obsmodes are taken from the ``obsmode`` column, or from ``--obsmode``
+options, and completed with the ``telescope`` column if they do not name
+a telescope.
+
+``ucam-thruput plan``, ``worker``, ``status`` and ``merge`` split a sweep of
+every target in a table through many obsmodes across machines sharing a
+filesystem, using the queue in `ucam_thruput.workqueue`.
+
+``ucam-thruput tables`` writes the zeropoint and extinction coefficient
+tables of `ucam_thruput.extinction` for real-time reduction.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import concurrent.futures
+import csv
+import os
+import sys
+import time
+from itertools import islice
+
+from . import TELESCOPE_AREAS, extinction, workqueue
+from .bandpass import list_obsmodes, parse_obsmode
+from .batch import evaluate
+from .kernels import BACKENDS, set_backend
+
+
+def _read_csv_chunks(path, chunk_size):
+    f = sys.stdin if path == '-' else open(path, newline='')
+    try:
+        reader = csv.DictReader(f)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+            yield rows
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _read_fits_chunks(path, chunk_size):
+    from astropy.io import fits
+    with fits.open(path, memmap=True) as hdul:
+        data = hdul[1].data
+        names = data.columns.names
+        for start in range(0, len(data), chunk_size):
+            chunk = data[start:start + chunk_size]
+            columns = [chunk[name].tolist() for name in names]
+            rows = []
+            for values in zip(*columns):
+                values = [v.decode().strip() if isinstance(v, bytes) else v for v in values]
+                rows.append(dict(zip(names, values)))
+            yield rows
+
+
+def read_chunks(path, chunk_size):
+    """
+    Read a CSV or FITS table as a stream of lists of row dictionaries.
+    """
+    if path.lower().endswith(('.fits', '.fit', '.fits.gz')):
+        return _read_fits_chunks(path, chunk_size)
+    return _read_csv_chunks(path, chunk_size)
+
+
+def _column(row, name):
+    # column names are matched case-insensitively, and empty values ignored
+    for key, value in row.items():
+        if key.lower() == name and value not in (None, ''):
+            return value
+    return None
+
+
+def _spectrum(row):
+    spec = _column(row, 'spectrum')
+    if spec is not None:
+        return str(spec)
+    sptype = _column(row, 'sptype')
+    if sptype is not None:
+        return 'pickles:{}'.format(sptype)
+    teff = _column(row, 'teff')
+    if teff is not None:
+        return 'bb:{}'.format(float(teff))
+    return 'flat'
+
+
+def _with_telescope(obsmode, telescope):
+    keywords = parse_obsmode(obsmode)
+    if telescope is None or any(kw in TELESCOPE_AREAS for kw in keywords):
+        return obsmode
+    return ','.join(keywords + (str(telescope),))
+
+
+def _target_obsmodes(row, obsmodes):
+    telescope = _column(row, 'telescope')
+    if not obsmodes:
+        obsmode = _column(row, 'obsmode')
+        if obsmode is None:
+            raise ValueError("No obsmode column or --obsmode option")
+        obsmodes = [obsmode]
+    elif 'all' in obsmodes:
+        if telescope is None:
+            raise ValueError("--obsmode all needs a telescope column")
+        obsmodes = list_obsmodes(telescope)
+    return [_with_telescope(obsmode, telescope) for obsmode in obsmodes]
+
+
+def process_chunk(rows, obsmodes=None, mag_obsmode=None):
+    """
+    Evaluate a chunk of targets.
+
+    Parameters
+    ----------
+    rows : list
+        Target table rows, as dictionaries.
+    obsmodes : list, optional
+        Obsmodes to evaluate every target in. By default, the ``obsmode``
+        column of each row is used.
+    mag_obsmode : string, optional
+        Obsmode in which the ``mag`` column is measured. By default, the
+        target's own obsmode, which is only allowed when each target is
+        evaluated in a single obsmode.
+
+    Returns
+    -------
+    rows : list
+        One output row (a dictionary) per target and obsmode, with the input
+        columns, plus ``obsmode``, ``countrate`` and ``abmag``.
+    """
+    targets, specs, modes, mags, norm_modes = [], [], [], [], []
+    for row in rows:
+        spec = _spectrum(row)
+        mag = _column(row, 'mag')
+        target_obsmodes = _target_obsmodes(row, obsmodes)
+        if mag is not None and mag_obsmode is None and len(target_obsmodes) > 1:
+            # scaling to the same magnitude in every band would erase the colours
+            raise ValueError("--mag-obsmode is needed with a mag column and several obsmodes")
+        for obsmode in target_obsmodes:
+            targets.append((row, obsmode))
+            specs.append(spec)
+            modes.append(obsmode)
+            mags.append(float('nan') if mag is None else float(mag))
+            if mag_obsmode is None:
+                norm_modes.append(obsmode)
+            else:
+                norm_modes.append(_with_telescope(mag_obsmode, _column(row, 'telescope')))
+
+    have_mags = any(mag == mag for mag in mags)
+    countrate, abmag = evaluate(
+        specs, modes, mags if have_mags else None, norm_modes
+    )
+    output = []
+    for (row, obsmode), rate, mag in zip(targets, countrate, abmag):
+        out = dict(row)
+        out.update(obsmode=obsmode, countrate=rate, abmag=mag)
+        output.append(out)
+    return output
+
+
+def _process(chunks, processes, obsmodes, mag_obsmode):
+    if processes <= 1:
+        for rows in chunks:
+            yield len(rows), process_chunk(rows, obsmodes, mag_obsmode)
+        return
+
+    # keep a bounded number of chunks in flight, so memory use stays constant
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = []
+        for rows in chunks:
+            pending.append((len(rows), executor.submit(process_chunk, rows, obsmodes, mag_obsmode)))
+            if len(pending) >= 2 * processes:
+                n_rows, future = pending.pop(0)
+                yield n_rows, future.result()
+        for n_rows, future in pending:
+            yield n_rows, future.result()
+
+
+def run_photometry(args):
+    chunks = read_chunks(args.input, args.chunk_size)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    writer = None
+    start = time.monotonic()
+    n_done = 0
+    try:
+        for n_rows, results in _process(chunks, args.processes, args.obsmodes, args.mag_obsmode):
+            if results:
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=list(results[0]), extrasaction='ignore')
+                    writer.writeheader()
+                writer.writerows(results)
+            n_done += n_rows
+            if not args.quiet:
+                elapsed = time.monotonic() - start
+                print("\r{} targets processed ({:.0f}/s)".format(n_done, n_done / max(elapsed, 1e-6)),
+                      end='', file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if not args.quiet:
+        print(file=sys.stderr)
+
+
+def run_plan(args):
+    specs, mags = [], []
+    for rows in read_chunks(args.input, 10000):
+        for row in rows:
+            specs.append(_spectrum(row))
+            mag = _column(row, 'mag')
+            mags.append(float('nan') if mag is None else float(mag))
+    have_mags = any(mag == mag for mag in mags)
+    if have_mags and args.mag_obsmode is None:
+        raise ValueError("--mag-obsmode is needed with a mag column")
+    n_shards = workqueue.plan_sweep(
+        args.queue, specs, args.obsmodes, args.telescopes, args.conditions or ('',),
+        mags if have_mags else None, args.mag_obsmode if have_mags else None, args.shard_size
+    )
+    print("{} targets in {} shards".format(len(specs), n_shards))
+
+
+def run_worker(args):
+    done = workqueue.run_worker(args.queue, args.stale_timeout, args.max_shards,
+                                verbose=not args.quiet)
+    if not args.quiet:
+        print("{} shards computed".format(len(done)))
+
+
+def run_status(args):
+    status = workqueue.queue_status(args.queue)
+    print("{} shards: {} done, {} claimed, {} waiting".format(*status))
+
+
+def run_merge(args):
+    store = workqueue.merge_results(args.queue, args.store)
+    print("{} of {} chunks merged into {}".format(
+        len(store.completed()), store.n_chunks, args.store
+    ))
+
+
+def run_tables(args):
+    obsmodes = args.obsmodes
+    if obsmodes is None:
+        telescopes = sorted(TELESCOPE_AREAS) if args.telescopes is None else args.telescopes
+        obsmodes = [obsmode for tel in telescopes for obsmode in list_obsmodes(tel)]
+    table = extinction.extinction_table(obsmodes, args.specs)
+    table.save(args.output)
+    print("{} obsmodes written to {}".format(len(table.obsmodes), args.output))
+
+
+def main(argv=None):
+    from . import server
+
+    parser = argparse.ArgumentParser(
+        prog='ucam-thruput',
+        description="Throughput models for HiPERCAM, ULTRACAM and ULTRASPEC"
+    )
+    parser.add_argument('--backend', choices=sorted(BACKENDS),
+                        help='photometry kernel backend (default numpy, or '
+                             '$UCAM_THRUPUT_BACKEND)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    phot = subparsers.add_parser(
+        'photometry', help='count rates and magnitudes for a target table',
+        description=__doc__.split('\n\n')[1]
+    )
+    phot.add_argument('input', help='CSV or FITS target table (- for CSV on stdin)')
+    phot.add_argument('output', nargs='?', default='-', help='output CSV table (default stdout)')
+    phot.add_argument('--obsmode', action='append', dest='obsmodes',
+                      help='obsmode to evaluate every target in (may be repeated, '
+                           'or "all" for every obsmode on the target\'s telescope)')
+    phot.add_argument('--mag-obsmode', help='obsmode in which the mag column is measured '
+                                            '(needed for several obsmodes per target)')
+    phot.add_argument('--chunk-size', type=int, default=10000, help='targets per chunk')
+    phot.add_argument('--processes', type=int, default=1, help='worker processes')
+    phot.add_argument('--quiet', action='store_true', help='do not report progress')
+    phot.set_defaults(func=run_photometry)
+
+    plan = subparsers.add_parser('plan', help='plan a sweep into a work queue')
+    plan.add_argument('input', help='CSV or FITS target table (- for CSV on stdin)')
+    plan.add_argument('queue', help='queue directory, on a shared filesystem')
+    plan.add_argument('--obsmode', action='append', dest='obsmodes',
+                      help='obsmode to evaluate (may be repeated, default every obsmode '
+                           'on every telescope)')
+    plan.add_argument('--telescope', action='append', dest='telescopes',
+                      help='telescope for the default obsmodes (may be repeated)')
+    plan.add_argument('--condition', action='append', dest='conditions',
+                      help='extra obsmode keywords for an observing condition, '
+                           'e.g noatmos (may be repeated)')
+    plan.add_argument('--mag-obsmode', help='obsmode in which the mag column is measured')
+    plan.add_argument('--shard-size', type=int, default=1000, help='targets per shard')
+    plan.set_defaults(func=run_plan)
+
+    worker = subparsers.add_parser('worker', help='work through the shards of a queue')
+    worker.add_argument('queue', help='queue directory')
+    worker.add_argument('--stale-timeout', type=float, default=workqueue.DEFAULT_STALE_TIMEOUT,
+                        help='age (s) after which claims are taken to be abandoned')
+    worker.add_argument('--max-shards', type=int, help='stop after this many shards')
+    worker.add_argument('--quiet', action='store_true', help='do not report progress')
+    worker.set_defaults(func=run_worker)
+
+    status = subparsers.add_parser('status', help='progress of a work queue')
+    status.add_argument('queue', help='queue directory')
+    status.set_defaults(func=run_status)
+
+    merge = subparsers.add_parser('merge', help='merge finished shards into a result store')
+    merge.add_argument('queue', help='queue directory')
+    merge.add_argument('store', help='result store directory')
+    merge.set_defaults(func=run_merge)
+
+    tables = subparsers.add_parser(
+        'tables', help='zeropoint and extinction coefficient tables for real-time reduction'
+    )
+    tables.add_argument('output', help='output .npz file')
+    tables.add_argument('--obsmode', action='append', dest='obsmodes',
+                        help='obsmode to include (may be repeated, default every obsmode '
+                             'on every telescope)')
+    tables.add_argument('--telescope', action='append', dest='telescopes',
+                        help='telescope for the default obsmodes (may be repeated)')
+    tables.add_argument('--spec', action='append', dest='specs',
+                        help='spectrum to fit the coefficients over, e.g pickles:G2V '
+                             '(may be repeated, default blackbodies)')
+    tables.set_defaults(func=run_tables)
+
+    serve = subparsers.add_parser('serve', help='run the photometry service')
+    server.add_arguments(serve)
+    serve.set_defaults(func=lambda args: server.serve(
+        args.host, args.port, args.telescopes, args.max_batch, args.batch_window
+    ))
+
+    args = parser.parse_args(argv)
+    if args.backend is not None:
+        # worker processes pick the backend up from the environment
+        os.environ['UCAM_THRUPUT_BACKEND'] = args.backend
+        set_backend(args.backend)
+    try:
+        args.func(args)
+    except ValueError as err:
+        parser.error(str(err))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Compact in-memory bandpasses, for holding every obsmode at once.
+
+A `CompactBandpass` keeps only the part of a throughput curve where it is
+non-zero, optionally in single precision, and refers to a wavelength grid
+shared by every bandpass rather than holding its own. Single precision
+throughputs are checked against the double precision originals when they
+are made, so the error they introduce is bounded.
+
+Bandpasses are only turned into `synphot.SpectralElement` objects when
+they are passed to code that needs one, with `CompactBandpass.to_spectral_element`.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET, list_obsmodes, obsmode_area, throughput, waveset_key
+from .photometry import ABZERO, H, trapezoid_weights
+
+# largest error allowed from storing a throughput in reduced precision, as a
+# fraction of its peak, and in the flat spectrum zeropoint (mag)
+THRU_RTOL = 1e-5
+ZEROPOINT_ATOL = 1e-5
+
+# waveset key -> (read-only waveset, read-only trapezoid weights)
+_WAVESETS = {}
+
+
+def shared_waveset(waveset=None):
+    """
+    A single read-only copy of a wavelength grid, and its trapezoid weights.
+
+    Every call with an identical grid returns the same arrays.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    key = waveset_key(waveset)
+    if key not in _WAVESETS:
+        waveset = np.array(waveset, dtype=np.float64)
+        weights = trapezoid_weights(waveset)
+        waveset.flags.writeable = False
+        weights.flags.writeable = False
+        _WAVESETS[key] = (waveset, weights)
+    return _WAVESETS[key]
+
+
+class CompactBandpass:
+    """
+    A throughput curve stored over its non-zero range on a shared wavelength grid.
+
+    Use `CompactBandpass.from_obsmode` to make one.
+
+    Parameters
+    ----------
+    obsmode : string
+        Obsmode of the bandpass.
+    airmass : float or None
+        Airmass of the atmospheric transmission, or None for the tabulated one.
+    waveset : `~numpy.ndarray`
+        Shared wavelength grid, see `shared_waveset`.
+    start : int
+        Index in ``waveset`` of the first stored throughput.
+    thru : `~numpy.ndarray`
+        Throughput from ``waveset[start]`` onwards; zero elsewhere.
+    """
+    __slots__ = ('obsmode', 'airmass', 'waveset', 'start', 'thru')
+
+    def __init__(self, obsmode, airmass, waveset, start, thru):
+        self.obsmode = obsmode
+        self.airmass = airmass
+        self.waveset = waveset
+        self.start = start
+        self.thru = thru
+
+    @classmethod
+    def from_obsmode(cls, obsmode, airmass=None, waveset=None, dtype=np.float32):
+        """
+        Build a compact bandpass for an obsmode.
+
+        Parameters
+        ----------
+        obsmode : string
+            Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+        airmass : float, optional
+            Airmass for the atmospheric transmission.
+        waveset : `~numpy.ndarray`, optional
+            Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+        dtype : `~numpy.dtype`, optional
+            Storage type for the throughput.
+        """
+        waveset, weights = shared_waveset(waveset)
+        full = throughput(obsmode, waveset, airmass, cache=False)
+        nonzero = np.flatnonzero(full)
+        if len(nonzero):
+            # keep a zero at each end, so interpolation within the grid is unchanged
+            start = max(nonzero[0] - 1, 0)
+            stop = min(nonzero[-1] + 2, len(waveset))
+        else:
+            start = stop = 0
+        thru = full[start:stop].astype(dtype)
+        thru.flags.writeable = False
+        bandpass = cls(obsmode, airmass, waveset, start, thru)
+        if np.dtype(dtype) != np.float64 and len(thru):
+            bandpass._check_precision(full, weights)
+        return bandpass
+
+    def _check_precision(self, full, weights):
+        error = np.max(np.abs(self.thru - full[self.start:self.stop])) / np.max(full)
+        flat = ABZERO / (H * self.waveset)
+        zp_full = 2.5 * np.log10(np.dot(flat * weights, full))
+        zp = 2.5 * np.log10(np.dot((flat * weights)[self.start:self.stop], self.thru))
+        if error > THRU_RTOL or abs(zp - zp_full) > ZEROPOINT_ATOL:
+            raise ValueError(
+                "Storing {} as {} gives errors of {:.2g} in throughput and {:.2g} mag "
+                "in zeropoint".format(self.obsmode, self.thru.dtype, error, zp - zp_full)
+            )
+
+    @property
+    def stop(self):
+        return self.start + len(self.thru)
+
+    @property
+    def wave(self):
+        """
+        Wavelengths (Angstroms) of the stored throughputs, a view of the shared grid.
+        """
+        return self.waveset[self.start:self.stop]
+
+    @property
+    def nbytes(self):
+        return self.thru.nbytes
+
+    def __call__(self):
+        """
+        The throughput in double precision over the whole wavelength grid.
+        """
+        full = np.zeros(len(self.waveset))
+        full[self.start:self.stop] = self.thru
+        return full
+
+    def __repr__(self):
+        return "<CompactBandpass {}{} {}-{}AA {}>".format(
+            self.obsmode, '' if self.airmass is None else ' X={:g}'.format(self.airmass),
+            self.wave[0] if len(self.thru) else '', self.wave[-1] if len(self.thru) else '',
+            self.thru.dtype
+        )
+
+    def countrate(self, flux, area=None):
+        """
+        Count rates (counts/s) of spectra sampled on the whole wavelength grid.
+
+        Only the part of each spectrum within the stored range is used.
+        """
+        if area is None:
+            area = obsmode_area(self.obsmode)
+        weights = shared_waveset(self.waveset)[1][self.start:self.stop]
+        flux = np.asarray(flux)[..., self.start:self.stop]
+        return area * np.dot(flux, weights * self.thru)
+
+    def to_spectral_element(self):
+        """
+        A `synphot.SpectralElement` holding a double precision copy of the throughput.
+        """
+        import synphot as syn
+        return syn.SpectralElement(
+            syn.Empirical1D, points=np.array(self.wave), lookup_table=self.thru.astype(np.float64),
+            meta=dict(expr=str(self.obsmode), airmass=self.airmass)
+        )
+
+
+class BandpassSet:
+    """
+    Compact bandpasses for many obsmodes and airmasses, on one shared wavelength grid.
+
+    Bandpasses are looked up by obsmode, or by ``(obsmode, airmass)``.
+
+    Parameters
+    ----------
+    obsmodes : list, optional
+        Obsmodes to include. Defaults to every obsmode on every telescope.
+    airmasses : sequence, optional
+        Airmasses to include for each obsmode. None gives the tabulated
+        atmosphere.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    dtype : `~numpy.dtype`, optional
+        Storage type for the throughputs.
+    """
+    def __init__(self, obsmodes=None, airmasses=(None,), waveset=None, dtype=np.float32):
+        if obsmodes is None:
+            obsmodes = list_obsmodes()
+        self.waveset = shared_waveset(waveset)[0]
+        self.obsmodes = list(obsmodes)
+        self.airmasses = list(airmasses)
+        self._bandpasses = {
+            (obsmode, airmass): CompactBandpass.from_obsmode(obsmode, airmass, self.waveset, dtype)
+            for obsmode in self.obsmodes for airmass in self.airmasses
+        }
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = (key, self.airmasses[0])
+        try:
+            return self._bandpasses[key]
+        except KeyError:
+            raise ValueError("No bandpass for {} in this set".format(key))
+
+    def __len__(self):
+        return len(self._bandpasses)
+
+    def __iter__(self):
+        return iter(self._bandpasses.values())
+
+    @property
+    def nbytes(self):
+        """
+        Memory (bytes) used by the throughputs and the shared wavelength grid.
+        """
+        return sum(bp.nbytes for bp in self) + self.waveset.nbytes
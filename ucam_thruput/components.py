@@ -0,0 +1,216 @@
+"""
+Content-addressed loading of component throughput curves.
+
+Many of the component files shipped with ``ucam_thruput`` hold numerically
+identical curves, because they were generated from the same model (e.g. the
+ULTRACAM collimator curves for the WHT and NTT). Curves are keyed by a hash
+of their contents, so that each unique curve is held in memory (and copied
+to CDBS) only once, and caches keyed on the hash reflect the real variety
+of curves.
+
+Fitted or remeasured curves can be saved as new versions of a component in
+the user directory, with `write_version`. The latest version of a component
+is used in place of the packaged file, here and in the tables installed for
+``stsynphot`` by `ucam_thruput.setup`.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import glob
+import hashlib
+import importlib.resources
+import os
+import pathlib
+
+import numpy as np
+
+CLEAR = 'clear'
+
+# component name -> content hash
+_DIGESTS = {}
+# content hash -> (wavelength, throughput)
+_CURVES = {}
+# data directory -> groups of packaged components, see unique_components
+_GROUPS = {}
+
+
+def _data_dir():
+    return importlib.resources.files("ucam_thruput") / "data"
+
+
+def component_names():
+    """
+    Names of all the components with throughput files in the package.
+    """
+    return sorted(
+        entry.name[:-4] for entry in _data_dir().iterdir()
+        if entry.name.endswith(".txt")
+    )
+
+
+def _version_dir():
+    return os.path.join(os.path.expanduser("~/.ucam_thruput"), "components")
+
+
+def component_versions(name):
+    """
+    Files holding saved versions of a component, oldest first.
+    """
+    pattern = os.path.join(_version_dir(), name + "_v[0-9]*.txt")
+    return sorted(glob.glob(pattern))
+
+
+def component_file(name):
+    """
+    Location of the throughput file for a component.
+
+    This is the latest saved version of the component if there is one,
+    otherwise the file shipped with the package.
+    """
+    versions = component_versions(name)
+    if versions:
+        return pathlib.Path(versions[-1])
+    return _data_dir() / (name + ".txt")
+
+
+def write_version(name, wave, thru, comment=None):
+    """
+    Save a new version of a component's throughput curve.
+
+    The new version is used for the component from then on. Re-run
+    `ucam_thruput.setup` to use it with ``stsynphot`` as well.
+
+    Parameters
+    ----------
+    name : string
+        Component name.
+    wave, thru : `~numpy.ndarray`
+        Wavelength (Angstroms) and throughput.
+    comment : string, optional
+        Written to the header of the file.
+
+    Returns
+    -------
+    filename : string
+        The file the new version was written to.
+    """
+    if name == CLEAR:
+        raise ValueError("Cannot write a throughput curve for {}".format(CLEAR))
+    wave = np.asarray(wave, dtype=np.float64)
+    thru = np.asarray(thru, dtype=np.float64)
+    if wave.shape != thru.shape or wave.ndim != 1:
+        raise ValueError("wave and thru must be 1D arrays of the same length")
+    from . import _check_user_dir
+    _check_user_dir()
+    if not os.path.exists(_version_dir()):
+        os.mkdir(_version_dir())
+    stamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
+    filename = os.path.join(_version_dir(), "{}_v{}.txt".format(name, stamp))
+    header = "{} version {}".format(name, stamp)
+    if comment:
+        header += "\n" + comment
+    # write then rename, so a partly written file is never picked up
+    np.savetxt(filename + ".tmp", np.column_stack((wave, thru)), header=header)
+    os.replace(filename + ".tmp", filename)
+    _DIGESTS.pop(name, None)
+    _GROUPS.clear()
+    return filename
+
+
+def _hash_curve(wave, thru):
+    sha = hashlib.sha1()
+    sha.update(wave.tobytes())
+    sha.update(thru.tobytes())
+    return sha.hexdigest()
+
+
+def _read_curve(name):
+    resource = component_file(name)
+    if not resource.is_file():
+        raise ValueError("No throughput file for component {}".format(name))
+    with resource.open("rb") as f:
+        wave, thru = np.loadtxt(f, dtype=np.float64).T
+    # some files are tabulated in descending order of wavelength
+    indices = np.argsort(wave, kind="stable")
+    wave = np.ascontiguousarray(wave[indices])
+    # negative throughputs are set to zero, as synphot does
+    thru = np.ascontiguousarray(np.clip(thru[indices], 0, None))
+    return wave, thru
+
+
+def load_component(name):
+    """
+    Load the throughput curve of a component.
+
+    Components with identical curves share the same (read-only) arrays.
+
+    Parameters
+    ----------
+    name : string
+        Component name, as used in the instrument graph table.
+
+    Returns
+    -------
+    wave, thru : `~numpy.ndarray`
+        Wavelength (Angstroms) in ascending order, and throughput.
+    """
+    digest = _DIGESTS.get(name)
+    if digest is None:
+        wave, thru = _read_curve(name)
+        digest = _hash_curve(wave, thru)
+        if digest not in _CURVES:
+            wave.flags.writeable = False
+            thru.flags.writeable = False
+            _CURVES[digest] = (wave, thru)
+        _DIGESTS[name] = digest
+    return _CURVES[digest]
+
+
+def component_digest(name):
+    """
+    Content hash of a component's throughput curve.
+
+    Identical curves have identical digests, so this is suitable as a cache key.
+    """
+    if name not in _DIGESTS:
+        load_component(name)
+    return _DIGESTS[name]
+
+
+def _component_groups():
+    key = str(_data_dir())
+    if key not in _GROUPS:
+        groups = {}
+        for name in component_names():
+            groups.setdefault(component_digest(name), []).append(name)
+        _GROUPS[key] = groups
+    return _GROUPS[key]
+
+
+def unique_components():
+    """
+    Group all packaged components by the content of their throughput curves.
+
+    Returns
+    -------
+    groups : dict
+        Mapping of content hash to a sorted list of the names of all components
+        sharing that curve.
+    """
+    return {digest: list(names) for digest, names in _component_groups().items()}
+
+
+def canonical_name(name):
+    """
+    Name of the component whose file is used to represent a component's curve.
+
+    This is the file name, without extension, of the first (alphabetically)
+    of all the components sharing the same curve. Components with no
+    throughput file are their own canonical name.
+    """
+    if name == CLEAR or not component_file(name).is_file():
+        return name
+    first = _component_groups()[component_digest(name)][0]
+    return component_file(first).name[:-4]
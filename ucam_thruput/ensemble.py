@@ -0,0 +1,181 @@
+"""
+Monte Carlo propagation of component throughput uncertainties.
+
+Each component along an obsmode's light path is perturbed by a grey scale
+error, a linear tilt across the optical and a wavelength shift (for
+coating edges). K realisations of the whole chain are built as a K x
+wavelength array stack, a chunk of realisations at a time to bound memory,
+and reduced to distributions of pivot wavelength, zeropoint and synthetic
+magnitudes.
+
+Random draws for a component depend only on the seed, the component
+name and how many times the component has already appeared in the chain.
+Ensembles for different obsmodes that share components (such as a CCD)
+therefore share the same realisations of those components, and colours
+or colour terms built from them are correctly correlated, while repeated
+components such as the aluminium coatings of separate mirrors are
+perturbed independently.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, component_curve, obsmode_area,
+                       obsmode_components)
+from .components import load_component
+from .field import angle_sensitive
+from .photometry import abmag, pivot_wavelength, zeropoint
+
+# 1-sigma errors: fractional grey scale, fractional tilt between 3000 and
+# 11000 Angstroms, and wavelength shift (Angstroms)
+Uncertainty = namedtuple("Uncertainty", ['scale', 'tilt', 'shift'])
+Ensemble = namedtuple("Ensemble", ['pivot', 'zeropoint', 'abmag'])
+
+COATING_UNCERTAINTY = Uncertainty(0.01, 0.01, 0.0)
+CCD_UNCERTAINTY = Uncertainty(0.03, 0.03, 0.0)
+DICHROIC_UNCERTAINTY = Uncertainty(0.005, 0.0, 5.0)
+FILTER_UNCERTAINTY = Uncertainty(0.01, 0.0, 2.0)
+ATMOSPHERE_UNCERTAINTY = Uncertainty(0.01, 0.02, 0.0)
+
+
+def component_uncertainty(name):
+    """
+    Default uncertainty for a component, based on what kind of component it is.
+    """
+    if name == 'atmos':
+        return ATMOSPHERE_UNCERTAINTY
+    if '_ccd' in name:
+        return CCD_UNCERTAINTY
+    if '_dich' in name:
+        return DICHROIC_UNCERTAINTY
+    if angle_sensitive(name):
+        return FILTER_UNCERTAINTY
+    return COATING_UNCERTAINTY
+
+
+def _draws(name, occurrence, uncertainty, n_samples, seed):
+    # seed from the component name and occurrence, so components are
+    # independent of each other but the same in every obsmode
+    name_seed = int(hashlib.sha1(name.encode()).hexdigest()[:8], 16)
+    rng = np.random.default_rng([seed, name_seed, occurrence])
+    return rng.standard_normal((3, n_samples)) * np.array(uncertainty)[:, np.newaxis]
+
+
+def throughput_ensemble(obsmode, n_samples, seed=0, chunk_size=256, uncertainties=None,
+                        waveset=None):
+    """
+    Perturbed realisations of an obsmode's throughput.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+    n_samples : int
+        Number of realisations.
+    seed : int, optional
+        Seed for the random draws.
+    chunk_size : int, optional
+        Number of realisations yielded at a time.
+    uncertainties : dict, optional
+        `Uncertainty` for each component name, overriding the defaults from
+        `component_uncertainty`.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Yields
+    ------
+    thru : `~numpy.ndarray`
+        Throughputs of shape ``(n, n_wave)``, for successive chunks of at most
+        ``chunk_size`` realisations.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    if uncertainties is None:
+        uncertainties = {}
+    # each position along the chain, as (name, number of earlier occurrences)
+    components = obsmode_components(obsmode)
+    positions = [(name, components[:i].count(name)) for i, name in enumerate(components)]
+    draws = {
+        position: _draws(position[0], position[1],
+                         uncertainties.get(position[0], component_uncertainty(position[0])),
+                         n_samples, seed)
+        for position in positions
+    }
+    x = (waveset - 7000.0) / 8000.0
+
+    # curves which are not shifted are the same in every realisation
+    static = np.ones(len(waveset))
+    for position in positions:
+        if not np.any(draws[position][2]):
+            static *= component_curve(position[0], waveset)
+
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        thru = np.empty((stop - start, len(waveset)))
+        thru[:] = static
+        factor = np.empty_like(thru)
+        grey = np.ones(stop - start)
+        for position in positions:
+            scale, tilt, shift = draws[position][:, start:stop]
+            if np.any(shift):
+                wave, curve = load_component(position[0])
+                thru *= np.interp(waveset - shift[:, np.newaxis], wave, curve)
+            # (1 + s + t x) = (1 + s) (1 + t x / (1 + s)), so grey errors are
+            # applied with a single multiplication at the end
+            grey *= np.clip(1 + scale, 0, None)
+            if np.any(tilt):
+                np.multiply.outer(tilt / (1 + scale), x, out=factor)
+                factor += 1
+                np.clip(factor, 0, None, out=factor)
+                thru *= factor
+        thru *= grey[:, np.newaxis]
+        yield thru
+
+
+def ensemble_photometry(obsmode, n_samples=1000, flux=None, seed=0, chunk_size=256,
+                        uncertainties=None, waveset=None):
+    """
+    Distributions of pivot wavelength, zeropoint and magnitudes.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+    n_samples : int, optional
+        Number of realisations.
+    flux : `~numpy.ndarray`, optional
+        Stack of N spectra (PHOTLAM) sampled on ``waveset``.
+    seed : int, optional
+        Seed for the random draws.
+    chunk_size : int, optional
+        Number of realisations held in memory at once.
+    uncertainties : dict, optional
+        `Uncertainty` for each component name, overriding the defaults.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    ensemble : `Ensemble`
+        Pivot wavelengths and AB zeropoints (1 count/s) of shape
+        ``(n_samples,)``, and if spectra are given, AB magnitudes of shape
+        ``(n_samples, N)``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    area = obsmode_area(obsmode)
+    pivots, zps, mags = [], [], []
+    for thru in throughput_ensemble(obsmode, n_samples, seed, chunk_size, uncertainties, waveset):
+        pivots.append(pivot_wavelength(thru, waveset))
+        zps.append(zeropoint(thru, waveset, area))
+        if flux is not None:
+            mags.append(abmag(np.atleast_2d(flux), thru, waveset).T)
+    return Ensemble(
+        np.concatenate(pivots), np.concatenate(zps),
+        np.concatenate(mags) if flux is not None else None
+    )
@@ -0,0 +1,184 @@
+"""
+Zeropoint and extinction coefficient tables for real-time reduction.
+
+The AB magnitude of a star observed at airmass X with a count rate R is
+modelled as
+
+    m = zeropoint - 2.5 log10(R) - k' X - k'' X c
+
+where the zeropoint is that above the atmosphere, k' and k'' are the first
+and second order extinction coefficients, and c is the star's g - r colour
+in the AB system of the same instrument and telescope, above the
+atmosphere.
+
+The coefficients are fitted for every obsmode at once, from count rates
+of a set of stellar spectra through the atmospheric transmission at each
+of a grid of airmasses. The fitted values are kept in flat arrays, so a
+reduction pipeline can find an obsmode's row once and then calibrate each
+frame with a few array lookups and no synphot calls.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, list_obsmodes, obsmode_area, parse_obsmode,
+                       throughput, throughput_stack)
+from .photometry import abmag, countrate, zeropoint
+from .spectra import from_spec
+
+ExtinctionCoefficients = namedtuple(
+    "ExtinctionCoefficients", ['zeropoint', 'k1', 'k2', 'rms']
+)
+
+DEFAULT_SPECS = ['bb:{:.0f}'.format(teff) for teff in np.geomspace(3000.0, 30000.0, 15)]
+DEFAULT_AIRMASSES = np.linspace(1.0, 3.0, 11)
+
+
+def colour_obsmodes(obsmode):
+    """
+    The obsmodes in which the g - r colour is measured for an obsmode.
+    """
+    instrument, telescope = parse_obsmode(obsmode)[:2]
+    return tuple(','.join((instrument, telescope, name, 'noatmos')) for name in ('g', 'r'))
+
+
+class ExtinctionTable:
+    """
+    Zeropoints and extinction coefficients for a set of obsmodes.
+
+    Parameters
+    ----------
+    obsmodes : list
+        Obsmodes in the table.
+    zeropoint : `~numpy.ndarray`
+        AB magnitude giving 1 count/s above the atmosphere, for each obsmode.
+    k1, k2 : `~numpy.ndarray`
+        First (mag/airmass) and second (mag/airmass/mag) order extinction
+        coefficients for each obsmode.
+    rms : `~numpy.ndarray`
+        RMS residual (mag) of the fit for each obsmode.
+    airmasses : `~numpy.ndarray`
+        Airmasses over which the coefficients were fitted.
+    specs : list
+        Spectra over which the coefficients were fitted.
+    """
+    def __init__(self, obsmodes, zeropoint, k1, k2, rms, airmasses, specs):
+        self.obsmodes = list(obsmodes)
+        self.index = {obsmode: i for i, obsmode in enumerate(self.obsmodes)}
+        self.zeropoint = zeropoint
+        self.k1 = k1
+        self.k2 = k2
+        self.rms = rms
+        self.airmasses = np.asarray(airmasses, dtype=np.float64)
+        self.specs = list(specs)
+
+    def row(self, obsmode):
+        """
+        Index of an obsmode's row in the coefficient arrays.
+        """
+        try:
+            return self.index[obsmode]
+        except KeyError:
+            raise ValueError("Obsmode {} is not in this extinction table".format(obsmode))
+
+    def __getitem__(self, obsmode):
+        i = self.row(obsmode)
+        return ExtinctionCoefficients(self.zeropoint[i], self.k1[i], self.k2[i], self.rms[i])
+
+    def magnitude(self, row, rate, airmass, colour=0.0):
+        """
+        AB magnitudes from count rates.
+
+        Parameters
+        ----------
+        row : int or `~numpy.ndarray`
+            Rows of the table, from `row`.
+        rate : float or `~numpy.ndarray`
+            Count rates (counts/s).
+        airmass : float or `~numpy.ndarray`
+            Airmass of each observation.
+        colour : float or `~numpy.ndarray`, optional
+            AB g - r colour of each star.
+        """
+        airmass = np.asarray(airmass, dtype=np.float64)
+        return (self.zeropoint[row] - 2.5 * np.log10(rate)
+                - airmass * (self.k1[row] + self.k2[row] * colour))
+
+    def save(self, filename):
+        np.savez(filename, obsmodes=np.array(self.obsmodes), zeropoint=self.zeropoint,
+                 k1=self.k1, k2=self.k2, rms=self.rms, airmasses=self.airmasses,
+                 specs=np.array(self.specs))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['obsmodes'].tolist(), data['zeropoint'], data['k1'], data['k2'],
+                       data['rms'], data['airmasses'], data['specs'].tolist())
+
+
+def extinction_table(obsmodes=None, specs=None, airmasses=None, waveset=None):
+    """
+    Fit zeropoints and extinction coefficients for many obsmodes.
+
+    Parameters
+    ----------
+    obsmodes : list, optional
+        Obsmodes to include. Defaults to every obsmode on every telescope.
+    specs : list, optional
+        Descriptions of the stellar spectra to fit over, see
+        `ucam_thruput.spectra.from_spec`. Defaults to blackbodies from 3000
+        to 30000K; Pickles templates can be used if ``$PYSYN_CDBS`` is set.
+    airmasses : `~numpy.ndarray`, optional
+        Airmasses to fit over.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    table : `ExtinctionTable`
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    if obsmodes is None:
+        obsmodes = list_obsmodes()
+    specs = DEFAULT_SPECS if specs is None else list(specs)
+    airmasses = DEFAULT_AIRMASSES if airmasses is None else np.asarray(airmasses, dtype=np.float64)
+    if len(specs) < 2:
+        raise ValueError("need at least two spectra to fit the colour term")
+
+    flux = np.array([from_spec(spec, waveset) for spec in specs])
+    area = np.array([obsmode_area(obsmode) for obsmode in obsmodes])
+
+    # colours of every spectrum for each instrument and telescope
+    pairs = [colour_obsmodes(obsmode) for obsmode in obsmodes]
+    unique_pairs = sorted(set(pairs))
+    pair_index = np.array([unique_pairs.index(pair) for pair in pairs])
+    mags = abmag(flux, throughput_stack([mode for pair in unique_pairs for mode in pair], waveset),
+                 waveset)
+    colours = (mags[:, 0::2] - mags[:, 1::2])[:, pair_index]
+
+    # magnitudes lost to the atmosphere, of shape (n_airmasses, n_specs, n_obsmodes)
+    above_thru = throughput_stack([obsmode + ',noatmos' for obsmode in obsmodes], waveset)
+    above = countrate(flux, above_thru, waveset, area)
+    loss = np.empty((len(airmasses),) + above.shape)
+    for j, airmass in enumerate(airmasses):
+        thru = np.vstack([throughput(obsmode, waveset, airmass, cache=False) for obsmode in obsmodes])
+        loss[j] = -2.5 * np.log10(countrate(flux, thru, waveset, area) / above)
+
+    # least squares fit of loss = X (k' + k'' c) for every obsmode
+    k1 = np.empty(len(obsmodes))
+    k2 = np.empty(len(obsmodes))
+    rms = np.empty(len(obsmodes))
+    x = np.broadcast_to(airmasses[:, np.newaxis], loss.shape[:2]).ravel()
+    for i in range(len(obsmodes)):
+        design = np.column_stack((x, x * np.broadcast_to(colours[:, i], loss.shape[:2]).ravel()))
+        y = loss[..., i].ravel()
+        (k1[i], k2[i]), _, _, _ = np.linalg.lstsq(design, y, rcond=None)
+        rms[i] = np.sqrt(np.mean((y - design.dot((k1[i], k2[i])))**2))
+
+    zp = zeropoint(above_thru, waveset, area)
+    return ExtinctionTable(obsmodes, zp, k1, k2, rms, airmasses, specs)
@@ -0,0 +1,160 @@
+"""
+Field-position dependent bandpasses.
+
+Interference filters and dichroics shift blueward when light arrives
+away from normal incidence. ``scripts/fix_filter_bandpass.py`` corrects
+the tabulated curves for the f-ratio of the on-axis beam; here the extra
+shift from the chief ray angle at each field position is applied to all
+the angle-sensitive components of an obsmode at once, so a grid of field
+angles is evaluated as array operations over blocks of angles.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, component_curve, obsmode_area,
+                       obsmode_components)
+from .components import load_component
+from .photometry import abmag, colour_term, zeropoint
+
+FieldBandpasses = namedtuple(
+    "FieldBandpasses", ['angles', 'throughput', 'zeropoint', 'colour_term']
+)
+
+
+def _filter_components():
+    from .hcam import Hcam
+    from .ucam import Ucam
+    from .uspec import Uspec
+
+    filters = chain(
+        chain(*Ucam._filter_groupings.values()),
+        chain(*Hcam._filter_groupings.values()),
+        Uspec._filter_list
+    )
+    return set(filt.thruput_reference for filt in filters)
+
+
+def angle_sensitive(component):
+    """
+    Is this component an interference filter or dichroic?
+    """
+    return '_dich' in component or component in _filter_components()
+
+
+def shift_factor(angles, n_eff=1.5):
+    """
+    Fractional wavelength shift of an interference coating.
+
+    Parameters
+    ----------
+    angles : float or `~numpy.ndarray`
+        Angles of incidence (degrees).
+    n_eff : float, optional
+        Effective refractive index of the coating. The default of 1.5 matches
+        that used in ``scripts/fix_filter_bandpass.py``.
+    """
+    sin_theta = np.sin(np.radians(angles))
+    return np.sqrt(1 - (sin_theta / n_eff)**2)
+
+
+def field_throughput(obsmode, angles, n_eff=1.5, waveset=None, block_size=256):
+    """
+    Throughput of an obsmode at a grid of field angles.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'hcam,gtc,g'``.
+    angles : `~numpy.ndarray`
+        Chief ray angle of incidence (degrees) on the filters and dichroics,
+        of any shape. An angle of zero gives the on-axis bandpass.
+    n_eff : float, optional
+        Effective refractive index of the coatings.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    block_size : int, optional
+        Number of field angles evaluated at once, which bounds the memory
+        used on top of the result.
+
+    Returns
+    -------
+    thru : `~numpy.ndarray`
+        Throughputs, of shape ``angles.shape + waveset.shape``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    angles = np.asarray(angles, dtype=np.float64)
+    components = obsmode_components(obsmode)
+    sensitive = [angle_sensitive(name) for name in components]
+    curves = [load_component(name) if shifted else component_curve(name, waveset)
+              for name, shifted in zip(components, sensitive)]
+
+    flat = angles.ravel()
+    thru = np.empty((len(flat), len(waveset)))
+    for start in range(0, len(flat), block_size):
+        block = thru[start:start + block_size]
+        # a coating curve T(lambda) moves to T(lambda / factor) at oblique incidence
+        shifted_wave = np.multiply.outer(1 / shift_factor(flat[start:start + block_size], n_eff),
+                                         waveset)
+        block.fill(1.0)
+        # in the order of the chain, as `throughput` does, so that on axis they agree exactly
+        for shifted, curve in zip(sensitive, curves):
+            if shifted:
+                block *= np.interp(shifted_wave, *curve)
+            else:
+                block *= curve
+    return thru.reshape(angles.shape + waveset.shape)
+
+
+def field_bandpasses(obsmode, angles, flux=None, colours=None, n_eff=1.5, waveset=None):
+    """
+    Bandpasses, zeropoints and colour terms over a grid of field angles.
+
+    Parameters
+    ----------
+    obsmode : string
+        Comma separated list of keywords, e.g ``'hcam,gtc,g'``.
+    angles : `~numpy.ndarray`
+        Chief ray angle of incidence (degrees) on the filters and dichroics,
+        of any shape.
+    flux : `~numpy.ndarray`, optional
+        A stack of N spectra in PHOTLAM, sampled on ``waveset``, used to
+        calculate colour terms.
+    colours : `~numpy.ndarray`, optional
+        Colours of the N spectra. Required if ``flux`` is given.
+    n_eff : float, optional
+        Effective refractive index of the coatings.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    result : `FieldBandpasses`
+        The angle grid; throughputs of shape ``angles.shape + waveset.shape``;
+        AB zeropoints (1 count/s) of shape ``angles.shape``; and, if spectra are
+        given, the slope of the magnitude relative to the on-axis bandpass
+        against colour, of shape ``angles.shape``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    angles = np.asarray(angles, dtype=np.float64)
+    thru = field_throughput(obsmode, angles, n_eff, waveset)
+    zp = zeropoint(thru, waveset, obsmode_area(obsmode))
+
+    cterm = None
+    if flux is not None:
+        if colours is None:
+            raise ValueError("colours of spectra are needed to calculate colour terms")
+        flux = np.atleast_2d(flux)
+        on_axis = field_throughput(obsmode, 0.0, n_eff, waveset)
+        ref_mag = abmag(flux, on_axis, waveset)
+        # magnitudes have spectra along the first axis; move them to the last
+        mag = np.moveaxis(abmag(flux, thru, waveset), 0, -1)
+        cterm = colour_term(mag, ref_mag, colours)
+    return FieldBandpasses(angles, thru, zp, cterm)
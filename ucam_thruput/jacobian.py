@@ -0,0 +1,127 @@
+"""
+Analytic derivatives of synthetic magnitudes with respect to component throughputs.
+
+For an obsmode with components T_1 ... T_C, the total throughput is
+T = T_1 * ... * T_C, so the derivative of a magnitude with respect to
+component c at wavelength i is the derivative with respect to T_i times
+the product of every other component, P_c. The P_c are formed once per
+chain and cached by `ucam_thruput.bandpass.partial_products`.
+
+Two magnitudes are supported: the instrumental magnitude
+-2.5 log10(count rate), which is what is compared to observed count rates
+of standard stars, and the AB magnitude. AB magnitudes are normalised by
+the bandpass, so they are unchanged by grey changes in throughput.
+
+Gradients can be returned for every wavelength of every component curve,
+or projected onto a basis of perturbations, such as low-order polynomials
+or wavelength shifts, to give derivatives with respect to the parameters
+of the perturbations.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, component_stack, obsmode_area,
+                       partial_products)
+from .photometry import ABZERO, H, trapezoid_weights
+
+MagnitudeGradients = namedtuple("MagnitudeGradients", ['components', 'mag', 'gradient'])
+
+_DMAG = -2.5 / np.log(10)
+
+
+def polynomial_basis(obsmode, order, waveset=None):
+    """
+    Basis for multiplicative Legendre polynomial perturbations of each component.
+
+    Component c becomes T_c * (1 + sum_p a_p L_p(x)), where x runs from -1 to 1
+    over the wavelength grid.
+
+    Returns
+    -------
+    basis : `~numpy.ndarray`
+        Array of shape (n_components, order + 1, n_wave).
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    _, curves = component_stack(obsmode, waveset)
+    x = np.linspace(-1, 1, len(waveset))
+    legendre = np.polynomial.legendre.legvander(x, order).T
+    return curves[:, np.newaxis, :] * legendre[np.newaxis, :, :]
+
+
+def shift_basis(obsmode, waveset=None):
+    """
+    Basis for wavelength shifts of each component.
+
+    Component c becomes T_c(lambda - delta), whose derivative with respect to
+    delta (Angstroms) is -dT_c/dlambda.
+
+    Returns
+    -------
+    basis : `~numpy.ndarray`
+        Array of shape (n_components, 1, n_wave).
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    _, curves = component_stack(obsmode, waveset)
+    return -np.gradient(curves, waveset, axis=-1)[:, np.newaxis, :]
+
+
+def magnitude_gradients(flux, obsmode, basis=None, kind='instrumental', waveset=None):
+    """
+    Magnitudes of spectra and their gradients with respect to each component.
+
+    Parameters
+    ----------
+    flux : `~numpy.ndarray`
+        Stack of N spectra (PHOTLAM) sampled on ``waveset``.
+    obsmode : string
+        Comma separated list of keywords, e.g ``'ucam,wht,g'``.
+    basis : `~numpy.ndarray`, optional
+        Additive perturbations to the component curves, either of shape
+        (P, n_wave), used for every component, or (n_components, P, n_wave).
+        See `polynomial_basis` and `shift_basis`.
+    kind : {'instrumental', 'abmag'}, optional
+        Which magnitude to differentiate.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    result : `MagnitudeGradients`
+        The component names; magnitudes of shape (N,); and gradients of shape
+        (N, n_components, n_wave), or (N, n_components, P) if a basis is given.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    if kind not in ('instrumental', 'abmag'):
+        raise ValueError("kind must be 'instrumental' or 'abmag', not {}".format(kind))
+    flux = np.atleast_2d(flux)
+    components, products = partial_products(obsmode, waveset)
+    _, curves = component_stack(obsmode, waveset)
+    thru = products[0] * curves[0]
+    weights = trapezoid_weights(waveset)
+
+    # derivative of each magnitude with respect to the total throughput
+    num = np.inner(flux, thru * weights)
+    dmag_dthru = _DMAG * flux * weights / num[:, np.newaxis]
+    if kind == 'instrumental':
+        mag = -2.5 * np.log10(obsmode_area(obsmode) * num)
+    else:
+        den = np.inner(thru, weights / waveset)
+        mag = -2.5 * np.log10(num / den * H / ABZERO)
+        dmag_dthru -= _DMAG * weights / waveset / den
+
+    if basis is None:
+        gradient = dmag_dthru[:, np.newaxis, :] * products[np.newaxis, :, :]
+    else:
+        basis = np.asarray(basis, dtype=np.float64)
+        if basis.ndim == 2:
+            basis = np.broadcast_to(basis, (len(components),) + basis.shape)
+        gradient = np.einsum('ni,ci,cpi->ncp', dmag_dthru, products, basis, optimize=True)
+    return MagnitudeGradients(components, mag, gradient)
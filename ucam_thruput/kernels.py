@@ -0,0 +1,275 @@
+"""
+Interchangeable implementations of the integration kernels used for photometry.
+
+Once spectra and throughputs are on a common wavelength grid, synthetic
+photometry is a set of weighted sums over wavelength. These are done by the
+current backend, which can be chosen at run time with `set_backend`, or with
+the ``UCAM_THRUPUT_BACKEND`` environment variable:
+
+* ``numpy`` - the reference implementation, using `numpy.inner` and
+  `numpy.einsum`.
+* ``numba`` - compiled, multi-threaded loops, if numba is installed.
+  Spectra tabulated on their own wavelength grid, such as those read from
+  files by `ucam_thruput.batch`, are interpolated, multiplied and
+  integrated in a single pass through a few bandpasses, without building
+  the resampled spectra.
+
+Every backend provides
+
+``inner(a, b)``
+    Sums over the last axis of every row of ``a`` with every row of ``b``,
+    with the shape of `numpy.inner`.
+``paired_inner(a, b)``
+    Sums over the last axis of ``a * b``, broadcasting the other axes.
+``interp_inner(wave, flux, b, waveset)``
+    ``inner(f, b)``, where ``f`` is ``flux``, tabulated at wavelengths
+    ``wave``, linearly interpolated onto ``waveset`` and zero outside the
+    tabulated range.
+
+`verify_backend` checks a backend against the reference implementation.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+import numpy as np
+
+DEFAULT_BACKEND = 'numpy'
+
+_BACKEND = None
+
+
+class NumpyBackend:
+    """
+    Reference implementation of the kernels.
+    """
+    name = 'numpy'
+
+    def inner(self, a, b):
+        return np.inner(a, b)
+
+    def paired_inner(self, a, b):
+        return np.einsum('...i,...i->...', a, b)
+
+    def interp_inner(self, wave, flux, b, waveset, block_size=256):
+        flux = np.atleast_2d(flux)
+        out = np.empty((len(flux),) + np.shape(b)[:-1])
+        for start in range(0, len(flux), block_size):
+            block = flux[start:start + block_size]
+            resampled = np.array([
+                np.interp(waveset, wave, spectrum, left=0.0, right=0.0) for spectrum in block
+            ])
+            out[start:start + block_size] = np.inner(resampled, b)
+        return out
+
+
+def _numba_kernels():
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def paired_inner(a, b, rows_a, rows_b, out):
+        for i in numba.prange(out.shape[0]):
+            ia = rows_a[i]
+            ib = rows_b[i]
+            total = 0.0
+            for k in range(a.shape[1]):
+                total += a[ia, k] * b[ib, k]
+            out[i] = total
+
+    @numba.njit
+    def _interp_row(wave, flux, waveset, k, j):
+        # both grids ascend, so the bracketing interval only moves forward
+        x = waveset[k]
+        while j < wave.shape[0] - 2 and wave[j + 1] < x:
+            j += 1
+        dx = wave[j + 1] - wave[j]
+        frac = (x - wave[j]) / dx if dx > 0 else 0.0
+        return flux[j] + frac * (flux[j + 1] - flux[j]), j
+
+    @numba.njit(parallel=True, cache=True)
+    def interp(wave, flux, waveset, out):
+        last = wave[wave.shape[0] - 1]
+        for i in numba.prange(flux.shape[0]):
+            j = 0
+            for k in range(waveset.shape[0]):
+                if waveset[k] < wave[0] or waveset[k] > last:
+                    out[i, k] = 0.0
+                else:
+                    out[i, k], j = _interp_row(wave, flux[i], waveset, k, j)
+
+    @numba.njit(parallel=True, cache=True)
+    def interp_inner(wave, flux, bt, waveset, out):
+        last = wave[wave.shape[0] - 1]
+        n_band = bt.shape[1]
+        for i in numba.prange(flux.shape[0]):
+            acc = np.zeros(n_band)
+            j = 0
+            for k in range(waveset.shape[0]):
+                if waveset[k] < wave[0] or waveset[k] > last:
+                    continue
+                value, j = _interp_row(wave, flux[i], waveset, k, j)
+                for m in range(n_band):
+                    acc[m] += value * bt[k, m]
+            for m in range(n_band):
+                out[i, m] = acc[m]
+
+    return paired_inner, interp, interp_inner
+
+
+class NumbaBackend:
+    """
+    Compiled, multi-threaded kernels using numba.
+
+    Dense products of many spectra with many bandpasses are left to
+    `numpy.inner`, as the BLAS library it calls is already compiled and
+    multi-threaded, and faster than a simple compiled loop. Interpolation
+    is fused with the integral when there are few bandpasses, and otherwise
+    done in compiled loops a block of spectra at a time.
+
+    Parameters
+    ----------
+    threads : int, optional
+        Number of threads. Defaults to numba's default, usually every core.
+    """
+    name = 'numba'
+    # most bandpasses for which interpolation is fused with integration
+    max_fused = 8
+
+    def __init__(self, threads=None):
+        import numba
+        if threads is not None:
+            numba.set_num_threads(threads)
+        self._paired_inner, self._interp, self._interp_inner = _numba_kernels()
+
+    def inner(self, a, b):
+        return np.inner(a, b)
+
+    def paired_inner(self, a, b):
+        a = np.asarray(a, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        shape = np.broadcast_shapes(a.shape[:-1], b.shape[:-1])
+        # rows of each input used for each output, without broadcasting the data
+        rows_a = np.broadcast_to(np.arange(int(np.prod(a.shape[:-1]))).reshape(a.shape[:-1]), shape)
+        rows_b = np.broadcast_to(np.arange(int(np.prod(b.shape[:-1]))).reshape(b.shape[:-1]), shape)
+        out = np.empty(int(np.prod(shape)))
+        self._paired_inner(
+            np.ascontiguousarray(a.reshape(-1, a.shape[-1])),
+            np.ascontiguousarray(b.reshape(-1, b.shape[-1])),
+            rows_a.ravel(), rows_b.ravel(), out
+        )
+        return out.reshape(shape)
+
+    def interp_inner(self, wave, flux, b, waveset, block_size=256):
+        wave = np.ascontiguousarray(wave, dtype=np.float64)
+        waveset = np.ascontiguousarray(waveset, dtype=np.float64)
+        flux = np.ascontiguousarray(np.atleast_2d(flux), dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        shape = (len(flux),) + b.shape[:-1]
+        b2 = b.reshape(-1, b.shape[-1])
+        out = np.empty((len(flux), len(b2)))
+        if len(b2) <= self.max_fused:
+            self._interp_inner(wave, flux, np.ascontiguousarray(b2.T), waveset, out)
+        else:
+            resampled = np.empty((min(block_size, len(flux)), len(waveset)))
+            for start in range(0, len(flux), block_size):
+                block = flux[start:start + block_size]
+                self._interp(wave, block, waveset, resampled[:len(block)])
+                out[start:start + block_size] = np.inner(resampled[:len(block)], b2)
+        return out.reshape(shape)
+
+
+BACKENDS = dict(numpy=NumpyBackend, numba=NumbaBackend)
+
+
+def available_backends():
+    """
+    Names of the backends which can be used in this installation.
+    """
+    names = ['numpy']
+    try:
+        import numba  # noqa: F401
+        names.append('numba')
+    except ImportError:
+        pass
+    return names
+
+
+def set_backend(name, **kwargs):
+    """
+    Select the backend used for photometry kernels.
+
+    Parameters
+    ----------
+    name : string
+        One of `available_backends`.
+    **kwargs
+        Options for the backend, e.g ``threads`` for numba.
+
+    Returns
+    -------
+    backend : object
+        The new backend.
+    """
+    global _BACKEND
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend {}, choose from {}".format(name, sorted(BACKENDS)))
+    try:
+        backend = BACKENDS[name](**kwargs)
+    except ImportError:
+        raise ValueError("Backend {} is not available".format(name))
+    _BACKEND = backend
+    return backend
+
+
+def get_backend():
+    """
+    The backend currently used for photometry kernels.
+    """
+    if _BACKEND is None:
+        set_backend(os.getenv("UCAM_THRUPUT_BACKEND", DEFAULT_BACKEND))
+    return _BACKEND
+
+
+def verify_backend(name, n_spectra=50, n_bands=20, n_wave=3000, rtol=1e-10, seed=0):
+    """
+    Check that a backend agrees with the numpy reference implementation.
+
+    Every kernel is run on random data with both backends.
+
+    Returns
+    -------
+    errors : dict
+        Largest relative difference from the reference for each kernel.
+    """
+    rng = np.random.default_rng(seed)
+    reference = NumpyBackend()
+    backend = BACKENDS[name]()
+    waveset = np.linspace(3000.0, 10000.0, n_wave)
+    wave = np.sort(rng.uniform(2500.0, 10500.0, n_wave // 2))
+    flux = rng.uniform(0.0, 1.0, (n_spectra, len(wave)))
+    a = rng.uniform(0.0, 1.0, (n_spectra, n_wave))
+    b = rng.uniform(0.0, 1.0, (n_bands, n_wave))
+
+    cases = dict(
+        inner=(backend.inner(a, b), reference.inner(a, b)),
+        paired_inner=(backend.paired_inner(a, b[:1]), reference.paired_inner(a, b[:1])),
+        interp_inner=(backend.interp_inner(wave, flux, b, waveset),
+                      reference.interp_inner(wave, flux, b, waveset)),
+        # few bandpasses, which some backends treat differently
+        interp_inner_few=(backend.interp_inner(wave, flux, b[:2], waveset),
+                          reference.interp_inner(wave, flux, b[:2], waveset)),
+    )
+    errors = {}
+    for kernel, (result, expected) in cases.items():
+        if result.shape != expected.shape:
+            raise ValueError("{} kernel of backend {} gives shape {}, not {}".format(
+                kernel, name, result.shape, expected.shape
+            ))
+        errors[kernel] = np.max(np.abs(result - expected) / np.abs(expected))
+        if errors[kernel] > rtol:
+            raise ValueError("{} kernel of backend {} differs from numpy by {:.3g}".format(
+                kernel, name, errors[kernel]
+            ))
+    return errors
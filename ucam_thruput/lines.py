@@ -0,0 +1,151 @@
+"""
+Count rates from emission lines through narrow-band filters.
+
+Lines are Gaussians with a given integrated flux and velocity width. The
+count rate from a line of flux F centred on lambda_0 is
+
+    area * F * integral G(lambda; lambda_0, sigma) lambda T(lambda) / hc dlambda
+
+and the integral over the Gaussian is done by Gauss-Hermite quadrature, so
+the response only has to be interpolated from the cached throughput at a
+few points around each shifted line centre. Every line, velocity and node
+is interpolated in a single call per obsmode.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET, obsmode_area, throughput, throughput_stack
+from .photometry import C, H, countrate
+from .spectra import from_spec, normalise
+
+LinePhotometry = namedtuple(
+    "LinePhotometry", ['velocities', 'obsmodes', 'line', 'continuum', 'total']
+)
+
+# speed of light (km/s)
+C_KMS = 299792.458
+# FWHM of a Gaussian in units of sigma
+FWHM_SIGMA = 2 * np.sqrt(2 * np.log(2))
+
+
+def doppler_factor(velocities):
+    """
+    Relativistic Doppler factor for radial velocities (km/s), positive away from us.
+    """
+    beta = np.asarray(velocities, dtype=np.float64) / C_KMS
+    return np.sqrt((1 + beta) / (1 - beta))
+
+
+def line_response(obsmodes, wave, fwhm, velocities, n_nodes=32, waveset=None):
+    """
+    Count rate per unit line flux for lines shifted over a grid of velocities.
+
+    Parameters
+    ----------
+    obsmodes : list
+        Obsmodes, e.g ``['ucam,wht,ha_narrow']``.
+    wave : `~numpy.ndarray`
+        Rest wavelengths (Angstroms) of the lines.
+    fwhm : `~numpy.ndarray`
+        Full widths at half maximum of the lines (km/s).
+    velocities : `~numpy.ndarray`
+        Radial velocities (km/s).
+    n_nodes : int, optional
+        Number of Gauss-Hermite quadrature nodes.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    response : `~numpy.ndarray`
+        Counts/s per erg/s/cm**2 of line flux, of shape
+        ``(n_obsmodes, n_velocities, n_lines)``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    wave = np.atleast_1d(np.asarray(wave, dtype=np.float64))
+    fwhm = np.broadcast_to(np.asarray(fwhm, dtype=np.float64), wave.shape)
+    velocities = np.atleast_1d(np.asarray(velocities, dtype=np.float64))
+
+    # photons per unit energy, times throughput, at every wavelength
+    thru = throughput_stack(obsmodes, waveset)
+    weight = thru * waveset / (H * C)
+
+    # observed centres and widths, of shape (n_velocities, n_lines)
+    centres = np.multiply.outer(doppler_factor(velocities), wave)
+    sigma = centres * fwhm / (FWHM_SIGMA * C_KMS)
+    nodes, weights = np.polynomial.hermite.hermgauss(n_nodes)
+    points = centres[..., np.newaxis] + np.sqrt(2) * sigma[..., np.newaxis] * nodes
+    weights = weights / np.sqrt(np.pi)
+
+    response = np.empty((len(obsmodes),) + centres.shape)
+    for i, obsmode in enumerate(obsmodes):
+        values = np.interp(points, waveset, weight[i], left=0.0, right=0.0)
+        np.dot(values, weights, out=response[i])
+        response[i] *= obsmode_area(obsmode)
+    return response
+
+
+def line_photometry(lines, obsmodes, velocities, continuum=None, continuum_mag=None,
+                    norm_obsmode=None, n_nodes=32, waveset=None):
+    """
+    Count rates from a list of emission lines plus continuum over a velocity grid.
+
+    Parameters
+    ----------
+    lines : `~numpy.ndarray`
+        Array of shape ``(n_lines, 3)`` giving the rest wavelength (Angstroms),
+        integrated flux (erg/s/cm**2) and FWHM (km/s) of each line.
+    obsmodes : list
+        Obsmodes, e.g ``['ucam,wht,ha_narrow', 'ucam,wht,rcont']``.
+    velocities : `~numpy.ndarray`
+        Radial velocities (km/s) by which every line is shifted.
+    continuum : string or `~numpy.ndarray`, optional
+        Continuum, as a description understood by
+        `ucam_thruput.spectra.from_spec` or PHOTLAM sampled on ``waveset``.
+        The continuum is not shifted.
+    continuum_mag : float, optional
+        AB magnitude of the continuum in ``norm_obsmode``, used to scale it.
+        If not given, the continuum is used as it is, so e.g ``'flat'`` is
+        a source of AB magnitude zero.
+    norm_obsmode : string, optional
+        Obsmode in which ``continuum_mag`` is measured.
+    n_nodes : int, optional
+        Number of Gauss-Hermite quadrature nodes.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    result : `LinePhotometry`
+        The velocities and obsmodes, count rates (counts/s) from the lines,
+        of shape ``(n_velocities, n_obsmodes)``, from the continuum, of
+        shape ``(n_obsmodes,)``, and their total.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    lines = np.atleast_2d(np.asarray(lines, dtype=np.float64))
+    if lines.shape[-1] != 3:
+        raise ValueError("lines must have columns of wavelength, flux and FWHM")
+    velocities = np.atleast_1d(np.asarray(velocities, dtype=np.float64))
+    wave, flux, fwhm = lines.T
+
+    response = line_response(obsmodes, wave, fwhm, velocities, n_nodes, waveset)
+    line = np.dot(response, flux).T
+
+    cont = np.zeros(len(obsmodes))
+    if continuum is not None:
+        if isinstance(continuum, str):
+            continuum = from_spec(continuum, waveset)
+        if continuum_mag is not None:
+            if norm_obsmode is None:
+                raise ValueError("norm_obsmode is needed to scale the continuum to continuum_mag")
+            continuum = normalise(continuum, continuum_mag, throughput(norm_obsmode, waveset), waveset)
+        area = np.array([obsmode_area(obsmode) for obsmode in obsmodes])
+        cont = countrate(continuum, throughput_stack(obsmodes, waveset), waveset, area)
+    return LinePhotometry(velocities, list(obsmodes), line, cont, line + cont)
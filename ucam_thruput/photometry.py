@@ -0,0 +1,199 @@
+"""
+Vectorised synthetic photometry on a common wavelength grid.
+
+Spectra are given as photon flux densities (PHOTLAM, photons/s/cm**2/AA)
+sampled on the same wavelength grid as the throughputs, so that all the
+integrals reduce to weighted sums. The leading dimensions of spectra and
+throughputs are broadcast against each other in the manner of `numpy.inner`,
+so a stack of N spectra and M throughputs gives an (N, M) array of results.
+With ``paired=True``, leading dimensions are instead broadcast element-wise,
+so N spectra and N throughputs give N results.
+
+The sums themselves are done by the backend selected in
+`ucam_thruput.kernels`.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numpy as np
+
+from .kernels import get_backend
+
+# Planck constant (erg s) and speed of light (AA/s)
+H = 6.62607015e-27
+C = 2.99792458e18
+# flux density of a zero magnitude AB source (erg/s/cm**2/Hz)
+ABZERO = 10**(-0.4 * 48.60)
+
+
+def trapezoid_weights(waveset):
+    """
+    Weights which turn a trapezoidal integral over ``waveset`` into a dot product.
+    """
+    waveset = np.asarray(waveset, dtype=np.float64)
+    dw = np.diff(waveset)
+    weights = np.zeros_like(waveset)
+    weights[:-1] += 0.5 * dw
+    weights[1:] += 0.5 * dw
+    return weights
+
+
+def _inner(a, b, paired=False):
+    if paired:
+        return get_backend().paired_inner(a, b)
+    return get_backend().inner(a, b)
+
+
+def countrate(flux, thru, waveset, area, paired=False):
+    """
+    Photon count rate of spectra through bandpasses.
+
+    Parameters
+    ----------
+    flux : `~numpy.ndarray`
+        Spectra in PHOTLAM, with wavelength along the last axis.
+    thru : `~numpy.ndarray`
+        Throughputs, with wavelength along the last axis.
+    waveset : `~numpy.ndarray`
+        Wavelengths (Angstroms) on which ``flux`` and ``thru`` are sampled.
+    area : float or `~numpy.ndarray`
+        Telescope collecting area (cm**2).
+    paired : bool, optional
+        Pair spectra with throughputs element-wise, rather than evaluating
+        every spectrum through every throughput.
+
+    Returns
+    -------
+    rate : `~numpy.ndarray`
+        Count rates (counts/s), of shape ``flux.shape[:-1] + thru.shape[:-1]``,
+        or the broadcast shape of the leading dimensions if ``paired``.
+    """
+    weights = trapezoid_weights(waveset)
+    return area * _inner(flux, thru * weights, paired)
+
+
+def tabulated_countrate(wave, flux, thru, waveset, area):
+    """
+    Photon count rate of spectra tabulated on their own wavelength grid.
+
+    The spectra are interpolated onto ``waveset`` as part of the integral,
+    and are taken to be zero outside the range of ``wave``.
+
+    Parameters
+    ----------
+    wave : `~numpy.ndarray`
+        Ascending wavelengths (Angstroms) at which the spectra are tabulated.
+    flux : `~numpy.ndarray`
+        Spectra in PHOTLAM, of shape (N, len(wave)).
+    thru : `~numpy.ndarray`
+        Throughputs sampled on ``waveset``, with wavelength along the last axis.
+    waveset : `~numpy.ndarray`
+        Wavelengths (Angstroms) on which ``thru`` is sampled.
+    area : float or `~numpy.ndarray`
+        Telescope collecting area (cm**2).
+
+    Returns
+    -------
+    rate : `~numpy.ndarray`
+        Count rates (counts/s), of shape ``(N,) + thru.shape[:-1]``.
+    """
+    weights = trapezoid_weights(waveset)
+    return area * get_backend().interp_inner(wave, flux, thru * weights, waveset)
+
+
+def pivot_wavelength(thru, waveset):
+    """
+    Pivot wavelength (Angstroms) of bandpasses.
+    """
+    weights = trapezoid_weights(waveset)
+    num = np.inner(thru, weights * waveset)
+    den = np.inner(thru, weights / waveset)
+    return np.sqrt(num / den)
+
+
+def abmag(flux, thru, waveset, paired=False):
+    """
+    Synthetic AB magnitudes of spectra through bandpasses.
+
+    This matches ``synphot.Observation.effstim('abmag')``, i.e the
+    mean flux density (FLAM) weighted by ``wavelength * throughput``,
+    converted to frequency units at the pivot wavelength.
+
+    Parameters
+    ----------
+    flux : `~numpy.ndarray`
+        Spectra in PHOTLAM, with wavelength along the last axis.
+    thru : `~numpy.ndarray`
+        Throughputs, with wavelength along the last axis.
+    waveset : `~numpy.ndarray`
+        Wavelengths (Angstroms) on which ``flux`` and ``thru`` are sampled.
+    paired : bool, optional
+        Pair spectra with throughputs element-wise, rather than evaluating
+        every spectrum through every throughput.
+
+    Returns
+    -------
+    mag : `~numpy.ndarray`
+        Magnitudes, of shape ``flux.shape[:-1] + thru.shape[:-1]``,
+        or the broadcast shape of the leading dimensions if ``paired``.
+    """
+    weights = trapezoid_weights(waveset)
+    num = _inner(flux, thru * weights, paired)
+    return -2.5 * np.log10(num) + abmag_offset(thru, waveset)
+
+
+def abmag_offset(thru, waveset):
+    """
+    Offsets relating the AB magnitude to the weighted flux integral.
+
+    For each bandpass, the AB magnitude of a spectrum is
+    ``-2.5 * log10(flux . (thru * weights)) + offset``, where ``weights`` are
+    the `trapezoid_weights`. This allows magnitudes to be found from
+    count rates without further integrals.
+    """
+    weights = trapezoid_weights(waveset)
+    den = np.inner(thru, weights * waveset)
+    return 2.5 * np.log10(den * ABZERO / H / pivot_wavelength(thru, waveset)**2)
+
+
+def zeropoint(thru, waveset, area):
+    """
+    AB magnitude of a flat spectrum that gives 1 count/s through bandpasses.
+
+    Parameters
+    ----------
+    thru : `~numpy.ndarray`
+        Throughputs, with wavelength along the last axis.
+    waveset : `~numpy.ndarray`
+        Wavelengths (Angstroms) on which ``thru`` is sampled.
+    area : float
+        Telescope collecting area (cm**2).
+    """
+    waveset = np.asarray(waveset, dtype=np.float64)
+    flat = ABZERO / (H * waveset)
+    return 2.5 * np.log10(countrate(flat, thru, waveset, area))
+
+
+def colour_term(mag, ref_mag, colour):
+    """
+    Slope of the magnitude difference between two systems against colour.
+
+    Parameters
+    ----------
+    mag, ref_mag : `~numpy.ndarray`
+        Magnitudes of N spectra in the system of interest and in the reference
+        system, with spectra along the last axis.
+    colour : `~numpy.ndarray`
+        Colours of the N spectra.
+
+    Returns
+    -------
+    slope : `~numpy.ndarray`
+        Least-squares slope of ``mag - ref_mag`` against ``colour``.
+    """
+    colour = np.asarray(colour, dtype=np.float64)
+    dc = colour - colour.mean()
+    dm = mag - ref_mag
+    dm = dm - dm.mean(axis=-1, keepdims=True)
+    return np.inner(dm, dc) / np.inner(dc, dc)
@@ -0,0 +1,299 @@
+"""
+Choosing filters and exposure settings for the simultaneous arms of HiPERCAM and ULTRACAM.
+
+Every arm is exposed in step, with a common exposure time. HiPERCAM arms
+can be read out only every ``nskip`` frames, and the ULTRACAM blue arm
+every ``nblue`` frames, which lengthens their effective exposures and
+the time between their frames. With an exposure time ``t``, a dead time
+``d`` between frames and a multiplier ``n``, an arm's exposures last
+``n (t + d) - d`` seconds and it takes a frame every ``n (t + d)``
+seconds.
+
+The signal-to-noise ratio is computed for every arm, filter, multiplier
+and exposure time at once. A configuration (an exposure time plus a
+filter and multiplier for each arm) is judged on three objectives: the
+lowest signal-to-noise of its arms, which should be high; the time
+between frames of its slowest arm, which should be short; and the ratio
+of its highest to lowest signal-to-noise, which should be near one.
+
+The configurations on the Pareto front of these objectives are found
+exactly without listing every combination. For an exposure time, a
+limit on the multipliers and a lowest acceptable signal-to-noise ``s``,
+the best balanced choice for each arm is independently the option with
+the lowest signal-to-noise which is at least ``s``. Every option of every
+arm is tried as ``s``, and the non-dominated results are kept.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET, obsmode_area, obsmode_components, throughput, throughput_stack
+from .photometry import countrate
+from .sky import pixel_scale, sky_table
+from .spectra import from_spec, normalise
+
+ExposurePlans = namedtuple(
+    "ExposurePlans",
+    ['arms', 'exposure', 'filters', 'multipliers', 'snr', 'cadence', 'min_snr', 'imbalance']
+)
+
+# read noise (electrons/pixel) in the slow readout speed
+READ_NOISE = dict(ucam=3.5, hcam=4.5)
+# dead time (s) between exposures, for frame transfer
+DEAD_TIME = dict(ucam=0.024, hcam=0.008)
+# arms which can be read out every n frames
+MULTIPLIED_ARMS = dict(ucam=('u',), hcam=('u', 'g', 'r', 'i', 'z'))
+
+DEFAULT_EXPOSURES = np.geomspace(0.01, 60.0, 40)
+DEFAULT_MULTIPLIERS = np.arange(1, 9)
+
+
+def _filter_groupings(instrument):
+    from .hcam import Hcam
+    from .ucam import Ucam
+    classes = dict(ucam=Ucam, hcam=Hcam)
+    if instrument not in classes:
+        raise ValueError("No simultaneous arms for instrument {}".format(instrument))
+    return classes[instrument]._filter_groupings
+
+
+def arm_options(instrument, telescope, filters=None):
+    """
+    The obsmodes which can be used in each arm of an instrument on a telescope.
+
+    Parameters
+    ----------
+    instrument : string
+        ``'ucam'`` or ``'hcam'``.
+    telescope : string
+        Telescope name, e.g ``'wht'``.
+    filters : dict, optional
+        Names of the filters to consider for some of the arms, e.g
+        ``dict(u=['u_s'])``. By default every filter is considered.
+
+    Returns
+    -------
+    options : dict
+        Obsmodes for each arm, in the order of the arms.
+    """
+    groupings = _filter_groupings(instrument)
+    filters = {} if filters is None else filters
+    unknown = set(filters) - set(groupings)
+    if unknown:
+        raise ValueError("{} has no arms {}".format(instrument, sorted(unknown)))
+
+    options = {}
+    for arm, group in groupings.items():
+        names = [filt.name for filt in group]
+        wanted = filters.get(arm, names)
+        bad = set(wanted) - set(names)
+        if bad:
+            raise ValueError("Filters {} are not in the {} arm of {}".format(sorted(bad), arm, instrument))
+        obsmodes = []
+        for name in wanted:
+            obsmode = ','.join((instrument, telescope, name))
+            try:
+                obsmode_components(obsmode)
+            except ValueError:
+                continue
+            obsmodes.append(obsmode)
+        if not obsmodes:
+            raise ValueError("No filters for the {} arm of {} on {}".format(arm, instrument, telescope))
+        options[arm] = obsmodes
+    return options
+
+
+def frame_snr(rate, sky, n_pix, exposure, read_noise):
+    """
+    Signal-to-noise ratio of aperture photometry in a single frame.
+
+    Parameters
+    ----------
+    rate : float or `~numpy.ndarray`
+        Count rate (counts/s) of the target within the aperture.
+    sky : float or `~numpy.ndarray`
+        Sky count rate (counts/s/pixel).
+    n_pix : float
+        Number of pixels in the aperture.
+    exposure : float or `~numpy.ndarray`
+        Exposure time (s).
+    read_noise : float
+        Read noise (electrons/pixel).
+    """
+    signal = rate * exposure
+    return signal / np.sqrt(signal + n_pix * (sky * exposure + read_noise**2))
+
+
+def pareto_front(objectives):
+    """
+    Indices of the points not dominated by any other, minimising three objectives.
+
+    Of identical points, only one is kept.
+
+    Parameters
+    ----------
+    objectives : `~numpy.ndarray`
+        Array of shape ``(n_points, 3)``.
+
+    Returns
+    -------
+    index : `~numpy.ndarray`
+        Indices of the non-dominated points, in increasing order of the first objective.
+    """
+    objectives = np.asarray(objectives, dtype=np.float64)
+    order = np.lexsort(objectives.T[::-1])
+    objectives = objectives[order]
+    # earlier points are never worse in the first objective, and within a run of
+    # equal first objectives never worse in the second
+    starts = np.flatnonzero(np.diff(objectives[:, 0], prepend=np.nan) != 0)
+    stops = np.append(starts[1:], len(objectives))
+
+    keep = []
+    front = np.empty((0, 2))
+    for start, stop in zip(starts, stops):
+        group = objectives[start:stop, 1:]
+        best = np.minimum.accumulate(np.concatenate(([np.inf], group[:-1, 1])))
+        candidates = np.flatnonzero(group[:, 1] < best)
+        points = group[candidates]
+        dominated = np.any(
+            (front[:, 0] <= points[:, :1]) & (front[:, 1] <= points[:, 1:]), axis=1
+        )
+        keep.append(start + candidates[~dominated])
+        front = np.concatenate((front, points[~dominated]))
+    return order[np.concatenate(keep)]
+
+
+def plan_exposures(instrument, telescope, spec='flat', mag=None, norm_obsmode=None,
+                   filters=None, exposures=None, multipliers=None, airmass=1.2,
+                   phase=0.0, distance=90.0, seeing=1.0, aperture=None, binning=1,
+                   waveset=None):
+    """
+    Pareto-optimal filter and exposure settings for every arm of an instrument.
+
+    Parameters
+    ----------
+    instrument : string
+        ``'ucam'`` or ``'hcam'``.
+    telescope : string
+        Telescope name, e.g ``'gtc'``.
+    spec : string or `~numpy.ndarray`, optional
+        Spectrum of the target, as a description understood by
+        `ucam_thruput.spectra.from_spec` or PHOTLAM sampled on ``waveset``.
+    mag : float, optional
+        AB magnitude of the target in ``norm_obsmode``, used to scale ``spec``.
+    norm_obsmode : string, optional
+        Obsmode in which ``mag`` is measured. Defaults to the instrument's
+        g filter above the atmosphere.
+    filters : dict, optional
+        Names of the filters to consider for some of the arms, e.g
+        ``dict(u=['u_s'])``. By default every filter is considered.
+    exposures : `~numpy.ndarray`, optional
+        Exposure times (s) to consider.
+    multipliers : `~numpy.ndarray`, optional
+        Multipliers (``nskip`` or ``nblue``) to consider, for the arms which
+        have them.
+    airmass : float, optional
+        Airmass of the target.
+    phase : float, optional
+        Illuminated fraction of the moon.
+    distance : float, optional
+        Angular distance between target and moon (degrees).
+    seeing : float, optional
+        FWHM of the seeing (arcsec).
+    aperture : float, optional
+        Radius of the photometric aperture (arcsec). Defaults to ``seeing``.
+    binning : int, optional
+        On-chip binning factor.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    plans : `ExposurePlans`
+        The names of the arms, then for each Pareto-optimal configuration
+        its exposure time (s), filter and multiplier for each arm,
+        signal-to-noise in each arm, time between frames of its slowest arm
+        (s), lowest signal-to-noise, and ratio of highest to lowest
+        signal-to-noise. Configurations are in order of increasing time
+        between frames.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    exposures = DEFAULT_EXPOSURES if exposures is None else np.asarray(exposures, dtype=np.float64)
+    multipliers = DEFAULT_MULTIPLIERS if multipliers is None else np.asarray(multipliers, dtype=int)
+    multipliers = np.unique(multipliers)
+    if multipliers[0] < 1:
+        raise ValueError("multipliers must be at least one")
+    aperture = seeing if aperture is None else aperture
+
+    options = arm_options(instrument, telescope, filters)
+    arms = list(options)
+    obsmodes = [obsmode for arm in arms for obsmode in options[arm]]
+    arm_index = np.repeat(np.arange(len(arms)), [len(options[arm]) for arm in arms])
+
+    # count rates of the target and sky through every filter
+    flux = from_spec(spec, waveset) if isinstance(spec, str) else np.asarray(spec, dtype=np.float64)
+    if mag is not None:
+        if norm_obsmode is None:
+            norm_obsmode = ','.join((instrument, telescope, 'g', 'noatmos'))
+        flux = normalise(flux, mag, throughput(norm_obsmode, waveset), waveset)
+    area = np.array([obsmode_area(obsmode) for obsmode in obsmodes])
+    rate = countrate(flux, throughput_stack(obsmodes, waveset, airmass), waveset, area)
+    sky = sky_table(obsmodes)
+    sky = np.array([sky(obsmode, phase, distance, airmass) for obsmode in obsmodes])
+
+    # the fraction of a Gaussian image within the aperture, and the pixels it covers
+    scale = np.array([pixel_scale(obsmode) for obsmode in obsmodes]) * binning
+    sigma = seeing / (2 * np.sqrt(2 * np.log(2)))
+    rate = rate * (1 - np.exp(-0.5 * (aperture / sigma)**2))
+    n_pix = np.pi * (aperture / scale)**2
+    sky = sky * binning**2
+
+    # signal-to-noise of every option, of shape (n_obsmodes, n_multipliers, n_exposures)
+    dead = DEAD_TIME[instrument]
+    cycle = exposures + dead
+    multiplied = np.isin(np.array(arms)[arm_index], MULTIPLIED_ARMS[instrument])
+    mult = np.where(multiplied[:, np.newaxis], multipliers, 1)
+    effective = mult[..., np.newaxis] * cycle - dead
+    snr = frame_snr(rate[:, np.newaxis, np.newaxis], sky[:, np.newaxis, np.newaxis],
+                    n_pix[:, np.newaxis, np.newaxis], effective, READ_NOISE[instrument])
+
+    # option index of each arm's choice, for every exposure, multiplier limit and floor
+    n_options = snr.shape[0] * snr.shape[1]
+    option_arm = np.repeat(arm_index, len(multipliers))
+    option_mult = mult.ravel()
+    found_exposure, found_choice = [], []
+    for k in range(len(exposures)):
+        values = snr[..., k].ravel()
+        for limit in multipliers:
+            allowed = option_mult <= limit
+            floors = values[allowed]
+            choice = np.empty((len(floors), len(arms)), dtype=int)
+            feasible = np.ones(len(floors), dtype=bool)
+            for a in range(len(arms)):
+                candidates = np.flatnonzero(allowed & (option_arm == a))
+                order = candidates[np.argsort(values[candidates])]
+                pos = np.searchsorted(values[order], floors)
+                feasible &= pos < len(order)
+                choice[:, a] = order[np.minimum(pos, len(order) - 1)]
+            found_choice.append(choice[feasible])
+            found_exposure.append(np.full(np.count_nonzero(feasible), k))
+    choice = np.concatenate(found_choice)
+    k = np.concatenate(found_exposure)
+
+    arm_snr = snr.reshape(n_options, -1)[choice, k[:, np.newaxis]]
+    arm_mult = option_mult[choice]
+    min_snr = arm_snr.min(axis=1)
+    cadence = arm_mult.max(axis=1) * cycle[k]
+    imbalance = arm_snr.max(axis=1) / min_snr
+    best = pareto_front(np.column_stack((cadence, -min_snr, imbalance)))
+
+    filter_names = np.array([obsmode.split(',')[-1] for obsmode in obsmodes])
+    return ExposurePlans(
+        arms, exposures[k[best]], filter_names[choice[best] // len(multipliers)],
+        arm_mult[best], arm_snr[best], cadence[best], min_snr[best], imbalance[best]
+    )
@@ -0,0 +1,128 @@
+"""
+Synthetic photometry of templates over a grid of redshifts.
+
+On a wavelength grid uniform in log(wavelength), redshifting a spectrum
+by (1 + z) = exp(k * dlnlam) is a shift of k pixels. A rest-frame template
+is sampled once on an extended log grid, and every redshift is then a
+window onto that one array, so a whole redshift track through every band
+is a single matrix product.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import list_obsmodes, throughput_stack
+from .kernels import get_backend
+from .photometry import abmag_offset, trapezoid_weights
+from .spectra import from_spec
+
+RedshiftPhotometry = namedtuple(
+    "RedshiftPhotometry", ['redshifts', 'obsmodes', 'abmag', 'kcorr']
+)
+
+# observed frame wavelength range (Angstroms) covering all the bandpasses
+WAVE_MIN = 2000.0
+WAVE_MAX = 12000.0
+DEFAULT_DLNLAM = 2e-4
+
+_LOG_WAVESETS = {}
+
+
+def log_waveset(dlnlam=DEFAULT_DLNLAM, wave_min=WAVE_MIN, wave_max=WAVE_MAX):
+    """
+    A wavelength grid uniform in log(wavelength).
+
+    Grids are cached and read-only, so bandpasses sampled on them are
+    cached by `ucam_thruput.bandpass` as well.
+    """
+    key = (dlnlam, wave_min, wave_max)
+    waveset = _LOG_WAVESETS.get(key)
+    if waveset is None:
+        n = int(np.ceil(np.log(wave_max / wave_min) / dlnlam)) + 1
+        waveset = wave_min * np.exp(dlnlam * np.arange(n))
+        waveset.flags.writeable = False
+        _LOG_WAVESETS[key] = waveset
+    return waveset
+
+
+def _rest_frame(template, waveset):
+    if isinstance(template, str):
+        return from_spec(template, waveset)
+    wave, flux = template
+    return np.interp(waveset, wave, flux, left=0.0, right=0.0)
+
+
+def redshift_photometry(template, obsmodes=None, redshifts=None, dlnlam=DEFAULT_DLNLAM,
+                        block_size=256):
+    """
+    AB magnitudes and K-corrections of a template over a redshift grid.
+
+    The template is redshifted conserving energy, i.e
+    F_obs(lambda) = F_rest(lambda / (1 + z)) / (1 + z), with no distance
+    dimming, so the magnitudes differ from apparent magnitudes by the
+    distance modulus.
+
+    Parameters
+    ----------
+    template : string or tuple
+        A spectrum description understood by `ucam_thruput.spectra.from_spec`,
+        or a tuple of rest-frame wavelength (Angstroms) and PHOTLAM arrays.
+        Tabulated templates are taken to be zero outside their range.
+    obsmodes : list, optional
+        Obsmodes to evaluate. Defaults to every obsmode for every telescope.
+    redshifts : `~numpy.ndarray`, optional
+        Redshifts to evaluate. Each is moved to the nearest redshift which is
+        a whole number of pixels on the log grid. Defaults to 0 to 6 in steps
+        of 0.01.
+    dlnlam : float, optional
+        Pixel size of the log wavelength grid.
+    block_size : int, optional
+        Number of redshifts evaluated at once, to bound memory use.
+
+    Returns
+    -------
+    result : `RedshiftPhotometry`
+        The (snapped) redshifts, the obsmodes, and AB magnitudes and
+        K-corrections (as defined by Hogg et al. 2002, for the same band in
+        the rest and observed frames) of shape ``(n_redshifts, n_obsmodes)``.
+    """
+    if obsmodes is None:
+        obsmodes = list_obsmodes()
+    if redshifts is None:
+        redshifts = np.arange(0, 6.005, 0.01)
+    redshifts = np.atleast_1d(np.asarray(redshifts, dtype=np.float64))
+    if np.any(redshifts < 0):
+        raise ValueError("redshifts must not be negative")
+
+    waveset = log_waveset(dlnlam)
+    n_wave = len(waveset)
+    shifts = np.rint(np.log1p(redshifts) / dlnlam).astype(int)
+    max_shift = max(shifts.max(), 0)
+    redshifts = np.expm1(shifts * dlnlam)
+
+    # rest frame template on the observed grid, extended blueward by max_shift pixels
+    rest_wave = WAVE_MIN * np.exp(dlnlam * np.arange(-max_shift, n_wave))
+    rest = _rest_frame(template, rest_wave)
+    # window k of this view is the template redshifted by (max_shift - k) pixels;
+    # in photon units the energy conserving shift is simply N_rest(lambda / (1 + z))
+    windows = np.lib.stride_tricks.sliding_window_view(rest, n_wave)
+
+    thru = throughput_stack(obsmodes, waveset)
+    thru_weights = thru * trapezoid_weights(waveset)
+    raw = np.empty((len(shifts), len(obsmodes)))
+    for start in range(0, len(shifts), block_size):
+        rows = max_shift - shifts[start:start + block_size]
+        raw[start:start + block_size] = get_backend().inner(windows[rows], thru_weights)
+    rest_raw = get_backend().inner(windows[max_shift], thru_weights)
+
+    offset = abmag_offset(thru, waveset)
+    with np.errstate(divide='ignore'):
+        mag = -2.5 * np.log10(raw) + offset
+        rest_mag = -2.5 * np.log10(rest_raw) + offset
+    # the redshifted spectrum already includes the (1 + z) bandwidth factor
+    kcorr = mag - rest_mag
+    return RedshiftPhotometry(redshifts, list(obsmodes), mag, kcorr)
@@ -0,0 +1,325 @@
+"""
+A lightweight photometry service for use on localhost.
+
+The service holds the throughputs of every obsmode for every telescope in
+``TELESCOPE_AREAS`` in memory, so requests avoid the cost of importing
+the package, calling `setref` and building bandpasses. Concurrent requests
+are gathered into batches and evaluated together.
+
+The protocol is newline-delimited JSON over a TCP socket. Each request is
+a JSON object on one line, and receives a JSON object on one line in reply::
+
+    {"id": 1, "obsmode": "ucam,wht,g", "mag": 18.0, "spectrum": {"teff": 5800}}
+    {"id": 1, "countrate": 1234.5, "abmag": 18.0, "zeropoint": 27.1}
+
+The spectrum can be ``{"teff": T}`` for a blackbody, ``{"index": a}`` for a
+power law F_nu ~ nu**a, or omitted for a flat (AB) spectrum. ``mag``, which
+is required, is the AB magnitude of the source in the requested obsmode.
+Requests which cannot be evaluated, or give a result that is not finite,
+receive ``{"error": "..."}``. The special requests
+``{"op": "metrics"}`` and ``{"op": "obsmodes"}`` return service metrics
+and the list of available obsmodes.
+
+Start the service with ``python -m ucam_thruput.server``.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from . import TELESCOPE_AREAS
+from .bandpass import DEFAULT_WAVESET, list_obsmodes, throughput_stack
+from .kernels import get_backend
+from .photometry import abmag_offset, trapezoid_weights, zeropoint
+from .spectra import blackbody, power_law
+
+DEFAULT_PORT = 8765
+
+
+class PhotometryService:
+    """
+    Warm, batched evaluation of count rates for all obsmodes.
+
+    Parameters
+    ----------
+    telescopes : list, optional
+        Telescopes to load. Defaults to all of those in ``TELESCOPE_AREAS``.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    max_spectra : int, optional
+        Number of spectra to keep in the cache.
+    """
+    def __init__(self, telescopes=None, waveset=None, max_spectra=4096):
+        if telescopes is None:
+            telescopes = sorted(TELESCOPE_AREAS)
+        if waveset is None:
+            waveset = DEFAULT_WAVESET
+        self.waveset = waveset
+        self.max_spectra = max_spectra
+
+        self.obsmodes = [obsmode for tel in telescopes for obsmode in list_obsmodes(tel)]
+        self.index = {obsmode: i for i, obsmode in enumerate(self.obsmodes)}
+        self.area = np.array([
+            TELESCOPE_AREAS[obsmode.split(',')[1]] for obsmode in self.obsmodes
+        ])
+        thru = throughput_stack(self.obsmodes, waveset)
+        weights = trapezoid_weights(waveset)
+        # count rate is area * flux . thru_weights
+        self._thru_weights = thru * weights
+        # AB magnitude of a spectrum is -2.5 log10(flux . thru_weights) + offset
+        self._ab_offset = abmag_offset(thru, waveset)
+        self.zeropoint = zeropoint(thru, waveset, self.area)
+        self._spectra = collections.OrderedDict()
+
+    def spectrum(self, spec):
+        """
+        Flux (PHOTLAM) of a spectrum description, from the cache if possible.
+        """
+        spec = spec or {}
+        key = tuple(sorted(spec.items()))
+        flux = self._spectra.get(key)
+        if flux is not None:
+            self._spectra.move_to_end(key)
+            return flux
+        if 'teff' in spec:
+            flux = blackbody(float(spec['teff']), self.waveset)
+        elif 'index' in spec:
+            flux = power_law(float(spec['index']), self.waveset)
+        elif not spec:
+            flux = power_law(0.0, self.waveset)
+        else:
+            raise ValueError("Unknown spectrum {}".format(spec))
+        self._spectra[key] = flux
+        if len(self._spectra) > self.max_spectra:
+            self._spectra.popitem(last=False)
+        return flux
+
+    def evaluate(self, requests):
+        """
+        Count rates for a batch of requests.
+
+        Parameters
+        ----------
+        requests : list
+            Dicts with keys ``obsmode``, ``mag`` and, optionally, ``spectrum``.
+
+        Returns
+        -------
+        replies : list
+            One dict per request, containing the count rate, magnitude and
+            zeropoint, or an error message.
+        """
+        replies = [None] * len(requests)
+        parsed, valid = [], []
+        # each distinct spectrum is evaluated once, against each distinct obsmode
+        columns, fluxes = {}, []
+        for i, request in enumerate(requests):
+            try:
+                row = self.index[request['obsmode']]
+                flux = self.spectrum(request.get('spectrum'))
+                mag = float(request['mag'])
+            except KeyError as err:
+                replies[i] = dict(error="missing or unknown {}".format(err))
+                continue
+            except (AttributeError, TypeError, ValueError) as err:
+                replies[i] = dict(error=str(err))
+                continue
+            if id(flux) not in columns:
+                columns[id(flux)] = len(fluxes)
+                fluxes.append(flux)
+            parsed.append((row, columns[id(flux)], mag))
+            valid.append(i)
+
+        if valid:
+            rows, spec_index, mags = (np.array(column) for column in zip(*parsed))
+            unique_rows, row_index = np.unique(rows, return_inverse=True)
+            table = get_backend().inner(np.array(fluxes), self._thru_weights[unique_rows])
+            raw = table[spec_index, row_index]
+            # scale each spectrum to its requested magnitude
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                raw_mag = -2.5 * np.log10(raw) + self._ab_offset[rows]
+                rate = self.area[rows] * raw * 10**(-0.4 * (mags - raw_mag))
+            for i, row, r, m in zip(valid, rows, rate, mags):
+                if not np.isfinite(r):
+                    # JSON has no NaN or infinity
+                    replies[i] = dict(error="no finite count rate for this spectrum and mag")
+                    continue
+                replies[i] = dict(countrate=float(r), abmag=float(m),
+                                  zeropoint=float(self.zeropoint[row]))
+
+        for request, reply in zip(requests, replies):
+            if 'id' in request:
+                reply['id'] = request['id']
+        return replies
+
+
+class Metrics:
+    """
+    Latency and throughput statistics for the service.
+    """
+    def __init__(self, window=10000):
+        self.start = time.monotonic()
+        self.requests = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record(self, latencies):
+        self.requests += len(latencies)
+        self.batches += 1
+        self.latencies.extend(latencies)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.start
+        summary = dict(
+            requests=self.requests,
+            batches=self.batches,
+            mean_batch_size=self.requests / self.batches if self.batches else 0.0,
+            requests_per_second=self.requests / elapsed if elapsed > 0 else 0.0,
+            uptime=elapsed,
+        )
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.array(self.latencies) * 1000, [50, 90, 99])
+            summary.update(latency_ms_p50=p50, latency_ms_p90=p90, latency_ms_p99=p99)
+        return summary
+
+
+class PhotometryServer:
+    """
+    Asyncio server which batches concurrent requests to a `PhotometryService`.
+
+    Parameters
+    ----------
+    service : `PhotometryService`
+        The (pre-loaded) service that evaluates requests.
+    max_batch : int, optional
+        Largest number of requests evaluated together.
+    batch_window : float, optional
+        Time (s) to wait for more requests to arrive before evaluating a batch.
+    """
+    def __init__(self, service, max_batch=1024, batch_window=0.0005):
+        self.service = service
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.metrics = Metrics()
+        self._queue = None
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            requests = [request for request, _, _ in batch]
+            try:
+                # evaluate off the event loop, so clients are still served meanwhile
+                replies = await loop.run_in_executor(None, self.service.evaluate, requests)
+            except Exception as err:
+                replies = [dict(error=str(err))] * len(batch)
+            now = time.monotonic()
+            for (_, future, received), reply in zip(batch, replies):
+                if not future.done():
+                    future.set_result(reply)
+            self.metrics.record([now - received for _, _, received in batch])
+
+    async def _handle(self, request):
+        op = request.get('op')
+        if op == 'metrics':
+            return self.metrics.summary()
+        if op == 'obsmodes':
+            return dict(obsmodes=self.service.obsmodes)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future, time.monotonic()))
+        return await future
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as err:
+                    reply = dict(error="bad request: {}".format(err))
+                else:
+                    reply = await self._handle(request)
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        """
+        Serve requests until cancelled.
+        """
+        self._queue = asyncio.Queue()
+        batcher = asyncio.ensure_future(self._batcher())
+        server = await asyncio.start_server(self._client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT, telescopes=None, max_batch=1024,
+          batch_window=0.0005):
+    """
+    Load all bandpasses and run the photometry service until interrupted.
+
+    Parameters
+    ----------
+    host : string, optional
+        Interface to listen on. Defaults to localhost only.
+    port : int, optional
+        Port to listen on.
+    telescopes : list, optional
+        Telescopes to load. Defaults to all of those in ``TELESCOPE_AREAS``.
+    max_batch : int, optional
+        Largest number of requests evaluated together.
+    batch_window : float, optional
+        Time (s) to wait for more requests to arrive before evaluating a batch.
+    """
+    service = PhotometryService(telescopes)
+    server = PhotometryServer(service, max_batch, batch_window)
+    print("Serving {} obsmodes on {}:{}".format(len(service.obsmodes), host, port))
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def add_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--telescope', action='append', dest='telescopes',
+                        choices=sorted(TELESCOPE_AREAS),
+                        help='telescope to load (may be repeated, default all)')
+    parser.add_argument('--max-batch', type=int, default=1024,
+                        help='largest number of requests evaluated together')
+    parser.add_argument('--batch-window', type=float, default=0.0005,
+                        help='time (s) to wait for a batch to fill')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.telescopes, args.max_batch, args.batch_window)
+
+
+if __name__ == "__main__":
+    main()
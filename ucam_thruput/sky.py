@@ -0,0 +1,283 @@
+"""
+Sky background count rates.
+
+The night sky is modelled as a dark-sky continuum plus scattered moonlight.
+The dark sky is interpolated between broad-band surface brightnesses typical
+of a good dark site (Benn & Ellison 1998, converted to AB). Moonlight follows
+Krisciunas & Schaefer (1991, PASP 103, 1033), with the spectrum of scattered
+sunlight approximated by a 5800K blackbody reddened or blued according to the
+balance of Mie and Rayleigh scattering at the given moon distance.
+
+Sky count rates per pixel are evaluated for every obsmode over a grid of
+lunar phase, moon distance and airmass at once, and the resulting lookup
+tables are cached in memory and in the user directory so that queries only
+need an interpolation.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import os
+
+import numpy as np
+
+from .bandpass import (DEFAULT_WAVESET, list_obsmodes, obsmode_area,
+                       obsmode_components, parse_obsmode, throughput_stack)
+from .components import component_digest
+from .photometry import ABZERO, H, countrate
+from .spectra import blackbody
+
+# dark sky AB magnitudes per square arcsecond at zenith, and their wavelengths
+DARK_SKY_WAVE = np.array([3650.0, 4450.0, 5510.0, 6580.0, 8060.0, 9000.0])
+DARK_SKY_MAG = np.array([22.79, 22.61, 21.92, 21.21, 20.45, 19.60])
+
+# V-band extinction coefficient (mag/airmass) used for moonlight
+EXTINCTION_V = 0.13
+
+# pixel scales (arcsec/pixel) of each instrument on each telescope
+PIXEL_SCALES = {
+    ('ucam', 'wht'): 0.30,
+    ('ucam', 'ntt'): 0.35,
+    ('ucam', 'vlt'): 0.15,
+    ('hcam', 'gtc'): 0.081,
+    ('hcam', 'wht'): 0.30,
+    ('uspec', 'tnt'): 0.45,
+    ('uspec', 'wht'): 0.20,
+}
+
+DEFAULT_PHASES = np.linspace(0, 1, 11)
+DEFAULT_DISTANCES = np.array([10.0, 20, 30, 45, 60, 90, 120, 150, 180])
+DEFAULT_AIRMASSES = np.array([1.0, 1.1, 1.2, 1.35, 1.5, 1.75, 2.0, 2.5, 3.0])
+
+_TABLE_CACHE = {}
+
+
+def pixel_scale(obsmode):
+    """
+    Pixel scale (arcsec/pixel) for an obsmode.
+    """
+    keywords = set(parse_obsmode(obsmode))
+    for (instrument, telescope), scale in PIXEL_SCALES.items():
+        if instrument in keywords and telescope in keywords:
+            return scale
+    raise ValueError("No pixel scale known for obsmode {}".format(obsmode))
+
+
+def _vmag_from_nanolamberts(brightness):
+    return (20.7233 - np.log(brightness / 34.08)) / 0.92104
+
+
+def _scattering_airmass(airmass):
+    # Krisciunas & Schaefer eq. 3, with zenith distance from a plane-parallel airmass
+    sin2z = 1 - 1 / np.asarray(airmass, dtype=np.float64)**2
+    return (1 - 0.96 * sin2z)**-0.5
+
+
+def sky_spectrum(phase, distance, airmass, moon_airmass=1.5, waveset=None):
+    """
+    Sky surface brightness spectra.
+
+    Parameters
+    ----------
+    phase : `~numpy.ndarray`
+        Illuminated fraction of the moon (0 for new, 1 for full).
+    distance : `~numpy.ndarray`
+        Angular distance between target and moon (degrees).
+    airmass : `~numpy.ndarray`
+        Airmass of the target.
+    moon_airmass : float, optional
+        Airmass of the moon.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    flux : `~numpy.ndarray`
+        PHOTLAM per square arcsecond, with shape given by broadcasting the
+        parameters against each other, plus a trailing wavelength axis.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    phase, distance, airmass = np.broadcast_arrays(
+        *(np.asarray(arr, dtype=np.float64) for arr in (phase, distance, airmass))
+    )
+    scatter_x = _scattering_airmass(airmass)
+
+    # dark sky brightens towards the horizon (K&S eq. 2)
+    dark_scale = scatter_x * 10**(-0.4 * EXTINCTION_V * (scatter_x - 1))
+    dark_mag = np.interp(waveset, DARK_SKY_WAVE, DARK_SKY_MAG)
+    dark = ABZERO * 10**(-0.4 * dark_mag) / (H * waveset)
+    flux = dark_scale[..., np.newaxis] * dark
+
+    # moonlight (K&S eqs. 15-21)
+    alpha = np.degrees(np.arccos(np.clip(2 * phase - 1, -1, 1)))
+    illuminance = 10**(-0.4 * (3.84 + 0.026 * alpha + 4e-9 * alpha**4))
+    rho = np.radians(distance)
+    rayleigh = 10**5.36 * (1.06 + np.cos(rho)**2)
+    mie = 10**(6.15 - distance / 40)
+    moon_x = _scattering_airmass(moon_airmass)
+    brightness = (
+        (rayleigh + mie) * illuminance * 10**(-0.4 * EXTINCTION_V * moon_x)
+        * (1 - 10**(-0.4 * EXTINCTION_V * scatter_x))
+    )
+    with np.errstate(divide='ignore'):
+        moon_vmag = _vmag_from_nanolamberts(brightness)
+
+    # scattered sunlight, with the Rayleigh part going as lambda**-4
+    sun = blackbody(5800.0, waveset)
+    sun = sun / np.interp(5500.0, waveset, sun)
+    colour = (rayleigh[..., np.newaxis] * (waveset / 5500.0)**-4 + mie[..., np.newaxis])
+    colour = colour / (rayleigh + mie)[..., np.newaxis]
+    moon_5500 = ABZERO * 10**(-0.4 * (moon_vmag + 0.02)) / (H * 5500.0)
+    flux += moon_5500[..., np.newaxis] * sun * colour
+    return flux
+
+
+class SkyTable:
+    """
+    Lookup table of sky count rates per pixel.
+
+    Parameters
+    ----------
+    obsmodes : list
+        Obsmodes in the table.
+    phases, distances, airmasses : `~numpy.ndarray`
+        Grid of moon illumination, moon distance (degrees) and target airmass.
+    counts : `~numpy.ndarray`
+        Sky count rates (counts/s/pixel) of shape
+        ``(n_obsmodes, n_phases, n_distances, n_airmasses)``.
+    """
+    def __init__(self, obsmodes, phases, distances, airmasses, counts):
+        self.obsmodes = list(obsmodes)
+        self.index = {obsmode: i for i, obsmode in enumerate(self.obsmodes)}
+        self.axes = tuple(np.asarray(ax, dtype=np.float64) for ax in (phases, distances, airmasses))
+        self.counts = counts
+
+    def __call__(self, obsmode, phase, distance, airmass):
+        """
+        Interpolate the sky count rate (counts/s/pixel) for an obsmode.
+
+        The conditions may be arrays, which are broadcast against each other.
+        Values beyond the edges of the grid are clipped to the grid.
+        """
+        try:
+            values = self.counts[self.index[obsmode]]
+        except KeyError:
+            raise ValueError("Obsmode {} is not in this sky table".format(obsmode))
+        points = np.broadcast_arrays(
+            *(np.asarray(p, dtype=np.float64) for p in (phase, distance, airmass))
+        )
+        lower, frac = [], []
+        for axis, p in zip(self.axes, points):
+            p = np.clip(p, axis[0], axis[-1])
+            i = np.clip(np.searchsorted(axis, p, side='right') - 1, 0, len(axis) - 2)
+            lower.append(i)
+            frac.append((p - axis[i]) / (axis[i + 1] - axis[i]))
+
+        # sum over the corners of the enclosing grid cell
+        result = 0.0
+        for corner in np.ndindex(*(2,) * len(self.axes)):
+            weight = 1.0
+            index = []
+            for offset, i, f in zip(corner, lower, frac):
+                weight = weight * (f if offset else 1 - f)
+                index.append(i + offset)
+            result = result + weight * values[tuple(index)]
+        return result
+
+    def save(self, filename):
+        np.savez(filename, obsmodes=np.array(self.obsmodes), phases=self.axes[0],
+                 distances=self.axes[1], airmasses=self.axes[2], counts=self.counts)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['obsmodes'].tolist(), data['phases'], data['distances'],
+                       data['airmasses'], data['counts'])
+
+
+def sky_counts(obsmodes, phases, distances, airmasses, moon_airmass=1.5, waveset=None):
+    """
+    Sky count rates per pixel for every obsmode over a grid of conditions.
+
+    The atmospheric transmission is not applied to the sky light, but every
+    other component of each obsmode is.
+
+    Returns
+    -------
+    counts : `~numpy.ndarray`
+        Count rates (counts/s/pixel) of shape
+        ``(n_obsmodes, n_phases, n_distances, n_airmasses)``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    distances = np.asarray(distances, dtype=np.float64)
+    airmasses = np.asarray(airmasses, dtype=np.float64)
+    thru = throughput_stack([obsmode + ',noatmos' for obsmode in obsmodes], waveset)
+    area = np.array([obsmode_area(obsmode) for obsmode in obsmodes])
+    pixel_area = np.array([pixel_scale(obsmode) for obsmode in obsmodes])**2
+
+    counts = np.empty((len(obsmodes), len(phases), len(distances), len(airmasses)))
+    # one phase at a time keeps the stack of sky spectra to a modest size
+    for i, phase in enumerate(phases):
+        sky = sky_spectrum(phase, distances[:, np.newaxis], airmasses[np.newaxis, :],
+                           moon_airmass, waveset)
+        rate = countrate(sky, thru, waveset, area * pixel_area)
+        counts[:, i] = np.moveaxis(rate, -1, 0)
+    return counts
+
+
+def sky_table(obsmodes=None, phases=None, distances=None, airmasses=None,
+              moon_airmass=1.5, cache=True):
+    """
+    A sky count rate lookup table, from the cache if possible.
+
+    Parameters
+    ----------
+    obsmodes : list, optional
+        Obsmodes to include. Defaults to every obsmode on every telescope.
+        A ValueError is raised if the pixel scale of any is not known.
+    phases, distances, airmasses : `~numpy.ndarray`, optional
+        Grid of moon illumination, moon distance (degrees) and target airmass.
+    moon_airmass : float, optional
+        Airmass of the moon.
+    cache : bool, optional
+        Read and write tables from the user directory.
+
+    Returns
+    -------
+    table : `SkyTable`
+    """
+    from . import _check_user_dir
+    if obsmodes is None:
+        obsmodes = list_obsmodes()
+    # fail before hashing components or building spectra
+    for obsmode in obsmodes:
+        pixel_scale(obsmode)
+    phases = DEFAULT_PHASES if phases is None else np.asarray(phases, dtype=np.float64)
+    distances = DEFAULT_DISTANCES if distances is None else np.asarray(distances, dtype=np.float64)
+    airmasses = DEFAULT_AIRMASSES if airmasses is None else np.asarray(airmasses, dtype=np.float64)
+
+    sha = hashlib.sha1()
+    sha.update(','.join(obsmodes).encode())
+    # saved versions of components change the table
+    for obsmode in obsmodes:
+        for name in obsmode_components(obsmode + ',noatmos'):
+            sha.update(component_digest(name).encode())
+    for arr in (phases, distances, airmasses, np.array([moon_airmass, EXTINCTION_V])):
+        sha.update(np.ascontiguousarray(arr).tobytes())
+    key = sha.hexdigest()
+
+    if key in _TABLE_CACHE:
+        return _TABLE_CACHE[key]
+    filename = os.path.join(_check_user_dir(), 'sky_{}.npz'.format(key[:16])) if cache else None
+    if filename is not None and os.path.exists(filename):
+        table = SkyTable.load(filename)
+    else:
+        counts = sky_counts(obsmodes, phases, distances, airmasses, moon_airmass)
+        table = SkyTable(obsmodes, phases, distances, airmasses, counts)
+        if filename is not None:
+            table.save(filename)
+    _TABLE_CACHE[key] = table
+    return table
@@ -0,0 +1,279 @@
+"""
+Simple source spectra sampled on a wavelength grid.
+
+All spectra are returned as photon flux densities (PHOTLAM) so they can be
+used directly with the functions in `ucam_thruput.photometry`. Analytic
+spectra are vectorised over their parameters.
+
+Spectra can also be described by short strings, which is convenient for
+catalogues and command line use (see `from_spec`).
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import collections
+import os
+
+import numpy as np
+
+from .bandpass import DEFAULT_WAVESET
+from .photometry import ABZERO, H, abmag
+
+# second radiation constant, hc/k (AA K)
+C2 = 1.438776877e8
+
+# Pickles (1998) main sequence templates, with effective temperatures
+PICKLES_MAIN_SEQUENCE = (
+    ('pickles_uk_1', 'O5V', 39810.7),
+    ('pickles_uk_2', 'O9V', 35481.4),
+    ('pickles_uk_3', 'B0V', 28183.8),
+    ('pickles_uk_4', 'B1V', 22387.2),
+    ('pickles_uk_5', 'B3V', 19054.6),
+    ('pickles_uk_6', 'B5-7V', 14125.4),
+    ('pickles_uk_7', 'B8V', 11749.0),
+    ('pickles_uk_9', 'A0V', 9549.93),
+    ('pickles_uk_10', 'A2V', 8912.51),
+    ('pickles_uk_11', 'A3V', 8790.23),
+    ('pickles_uk_12', 'A5V', 8491.80),
+    ('pickles_uk_14', 'F0V', 7211.08),
+    ('pickles_uk_15', 'F2V', 6776.42),
+    ('pickles_uk_16', 'F5V', 6531.31),
+    ('pickles_uk_20', 'F8V', 6039.48),
+    ('pickles_uk_23', 'G0V', 5807.64),
+    ('pickles_uk_26', 'G2V', 5636.38),
+    ('pickles_uk_27', 'G5V', 5584.70),
+    ('pickles_uk_30', 'G8V', 5333.35),
+    ('pickles_uk_31', 'K0V', 5188.00),
+    ('pickles_uk_33', 'K2V', 4886.52),
+    ('pickles_uk_36', 'K5V', 4187.94),
+    ('pickles_uk_37', 'K7V', 3999.45),
+    ('pickles_uk_38', 'M0V', 3801.89),
+    ('pickles_uk_40', 'M2V', 3548.13),
+    ('pickles_uk_43', 'M4V', 3111.72),
+    ('pickles_uk_44', 'M5V', 2951.21)
+)
+
+# (spec, waveset key) -> flux, least recently used first
+_SPEC_CACHE = collections.OrderedDict()
+_SPEC_CACHE_SIZE = 1024
+
+
+def blackbody(teff, waveset=None):
+    """
+    Blackbody spectra, with arbitrary normalisation.
+
+    Parameters
+    ----------
+    teff : float or `~numpy.ndarray`
+        Temperatures (K).
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    flux : `~numpy.ndarray`
+        PHOTLAM, of shape ``teff.shape + waveset.shape``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    teff = np.asarray(teff, dtype=np.float64)
+    x = C2 / np.multiply.outer(teff, waveset)
+    # photon number density goes as lambda**-4 / (exp(hc/lambda k T) - 1)
+    with np.errstate(over='ignore'):
+        return 1e16 / waveset**4 / np.expm1(x)
+
+
+def power_law(index, waveset=None):
+    """
+    Power law spectra F_nu ~ nu**index, normalised to AB=0 at 5500 Angstroms.
+
+    Parameters
+    ----------
+    index : float or `~numpy.ndarray`
+        Spectral indices. An index of 0 gives a flat (AB) spectrum.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+
+    Returns
+    -------
+    flux : `~numpy.ndarray`
+        PHOTLAM, of shape ``index.shape + waveset.shape``.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    index = np.asarray(index, dtype=np.float64)
+    fnu = ABZERO * (5500.0 / waveset)**index[..., np.newaxis]
+    return fnu / (H * waveset)
+
+
+def flat(waveset=None):
+    """
+    A flat spectrum in F_nu with an AB magnitude of zero.
+    """
+    return power_law(0.0, waveset)
+
+
+def from_file(filename, waveset=None, **kwargs):
+    """
+    Read a spectrum with `synphot.SourceSpectrum.from_file` and resample it.
+
+    Parameters
+    ----------
+    filename : string
+        FITS or ASCII spectrum, in any format understood by synphot.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    **kwargs
+        Passed to `synphot.SourceSpectrum.from_file`, e.g ``flux_col``.
+    """
+    import synphot as syn
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    sp = syn.SourceSpectrum.from_file(filename, **kwargs)
+    return sp(waveset).value
+
+
+def tabulated_file(filename, waveset=None, **kwargs):
+    """
+    Read a spectrum with `synphot.SourceSpectrum.from_file`, without resampling it.
+
+    Beyond its tabulated range synphot holds a spectrum at its end values,
+    so the end values are repeated at the ends of ``waveset`` to keep that
+    behaviour when the result is taken to be zero outside its range, as in
+    `ucam_thruput.photometry.tabulated_countrate`.
+
+    Parameters
+    ----------
+    filename : string
+        FITS or ASCII spectrum, in any format understood by synphot.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms) to cover. Defaults to `DEFAULT_WAVESET`.
+    **kwargs
+        Passed to `synphot.SourceSpectrum.from_file`, e.g ``flux_col``.
+
+    Returns
+    -------
+    wave, flux : `~numpy.ndarray`
+        Ascending wavelengths (Angstroms) and flux (PHOTLAM).
+    """
+    import synphot as syn
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    sp = syn.SourceSpectrum.from_file(filename, **kwargs)
+    wave = sp.waveset.value
+    flux = sp(wave).value
+    if waveset[0] < wave[0]:
+        wave, flux = np.r_[waveset[0], wave], np.r_[flux[0], flux]
+    if waveset[-1] > wave[-1]:
+        wave, flux = np.r_[wave, waveset[-1]], np.r_[flux, flux[-1]]
+    return wave, flux
+
+
+def pickles(sptype, waveset=None):
+    """
+    A Pickles main sequence template, read from the CDBS atlas.
+
+    Parameters
+    ----------
+    sptype : string
+        Spectral type. Types other than those in `PICKLES_MAIN_SEQUENCE` are
+        looked up in `ucam_thruput.atlas.atlas_index`.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    """
+    names = {spt: name for name, spt, _ in PICKLES_MAIN_SEQUENCE}
+    if sptype not in names:
+        # other types are found from the atlas index
+        from .atlas import atlas_index
+        index = atlas_index()
+        rows = index.query(atlas='pickles', sptype=sptype)
+        if not len(rows):
+            raise ValueError("No Pickles template for spectral type {}".format(sptype))
+        return index.flux(rows[0], waveset)
+    pysyn_cdbs = os.getenv("PYSYN_CDBS")
+    if pysyn_cdbs is None:
+        raise ValueError("PYSYN_CDBS environment variable is not set")
+    path = os.path.join(pysyn_cdbs, 'grid', 'pickles', 'dat_uvk', names[sptype] + '.fits')
+    return from_file(path, waveset)
+
+
+def from_spec(spec, waveset=None):
+    """
+    A spectrum from a short string description.
+
+    Recognised descriptions are
+
+    * ``flat`` - flat in F_nu (AB magnitude zero)
+    * ``bb:<teff>`` - a blackbody of temperature teff (K)
+    * ``pl:<index>`` - a power law F_nu ~ nu**index
+    * ``pickles:<sptype>`` - a Pickles main sequence template, e.g ``pickles:G2V``
+    * ``atlas:<atlas>:<teff>[,<logg>[,<feh>]]`` - the nearest entry in a CDBS
+      atlas, e.g ``atlas:ck04models:5750,4.5,0.0``
+    * ``file:<path>`` - any spectrum file readable by synphot
+
+    Spectra are cached, so repeated descriptions are cheap.
+
+    Parameters
+    ----------
+    spec : string
+        Description of the spectrum.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    """
+    from .bandpass import waveset_key
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    key = (spec, waveset_key(waveset))
+    flux = _SPEC_CACHE.get(key)
+    if flux is not None:
+        _SPEC_CACHE.move_to_end(key)
+        return flux
+
+    kind, _, value = spec.partition(':')
+    if kind == 'flat':
+        flux = flat(waveset)
+    elif kind == 'bb':
+        flux = blackbody(float(value), waveset)
+    elif kind == 'pl':
+        flux = power_law(float(value), waveset)
+    elif kind == 'pickles':
+        flux = pickles(value, waveset)
+    elif kind == 'atlas':
+        from .atlas import atlas_index
+        atlas, _, params = value.partition(':')
+        params = [float(param) for param in params.split(',')]
+        index = atlas_index()
+        flux = index.flux(index.nearest(atlas, *params), waveset)
+    elif kind == 'file':
+        flux = from_file(value, waveset)
+    else:
+        raise ValueError("Unknown spectrum description {}".format(spec))
+    flux.flags.writeable = False
+    _SPEC_CACHE[key] = flux
+    if len(_SPEC_CACHE) > _SPEC_CACHE_SIZE:
+        _SPEC_CACHE.popitem(last=False)
+    return flux
+
+
+def normalise(flux, mag, thru, waveset=None):
+    """
+    Scale spectra to a given AB magnitude through a bandpass.
+
+    Parameters
+    ----------
+    flux : `~numpy.ndarray`
+        Spectra (PHOTLAM), with wavelength along the last axis.
+    mag : float or `~numpy.ndarray`
+        AB magnitudes, broadcastable against ``flux.shape[:-1]``.
+    thru : `~numpy.ndarray`
+        Throughput of a single bandpass, or one throughput per spectrum.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    """
+    if waveset is None:
+        waveset = DEFAULT_WAVESET
+    flux = np.asarray(flux, dtype=np.float64)
+    mag0 = abmag(flux, thru, waveset, paired=True)
+    scale = 10**(-0.4 * (np.asarray(mag) - mag0))
+    return flux * scale[..., np.newaxis]
@@ -0,0 +1,273 @@
+"""
+Chunked on-disk storage for the results of large photometry sweeps.
+
+A store is a directory holding a ``meta.json`` file, which records the
+spectra, obsmodes and conditions the results are for, and one ``.npy``
+file per field per chunk of spectra. Each chunk holds an array of shape
+(spectra in chunk, n_obsmodes, n_conditions).
+
+Chunk files are written to a temporary name and renamed into place, so a
+chunk either exists completely or not at all. An interrupted sweep can
+therefore be resumed by computing only the chunks that are missing, and
+results can be read back lazily, a chunk at a time, with memory mapping.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import os
+
+import numpy as np
+
+META_NAME = "meta.json"
+DEFAULT_FIELDS = ('countrate', 'abmag')
+
+
+def _write_json(filename, data):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(filename + '.tmp', filename)
+
+
+class ResultStore:
+    """
+    Results for every spectrum x obsmode x condition, stored in chunks of spectra.
+
+    Use `ResultStore.create` to make a new store, or `ResultStore.open` to
+    open an existing one.
+
+    Parameters
+    ----------
+    directory : string
+        Directory holding the store.
+    meta : dict
+        Contents of the store's ``meta.json``.
+    """
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.spectra = list(meta['spectra'])
+        self.obsmodes = list(meta['obsmodes'])
+        self.conditions = list(meta['conditions'])
+        self.fields = tuple(meta['fields'])
+        self.chunk_size = int(meta['chunk_size'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.attrs = dict(meta.get('attrs', {}))
+        # label -> positions along each axis; spectra may repeat, e.g in catalogues
+        self.spectrum_index = self._index(self.spectra)
+        self.obsmode_index = self._index(self.obsmodes)
+        self.condition_index = self._index(self.conditions)
+
+    @staticmethod
+    def _index(labels):
+        index = {}
+        for i, label in enumerate(labels):
+            index.setdefault(label, []).append(i)
+        return index
+
+    @property
+    def meta(self):
+        return dict(
+            spectra=self.spectra, obsmodes=self.obsmodes, conditions=self.conditions,
+            fields=list(self.fields), chunk_size=self.chunk_size, dtype=self.dtype.str,
+            attrs=self.attrs
+        )
+
+    @classmethod
+    def create(cls, directory, spectra, obsmodes, conditions=('',), fields=DEFAULT_FIELDS,
+               chunk_size=1024, dtype=np.float64, attrs=None, overwrite=False):
+        """
+        Create a store, or open it to resume if it already exists with the same layout.
+
+        Parameters
+        ----------
+        directory : string
+            Directory to hold the store.
+        spectra, obsmodes, conditions : sequence
+            Labels (strings) for each axis of the results. Spectra may
+            repeat, but obsmodes and conditions must not.
+        fields : sequence, optional
+            Names of the quantities stored.
+        chunk_size : int, optional
+            Number of spectra in each chunk.
+        dtype : `~numpy.dtype`, optional
+            Data type of the results.
+        attrs : dict, optional
+            Extra JSON serialisable information to keep with the results.
+        overwrite : bool, optional
+            Remove any existing results if the layout differs, rather than
+            raising an error.
+        """
+        store = cls(directory, dict(
+            spectra=[str(spec) for spec in spectra], obsmodes=[str(mode) for mode in obsmodes],
+            conditions=[str(condition) for condition in conditions], fields=list(fields),
+            chunk_size=chunk_size, dtype=np.dtype(dtype).str, attrs=attrs or {}
+        ))
+        for axis, labels in (('obsmodes', store.obsmodes), ('conditions', store.conditions)):
+            if len(set(labels)) != len(labels):
+                raise ValueError("{} of a result store must not repeat".format(axis))
+        meta_file = os.path.join(directory, META_NAME)
+        if os.path.exists(meta_file):
+            existing = cls.open(directory)
+            if existing.meta == store.meta:
+                return existing
+            if not overwrite:
+                raise ValueError(
+                    "A different result store already exists in {}".format(directory)
+                )
+            existing.clear()
+        elif not os.path.exists(directory):
+            os.makedirs(directory)
+        _write_json(meta_file, store.meta)
+        return store
+
+    @classmethod
+    def open(cls, directory):
+        """
+        Open an existing store.
+        """
+        meta_file = os.path.join(directory, META_NAME)
+        if not os.path.exists(meta_file):
+            raise ValueError("No result store in {}".format(directory))
+        with open(meta_file) as f:
+            return cls(directory, json.load(f))
+
+    @property
+    def shape(self):
+        return (len(self.spectra), len(self.obsmodes), len(self.conditions))
+
+    @property
+    def n_chunks(self):
+        return -(-len(self.spectra) // self.chunk_size)
+
+    def chunk_slice(self, chunk):
+        """
+        The spectra in a chunk, as a slice.
+        """
+        if not 0 <= chunk < self.n_chunks:
+            raise ValueError("No chunk {} in a store of {} chunks".format(chunk, self.n_chunks))
+        start = chunk * self.chunk_size
+        return slice(start, min(start + self.chunk_size, len(self.spectra)))
+
+    def _filename(self, field, chunk):
+        return os.path.join(self.directory, '{}_{:06d}.npy'.format(field, chunk))
+
+    def is_complete(self, chunk):
+        return all(os.path.exists(self._filename(field, chunk)) for field in self.fields)
+
+    def completed(self):
+        """
+        Indices of the chunks which have been written.
+        """
+        return [chunk for chunk in range(self.n_chunks) if self.is_complete(chunk)]
+
+    def pending(self):
+        """
+        Indices of the chunks still to be written.
+        """
+        return [chunk for chunk in range(self.n_chunks) if not self.is_complete(chunk)]
+
+    def write_chunk(self, chunk, **results):
+        """
+        Save the results for a chunk.
+
+        Parameters
+        ----------
+        chunk : int
+            Index of the chunk.
+        **results : `~numpy.ndarray`
+            An array for every field, of shape
+            (spectra in chunk, n_obsmodes, n_conditions).
+        """
+        rows = self.chunk_slice(chunk)
+        shape = (rows.stop - rows.start,) + self.shape[1:]
+        if set(results) != set(self.fields):
+            raise ValueError("Results must be given for fields {}".format(list(self.fields)))
+        for field in self.fields:
+            if np.shape(results[field]) != shape:
+                raise ValueError("{} must have shape {}, not {}".format(
+                    field, shape, np.shape(results[field])
+                ))
+        for field in self.fields:
+            filename = self._filename(field, chunk)
+            with open(filename + '.tmp', 'wb') as f:
+                np.save(f, np.asarray(results[field], dtype=self.dtype))
+            os.replace(filename + '.tmp', filename)
+
+    def read_chunk(self, field, chunk):
+        """
+        Memory-mapped results of a chunk, or None if it has not been written.
+        """
+        if field not in self.fields:
+            raise ValueError("No field {} in this store".format(field))
+        filename = self._filename(field, chunk)
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    def iter_chunks(self, field):
+        """
+        Iterate over the written chunks of a field.
+
+        Yields
+        ------
+        rows : slice
+            The spectra in the chunk.
+        values : `~numpy.ndarray`
+            Memory-mapped results for the chunk.
+        """
+        for chunk in range(self.n_chunks):
+            values = self.read_chunk(field, chunk)
+            if values is not None:
+                yield self.chunk_slice(chunk), values
+
+    def read(self, field, spectra=None, obsmodes=None, conditions=None):
+        """
+        Read results, loading only the chunks needed.
+
+        Parameters
+        ----------
+        field : string
+            Quantity to read.
+        spectra, obsmodes, conditions : sequence, optional
+            Labels to select along each axis. By default, everything is read.
+            A spectrum label selects every spectrum with that label.
+
+        Returns
+        -------
+        values : `~numpy.ndarray`
+            Results of shape (n_spectra, n_obsmodes, n_conditions). Results
+            for chunks which have not been written are NaN.
+        """
+        rows = self._select(self.spectrum_index, spectra, self.shape[0])
+        cols = self._select(self.obsmode_index, obsmodes, self.shape[1])
+        conds = self._select(self.condition_index, conditions, self.shape[2])
+        values = np.full((len(rows), len(cols), len(conds)), np.nan, dtype=self.dtype)
+        chunks = rows // self.chunk_size
+        for chunk in np.unique(chunks):
+            data = self.read_chunk(field, chunk)
+            if data is None:
+                continue
+            wanted = chunks == chunk
+            local = rows[wanted] - chunk * self.chunk_size
+            values[wanted] = data[local][:, cols][:, :, conds]
+        return values
+
+    @staticmethod
+    def _select(index, labels, size):
+        if labels is None:
+            return np.arange(size)
+        try:
+            return np.array([i for label in labels for i in index[label]], dtype=int)
+        except KeyError as err:
+            raise ValueError("{} is not in this store".format(err))
+
+    def clear(self):
+        """
+        Remove every chunk written so far.
+        """
+        for chunk in range(self.n_chunks):
+            for field in self.fields:
+                filename = self._filename(field, chunk)
+                if os.path.exists(filename):
+                    os.remove(filename)
@@ -0,0 +1,319 @@
+"""
+Splitting photometry sweeps across machines with a file-based work queue.
+
+A sweep of spectra x obsmodes x conditions is planned into a queue
+directory on a shared filesystem. The spectra are split into shards of
+fixed size, and each shard is described by its own JSON file, so the plan
+is deterministic: planning the same sweep again gives the same shards.
+
+Workers on any machine that can see the directory take shards by creating
+a claim file with ``O_CREAT | O_EXCL``, which succeeds for exactly one
+worker. Results are written to a temporary file and renamed into place,
+so a shard's results either exist completely or not at all. Claims older
+than a timeout are taken to belong to workers that have died, and are
+broken so the shard can be claimed again. At worst a shard is computed
+twice, which is harmless as the results are identical.
+
+Nothing is needed beyond a POSIX filesystem: no scheduler, broker or
+database. Once all the shards are done, `merge_results` assembles them
+into a `ucam_thruput.store.ResultStore`.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import json
+import os
+import socket
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .bandpass import list_obsmodes
+from .batch import evaluate_grid
+from .store import ResultStore
+
+PLAN_NAME = "plan.json"
+DEFAULT_STALE_TIMEOUT = 3600.0
+
+QueueStatus = namedtuple("QueueStatus", ['n_shards', 'done', 'claimed', 'pending'])
+
+
+def _write_json(filename, data):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def _read_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def _shard_name(shard):
+    return 'shard_{:06d}'.format(shard)
+
+
+def _paths(queue_dir, shard):
+    name = _shard_name(shard)
+    return dict(
+        shard=os.path.join(queue_dir, 'shards', name + '.json'),
+        claim=os.path.join(queue_dir, 'claims', name + '.claim'),
+        result=os.path.join(queue_dir, 'results', name + '.npz'),
+    )
+
+
+def plan_sweep(queue_dir, specs, obsmodes=None, telescopes=None, conditions=('',),
+               mags=None, norm_obsmode=None, shard_size=1000):
+    """
+    Write the shards of a sweep to a queue directory.
+
+    Planning an identical sweep into an existing queue leaves it as it is,
+    so that finished shards are kept.
+
+    Parameters
+    ----------
+    queue_dir : string
+        Queue directory, on a filesystem shared by all the workers.
+    specs : sequence
+        Spectrum descriptions, see `ucam_thruput.spectra.from_spec`.
+    obsmodes : sequence, optional
+        Obsmodes to evaluate. Defaults to every obsmode on ``telescopes``.
+    telescopes : sequence, optional
+        Telescopes for the default obsmodes. Defaults to every telescope in
+        ``TELESCOPE_AREAS``.
+    conditions : sequence, optional
+        Extra obsmode keywords for each observing condition.
+    mags : sequence, optional
+        AB magnitude of each spectrum in ``norm_obsmode``.
+    norm_obsmode : string, optional
+        Obsmode in which ``mags`` are measured.
+    shard_size : int, optional
+        Number of spectra in each shard.
+
+    Returns
+    -------
+    n_shards : int
+        Number of shards in the queue.
+    """
+    from . import TELESCOPE_AREAS
+    if obsmodes is None:
+        telescopes = sorted(TELESCOPE_AREAS) if telescopes is None else telescopes
+        obsmodes = [obsmode for tel in telescopes for obsmode in list_obsmodes(tel)]
+    if mags is not None:
+        mags = np.asarray(mags, dtype=np.float64)
+        if len(mags) != len(specs):
+            raise ValueError("need one magnitude per spectrum")
+    n_shards = -(-len(specs) // shard_size)
+    plan = dict(
+        n_spectra=len(specs), shard_size=shard_size, n_shards=n_shards,
+        obsmodes=[str(obsmode) for obsmode in obsmodes],
+        conditions=[str(condition) for condition in conditions],
+        norm_obsmode=norm_obsmode, have_mags=mags is not None
+    )
+
+    plan_file = os.path.join(queue_dir, PLAN_NAME)
+    if os.path.exists(plan_file):
+        if _read_json(plan_file) != plan:
+            raise ValueError("A different sweep is already planned in {}".format(queue_dir))
+    else:
+        for subdir in ('shards', 'claims', 'results'):
+            os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+    for shard in range(n_shards):
+        rows = slice(shard * shard_size, min((shard + 1) * shard_size, len(specs)))
+        description = dict(
+            shard=shard, start=rows.start, stop=rows.stop,
+            specs=[str(spec) for spec in specs[rows]],
+            # missing magnitudes are NaN, which JSON cannot hold
+            mags=None if mags is None else [
+                None if np.isnan(mag) else float(mag) for mag in mags[rows]
+            ]
+        )
+        filename = _paths(queue_dir, shard)['shard']
+        if not os.path.exists(filename):
+            _write_json(filename, description)
+        elif _read_json(filename) != description:
+            raise ValueError("A different sweep is already planned in {}".format(queue_dir))
+    # the plan is written last, so workers never see a partly written queue
+    _write_json(plan_file, plan)
+    return n_shards
+
+
+def read_plan(queue_dir):
+    """
+    The description of the sweep planned in a queue.
+    """
+    plan_file = os.path.join(queue_dir, PLAN_NAME)
+    if not os.path.exists(plan_file):
+        raise ValueError("No sweep planned in {}".format(queue_dir))
+    return _read_json(plan_file)
+
+
+def _worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _claim(filename, worker, stale_timeout):
+    """
+    Try to claim a shard. Returns True if the claim was made.
+    """
+    for _ in range(2):
+        try:
+            fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(filename)
+            except FileNotFoundError:
+                continue
+            if age < stale_timeout:
+                return False
+            # break the stale claim; only one worker's rename can succeed
+            stale = '{}.stale.{}'.format(filename, worker.replace(':', '_'))
+            try:
+                os.rename(filename, stale)
+            except FileNotFoundError:
+                return False
+            if time.time() - os.path.getmtime(stale) < stale_timeout:
+                # another worker claimed the shard in the meantime, so put it back
+                try:
+                    os.link(stale, filename)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            continue
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(worker=worker, time=time.time()), f)
+        return True
+    return False
+
+
+def run_shard(queue_dir, shard, plan=None, waveset=None, block_size=256):
+    """
+    Compute and save the results for one shard, whether or not it is claimed.
+    """
+    if plan is None:
+        plan = read_plan(queue_dir)
+    paths = _paths(queue_dir, shard)
+    description = _read_json(paths['shard'])
+    mags = description['mags']
+    if mags is not None:
+        mags = np.array([np.nan if mag is None else mag for mag in mags])
+    countrate, abmag = evaluate_grid(
+        description['specs'], plan['obsmodes'], plan['conditions'],
+        mags, plan['norm_obsmode'], waveset, block_size
+    )
+    # workers write to their own temporary file, in case two compute the same shard
+    tmp = '{}.{}.tmp.npz'.format(paths['result'][:-4], _worker_id().replace(':', '_'))
+    np.savez(tmp, countrate=countrate, abmag=abmag)
+    os.replace(tmp, paths['result'])
+
+
+def run_worker(queue_dir, stale_timeout=DEFAULT_STALE_TIMEOUT, max_shards=None,
+               waveset=None, block_size=256, verbose=False):
+    """
+    Work through the shards of a queue until none are left to claim.
+
+    Several workers, on the same or different machines, can run against
+    the same queue at once.
+
+    Parameters
+    ----------
+    queue_dir : string
+        Queue directory.
+    stale_timeout : float, optional
+        Age (s) after which a claim on an unfinished shard is broken. This
+        should be longer than a shard takes to compute.
+    max_shards : int, optional
+        Stop after this many shards.
+    waveset : `~numpy.ndarray`, optional
+        Wavelengths (Angstroms). Defaults to `DEFAULT_WAVESET`.
+    block_size : int, optional
+        Number of spectra held in memory at once.
+    verbose : bool, optional
+        Report each shard as it is finished.
+
+    Returns
+    -------
+    shards : list
+        The shards this worker computed.
+    """
+    plan = read_plan(queue_dir)
+    worker = _worker_id()
+    done = []
+    for shard in range(plan['n_shards']):
+        if max_shards is not None and len(done) >= max_shards:
+            break
+        paths = _paths(queue_dir, shard)
+        if os.path.exists(paths['result']):
+            continue
+        if not _claim(paths['claim'], worker, stale_timeout):
+            continue
+        # the shard may have been finished between the check and the claim
+        if not os.path.exists(paths['result']):
+            run_shard(queue_dir, shard, plan, waveset, block_size)
+            done.append(shard)
+            if verbose:
+                print("{} finished {}".format(worker, _shard_name(shard)))
+        try:
+            os.remove(paths['claim'])
+        except FileNotFoundError:
+            # the claim was broken as stale by another worker
+            pass
+    return done
+
+
+def queue_status(queue_dir):
+    """
+    Numbers of shards done, claimed and waiting.
+
+    Returns
+    -------
+    status : `QueueStatus`
+    """
+    plan = read_plan(queue_dir)
+    done = claimed = 0
+    for shard in range(plan['n_shards']):
+        paths = _paths(queue_dir, shard)
+        if os.path.exists(paths['result']):
+            done += 1
+        elif os.path.exists(paths['claim']):
+            claimed += 1
+    return QueueStatus(plan['n_shards'], done, claimed, plan['n_shards'] - done - claimed)
+
+
+def merge_results(queue_dir, directory):
+    """
+    Assemble the results of finished shards into a result store.
+
+    Shards which have not finished are left out, and can be merged later.
+
+    Parameters
+    ----------
+    queue_dir : string
+        Queue directory.
+    directory : string
+        Directory for the `~ucam_thruput.store.ResultStore`. There is one
+        chunk of the store for each shard.
+
+    Returns
+    -------
+    store : `~ucam_thruput.store.ResultStore`
+    """
+    plan = read_plan(queue_dir)
+    specs = []
+    for shard in range(plan['n_shards']):
+        specs.extend(_read_json(_paths(queue_dir, shard)['shard'])['specs'])
+    store = ResultStore.create(
+        directory, specs, plan['obsmodes'], plan['conditions'],
+        chunk_size=plan['shard_size'], attrs=dict(norm_obsmode=plan['norm_obsmode'])
+    )
+    for shard in store.pending():
+        result = _paths(queue_dir, shard)['result']
+        if os.path.exists(result):
+            with np.load(result) as data:
+                store.write_chunk(shard, countrate=data['countrate'], abmag=data['abmag'])
+    return store